@@ -0,0 +1,9 @@
+import os
+import sys
+# make the src package importable when run with python -m rsc_ca_plotting
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from src.frontend.cli import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,9 +3,13 @@ from PyQt5.QtCore import pyqtSlot as Slot
 from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QColorDialog
 from PyQt5.QtGui import QFont
 from src.workutils.handle_dirs import can_create_directory
-from src.workutils.TaskManager import TaskManager
+from src.workutils.TaskManager import TaskManager, TaskResult, FIGURE_RESOURCE
+from src.workutils.cancellation import CancellationToken
 from src.plotting.timeseries_plot import TimeSeriesPlots
 from src.plotting.longitudinal_plot import LongitudinalPlot
+from src.workutils.figure_output import FigureOutput
+from src.plotting.cell_selection import CellSelection
+from src.plotting.tuning_metrics import METRIC_NAMES, P_VALUE_METRICS
 from src.frontend.BarrierDialog import BarrierDialog
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as PlotCanvas 
 from colour import Color
@@ -42,6 +46,7 @@ class MainUI(QMainWindow):
         self.heatmap_checkbox.stateChanged.connect(self.set_heatmap_plot)
         self.hd_curve_checkbox.stateChanged.connect(self.set_hd_curve_plot)
         self.plot_it_button.clicked.connect(self.on_plot_click)
+        self.stop_button.clicked.connect(self.on_stop_click)
         self.trajectory_color_select_button.clicked.connect(self.show_color_dialog_trajectory)
         self.hd_color_select_button.clicked.connect(self.show_color_dialog_hd_color)
 
@@ -57,7 +62,16 @@ class MainUI(QMainWindow):
         self.output_folder_named = False
         self.single_day_selected = False
         self.multi_day_selected = False
-        self.running = False
+        # a timeseries and a longitudinal job can run at the same time, but only one of each
+        self.timeseries_running = False
+        self.longitudinal_running = False
+        # id of the last task of the running timeseries / longitudinal job -> the job is done when it finishes
+        self.timeseries_task = None
+        self.longitudinal_task = None
+        # stops the running timeseries / longitudinal job between cells and sessions
+        self.timeseries_cancel_token = CancellationToken()
+        self.longitudinal_cancel_token = CancellationToken()
+        self.task_manager.task_finished.connect(self.on_task_finished)
         self.barrier_dialog_closed = False
 
         self.plot_dict = {'spike_plot': False, 'ebc_boundary': False,
@@ -73,6 +87,11 @@ class MainUI(QMainWindow):
         self.output_folder_name = self.output_folder_name_line_edit.text()
         self.hd_color_line_edit.setText('red')
         self.hd_line_color = self.hd_color_line_edit.text()
+        self.multipage_pdf_checkbox.stateChanged.connect(self.on_multipage_pdf_check)
+        # cells are selected by a tuning metric only when one is chosen
+        self.cells_line_edit.setPlaceholderText('C000, C012')
+        self.selection_metric_combobox.addItems([''] + METRIC_NAMES + P_VALUE_METRICS)
+        self.selection_metric_combobox.view().setMinimumWidth(260)
 
 
     def check_color(self, color):
@@ -118,13 +137,46 @@ class MainUI(QMainWindow):
                 self.show_error_message('Head direction curve line color is not valid.')
                 return
         return self.plot_attributes
+
+    # format, DPI and thumbnails of the figures saved
+    def get_figure_output(self):
+        thumbnail_dpi = 72 if self.thumbnails_checkbox.isChecked() else None
+        return FigureOutput(self.figure_format_combobox.currentText(), self.figure_dpi_spinbox.value(),
+                            thumbnail_dpi, self.multipage_pdf_checkbox.isChecked())
+
+    # tuning metrics of every cell are saved as a csv table next to the figures when the box is checked -> None saves no table
+    def get_metrics_format(self):
+        return 'csv' if self.save_metrics_checkbox.isChecked() else None
+
+    # cells to plot from the cell selection widgets -> None plots every cell
+    # cells are typed as names separated by commas (ex. C000, C012)
+    def get_cell_selection(self):
+        cells = [cell.strip() for cell in self.cells_line_edit.text().split(',') if len(cell.strip()) > 0]
+        metric = self.selection_metric_combobox.currentText()
+        if ((len(cells) == 0) & (self.min_events_spinbox.value() == 0) & (self.min_rate_spinbox.value() == 0) &
+            (len(metric) == 0)):
+            return None
+        return CellSelection(cells if len(cells) > 0 else None, self.min_events_spinbox.value(), self.min_rate_spinbox.value(),
+                             metric if len(metric) > 0 else None, self.metric_threshold_spinbox.value(),
+                             self.all_sessions_checkbox.isChecked())
+
+    # all figures in one file can only be saved as a pdf
+    def on_multipage_pdf_check(self, state):
+        if (state == 2):
+            self.figure_format_combobox.setCurrentText('pdf')
+            self.figure_format_combobox.setEnabled(False)
+        else:
+            self.figure_format_combobox.setEnabled(True)
     
     def create_timeseries_plots(self):
         try:
             plots_to_make = self.get_plot_args()
             plot_attributes = self.get_plot_kwargs(*plots_to_make)
+            figure_output = self.get_figure_output()
+            cell_selection = self.get_cell_selection()
+            metrics_format = self.get_metrics_format()
             
-            if (len(plots_to_make) > 0 & (not self.running)):
+            if ((len(plots_to_make) > 0) & (not self.timeseries_running)):
                 if self.calcium_dir_selected & self.dlc_dir_selected & self.output_path_selected:
                     self.timeseries_plots = TimeSeriesPlots(self.calcium_input_dir, 
                                                             self.dlc_input_dir,
@@ -149,15 +201,24 @@ class MainUI(QMainWindow):
                     self.timeseries_plots.signals.cell_plotted.connect(self.cell_name_emitted)
                     self.timeseries_plots.signals.figure_closed.connect(self.close_plotted_figure)
                     output_folder = self.output_folder_name_line_edit.text()
-                    self.task_manager.tasks_completed.connect(self.timeseries_plots_completed)
-                    self.task_manager.add_task('plot_figures', output_folder, *plots_to_make, **plot_attributes)
+                    self.timeseries_cancel_token = CancellationToken()
+                    # sessions are prepared while other jobs render, figures are drawn once no other job is drawing
+                    prepare_task = self.task_manager.add_task('prepare_figures', output_folder, *plots_to_make,
+                                                              figure_output=figure_output, metrics_format=metrics_format,
+                                                              cell_selection=cell_selection,
+                                                              cancel_token=self.timeseries_cancel_token, **plot_attributes)
+                    self.timeseries_task = self.task_manager.add_graph_task('render_prepared_figures',
+                                                                            (TaskResult(prepare_task),) + plots_to_make,
+                                                                            dict(plot_attributes,
+                                                                                 cancel_token=self.timeseries_cancel_token),
+                                                                            resource=FIGURE_RESOURCE)
+                    self.timeseries_running = True
                     self.task_manager.start_tasks()
                     self.show_complete_dialog('Plotting begun!')
-                    self.running = True
                     return
             elif not self.calcium_dir_selected:
                 self.show_error_message('Calcium file directory has not been selected.')
-            elif self.running:
+            elif self.timeseries_running:
                 self.show_error_message('Process still running.')
         except Exception as e:
             self.show_error_message(f"ERROR: {e}")
@@ -167,8 +228,11 @@ class MainUI(QMainWindow):
         try:
             plots_to_make = self.get_plot_args()
             plot_attributes = self.get_plot_kwargs(*plots_to_make)
+            figure_output = self.get_figure_output()
+            cell_selection = self.get_cell_selection()
+            metrics_format = self.get_metrics_format()
             
-            if (len(plots_to_make) == 1 & (not self.running)):
+            if ((len(plots_to_make) == 1) & (not self.longitudinal_running)):
                 self.longitudinal_plots = LongitudinalPlot(self.calcium_input_dir, 
                                                         self.dlc_input_dir,
                                                         self.output_path_line_edit.text(),
@@ -191,15 +255,25 @@ class MainUI(QMainWindow):
                 self.longitudinal_plots.signals.cell_plotted.connect(self.cell_name_emitted)
                 self.longitudinal_plots.signals.figure_closed.connect(self.close_plotted_figure)
                 output_folder = self.output_folder_name_line_edit.text()
-                self.task_manager.tasks_completed.connect(self.longitudinal_plots_completed)
-                self.task_manager.add_task('plot_LR_figures', output_folder, *plots_to_make, **plot_attributes)
+                self.longitudinal_cancel_token = CancellationToken()
+                prepare_task = self.task_manager.add_task('prepare_LR_figures', output_folder, *plots_to_make,
+                                                          figure_output=figure_output, metrics_format=metrics_format,
+                                                          cell_selection=cell_selection,
+                                                          cancel_token=self.longitudinal_cancel_token, **plot_attributes)
+                self.longitudinal_task = self.task_manager.add_graph_task('render_prepared_LR_figures',
+                                                                          (TaskResult(prepare_task),) + plots_to_make,
+                                                                          dict(plot_attributes,
+                                                                               cancel_token=self.longitudinal_cancel_token),
+                                                                          resource=FIGURE_RESOURCE)
+                self.longitudinal_running = True
                 self.task_manager.start_tasks()
                 self.show_complete_dialog('Plotting begun!')
-                self.running = True
                 return
             elif len(plots_to_make) > 1:
                 self.show_error_message('ERROR: Longitudinal plots cannot be created with more than 1 plot type.')
                 return
+            elif self.longitudinal_running:
+                self.show_error_message('Process still running.')
         except Exception as e:
             self.show_error_message(f"ERROR: {e}")
             traceback.print_exc()
@@ -362,27 +436,42 @@ class MainUI(QMainWindow):
     def cell_name_emitted(self, cell_name):
         self.cell_name_plotted_label.setText(f"Cell: {cell_name}")
 
+    # stop the running jobs -> they stop after the cell or session they are on, figures already made are kept
+    def on_stop_click(self):
+        if self.timeseries_running or self.longitudinal_running:
+            self.task_manager.quit_tasks()
+        else:
+            self.show_error_message('No plots are being made.')
+
+    # a job is done when its last task finishes (or is skipped because a task before it failed)
+    @Slot(str)
+    def on_task_finished(self, task_id):
+        if task_id == self.timeseries_task:
+            self.timeseries_plots_completed()
+        elif task_id == self.longitudinal_task:
+            self.longitudinal_plots_completed()
+
     @Slot()
     def timeseries_plots_completed(self):
         try:
-            self.running = False
-            self.task_manager.tasks_completed.disconnect(self.timeseries_plots_completed)
+            self.timeseries_running = False
+            self.timeseries_task = None
             self.timeseries_plots.signals.figure_plotted.disconnect(self.show_plotted_figure)
             self.timeseries_plots.signals.figure_closed.disconnect(self.close_plotted_figure)
             self.timeseries_plots.signals.cell_plotted.disconnect(self.cell_name_emitted)
-            self.show_complete_dialog('Plotting finished!')
+            self.show_complete_dialog('Plotting stopped.' if self.timeseries_cancel_token.is_cancelled() else 'Plotting finished!')
         except Exception as e:
             self.show_error_message(f"ERROR:{e}")
 
     @Slot()
     def longitudinal_plots_completed(self):
         try:
-            self.running = False
-            self.task_manager.tasks_completed.disconnect(self.longitudinal_plots_completed)
+            self.longitudinal_running = False
+            self.longitudinal_task = None
             self.longitudinal_plots.signals.figure_plotted.disconnect(self.show_plotted_figure)
             self.longitudinal_plots.signals.cell_plotted.disconnect(self.cell_name_emitted)
             self.longitudinal_plots.signals.figure_closed.disconnect(self.close_plotted_figure)
-            self.show_complete_dialog('Plotting finished!')
+            self.show_complete_dialog('Plotting stopped.' if self.longitudinal_cancel_token.is_cancelled() else 'Plotting finished!')
         except Exception as e:
             self.show_error_message(f"ERROR:{e}")
             traceback.print_exc()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import sys
+import matplotlib
+# no display is needed for batch runs -> select the non-interactive backend before anything imports pyplot
+matplotlib.use('Agg')
+from src.workutils.handle_dirs import can_create_directory
+from src.workutils.figure_output import FigureOutput, OUTPUT_FORMATS
+from src.plotting.tuning_metrics import METRICS_FORMATS, METRIC_NAMES, P_VALUE_METRICS
+from src.plotting.cell_selection import CellSelection
+
+# command line entry point to run the same timeseries / longitudinal plotting as the GUI without a display
+# ex. python -m rsc_ca_plotting --spike-dir D:/20230728_kombucha --output-dir D:/plots --framerate 30 --arena 60 60 --plots spike_plot ebc_boundary
+# all options can also be given in a JSON config file with the option names as keys (ex. {"spike_dir": ..., "arena": [60, 60]})
+# options given on the command line override the config file
+# timeseries runs save a results file in the figure folder, which can be plotted again (ex. with new colours) without the input files:
+# figures can be saved as png, jpg, webp, svg or pdf at any DPI, with 72 dpi thumbnails, or all as pages of one pdf:
+# python -m rsc_ca_plotting ... --format pdf --multipage-pdf --thumbnail-dpi 72
+# a table of tuning metrics (events, rates, spatial information, HD and EBC tuning) of every cell can be saved with the figures,
+# or on its own to screen cells before plotting them:
+# python -m rsc_ca_plotting --spike-dir D:/20230728_kombucha --output-dir D:/plots --arena 60 60 --metrics-only --metric-shuffles 1000
+# only some cells can be plotted, ex. the cells with at least 20 events in a session and significant spatial information:
+# python -m rsc_ca_plotting ... --min-events 20 --select-metric spatial_information_p_value --select-threshold 0.01
+# python -m rsc_ca_plotting --replot-from D:/plots/plots/results.npz --output-dir D:/plots --output-folder-name recolored --plots hd_curve --hd-line-color blue
+
+PLOT_TYPES = ['spike_plot', 'ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'heatmap', 'hd_curve']
+
+DEFAULTS = {'dlc_dir': None, 'output_folder_name': 'plots', 'mode': 'timeseries', 'framerate': 30,
+            'barrier': [], 'spike_line_color': 'gray', 'line_size': 1.25, 'spike_size': 6,
+            'hd_line_color': 'red', 'workers': 1, 'no_cache': False,
+            'max_loaded_sessions': 4, 'replot_from': None, 'no_results': False,
+            'force': False, 'reuse_figure': False, 'format': 'png', 'dpi': 300, 'thumbnail_dpi': None,
+            'multipage_pdf': False, 'no_background_writes': False, 'metrics': None, 'metrics_only': False,
+            'metric_shuffles': 0, 'cells': None, 'min_events': 0, 'min_rate': 0., 'select_metric': None,
+            'select_threshold': None, 'all_sessions': False}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='rsc_ca_plotting',
+                                     description='Make calcium event plots from spike and DLC files without the GUI.')
+    parser.add_argument('--config', help='JSON file with any of the options below')
+    parser.add_argument('--spike-dir', dest='spike_dir', help='directory with the calcium spike files')
+    parser.add_argument('--dlc-dir', dest='dlc_dir', help='directory with the DLC files (defaults to the spike directory)')
+    parser.add_argument('--output-dir', dest='output_dir', help='directory to save plots in')
+    parser.add_argument('--output-folder-name', dest='output_folder_name', help='folder made in the output directory for the figures')
+    parser.add_argument('--mode', choices=['timeseries', 'longitudinal'], help='single day (timeseries) or multi day (longitudinal) recordings')
+    parser.add_argument('--framerate', type=int, help='video framerate (Hz)')
+    parser.add_argument('--arena', type=float, nargs=2, metavar=('X', 'Y'), help='arena x and y lengths (cm)')
+    parser.add_argument('--plots', nargs='+', choices=PLOT_TYPES, help='plot types to make')
+    parser.add_argument('--barrier', type=float, nargs=5, action='append', metavar=('SESSION', 'X1', 'Y1', 'X2', 'Y2'),
+                        help='barrier start and end coordinates for a session (numbered from 1), can be repeated')
+    parser.add_argument('--spike-line-color', dest='spike_line_color', help='trajectory line color for spike plots')
+    parser.add_argument('--line-size', dest='line_size', type=float, help='trajectory line width for spike plots')
+    parser.add_argument('--spike-size', dest='spike_size', type=float, help='event marker size for spike plots')
+    parser.add_argument('--hd-line-color', dest='hd_line_color', help='line color for head direction curves')
+    parser.add_argument('--workers', type=int, help='number of processes used to render timeseries figures')
+    parser.add_argument('--max-loaded-sessions', dest='max_loaded_sessions', type=int,
+                        help='number of longitudinal sessions kept in memory at once')
+    parser.add_argument('--no-results', dest='no_results', action='store_true', default=None,
+                        help='do not save the ratemaps and spike trains of a timeseries run to a results file')
+    parser.add_argument('--replot-from', dest='replot_from',
+                        help='results file saved by an earlier timeseries run to plot from instead of the spike and DLC files')
+    parser.add_argument('--force', action='store_true', default=None,
+                        help='make every figure again, even ones that are up to date in the output folder')
+    parser.add_argument('--reuse-figure', dest='reuse_figure', action='store_true', default=None,
+                        help='build the figure layout once and only update the plotted data for each cell')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS + ['jpeg'], help='file format figures are saved as')
+    parser.add_argument('--dpi', type=int, help='resolution of saved figures')
+    parser.add_argument('--thumbnail-dpi', dest='thumbnail_dpi', type=int,
+                        help='also save png thumbnails at this resolution (ex. 72) in a thumbnails folder')
+    parser.add_argument('--multipage-pdf', dest='multipage_pdf', action='store_true', default=None,
+                        help='save all figures as the pages of one pdf (with --format pdf)')
+    parser.add_argument('--no-background-writes', dest='no_background_writes', action='store_true', default=None,
+                        help='write each figure before drawing the next one instead of writing figures in a background thread')
+    parser.add_argument('--metrics', choices=METRICS_FORMATS,
+                        help='also save a table of tuning metrics of every cell and session in this format')
+    parser.add_argument('--metrics-only', dest='metrics_only', action='store_true', default=None,
+                        help='only save the tuning metrics table (csv unless --metrics is given), without making figures')
+    parser.add_argument('--metric-shuffles', dest='metric_shuffles', type=int,
+                        help='number of shuffles used to add p values to the tuning metrics (0 for none)')
+    parser.add_argument('--cells', nargs='+', help='names of the cells to plot (ex. C000 C012), every cell by default')
+    parser.add_argument('--min-events', dest='min_events', type=int, help='only plot cells with at least this many events')
+    parser.add_argument('--min-rate', dest='min_rate', type=float, help='only plot cells with at least this event rate (events / s)')
+    parser.add_argument('--select-metric', dest='select_metric', choices=METRIC_NAMES + P_VALUE_METRICS,
+                        help='only plot cells with this tuning metric at least --select-threshold (at most for p values)')
+    parser.add_argument('--select-threshold', dest='select_threshold', type=float, help='threshold of --select-metric')
+    parser.add_argument('--all-sessions', dest='all_sessions', action='store_true', default=None,
+                        help='cells have to pass --min-events, --min-rate and --select-metric in every session instead of any session')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', default=None,
+                        help='parse every csv file again instead of using the cached copies in the output directory')
+    return parser
+
+
+# combine defaults, config file and command line options (in that order of priority)
+def get_options(argv=None):
+    parser = build_parser()
+    cli_options = vars(parser.parse_args(argv))
+    options = dict(DEFAULTS)
+    if cli_options['config'] is not None:
+        try:
+            with open(cli_options['config']) as config_file:
+                options.update(json.load(config_file))
+        except (OSError, ValueError) as e:
+            parser.error(f'Could not read config file {cli_options["config"]}: {e}')
+    options.update({key: value for key, value in cli_options.items() if value is not None})
+    if options['dlc_dir'] is None:
+        options['dlc_dir'] = options.get('spike_dir')
+
+    if options['metrics_only'] & (options['metrics'] is None):
+        options['metrics'] = 'csv'
+    # replotting reads everything it needs from the results file, metrics are computed without any plots
+    required_options = ['output_dir', 'plots'] if options['replot_from'] is not None else ['spike_dir', 'output_dir', 'arena', 'plots']
+    if options['metrics_only']:
+        required_options.remove('plots')
+        options['plots'] = []
+    for required in required_options:
+        if options.get(required) is None:
+            parser.error(f'{required} has not been provided.')
+    invalid_plots = [plot for plot in options['plots'] if plot not in PLOT_TYPES]
+    if len(invalid_plots) > 0:
+        parser.error(f'The plot types {invalid_plots} provided are not valid plot types.')
+    if (options['replot_from'] is not None) & (options['mode'] == 'longitudinal'):
+        parser.error('Only timeseries plots can be made from a results file.')
+    if (options['metrics'] is not None) & (options['replot_from'] is not None):
+        parser.error('Tuning metrics can only be saved for runs from the spike and DLC files.')
+    if options['metric_shuffles'] < 0:
+        parser.error('The number of metric shuffles cannot be negative.')
+    if (options['mode'] == 'longitudinal') & (len(options['plots']) > 1):
+        parser.error('Longitudinal plots cannot be created with more than 1 plot type.')
+    try:
+        get_figure_output(options)
+        get_cell_selection(options)
+    except ValueError as e:
+        parser.error(str(e))
+    if not can_create_directory(options['output_dir']):
+        parser.error(f'The output folder {options["output_dir"]} could not be created. Please check that it is a valid file path.')
+    return options
+
+
+# get plot kwargs in the same form the GUI passes them to the plotting classes
+def get_plot_kwargs(options, num_sessions):
+    plot_kwargs = {'spike_line_color': options['spike_line_color'], 'line_size': options['line_size'],
+                   'spike_size': options['spike_size'], 'hd_line_color': options['hd_line_color']}
+    barrier_coords = [[[None, None], [None, None]] for _ in range(num_sessions)]
+    for session_num, x1, y1, x2, y2 in options['barrier']:
+        barrier_session_idx = int(session_num) - 1
+        if (barrier_session_idx < 0) or (barrier_session_idx >= num_sessions):
+            raise ValueError(f'Barrier session {int(session_num)} provided is greater than the number of sessions.')
+        barrier_coords[barrier_session_idx] = [[x1, y1], [x2, y2]]
+    plot_kwargs['barrier_coords'] = barrier_coords
+    return plot_kwargs
+
+
+# format, resolution and thumbnails of the saved figures
+def get_figure_output(options):
+    return FigureOutput(options['format'], options['dpi'], options['thumbnail_dpi'], options['multipage_pdf'],
+                        background_writes=not options['no_background_writes'])
+
+
+# cells to plot -> None plots every cell
+def get_cell_selection(options):
+    if ((options['cells'] is None) & (options['min_events'] == 0) & (options['min_rate'] == 0) &
+        (options['select_metric'] is None)):
+        return None
+    # p values used to select cells are computed with 1000 shuffles unless --metric-shuffles is given
+    metric_shuffles = options['metric_shuffles'] if options['metric_shuffles'] > 0 else 1000
+    return CellSelection(options['cells'], options['min_events'], options['min_rate'], options['select_metric'],
+                         options['select_threshold'], options['all_sessions'], metric_shuffles)
+
+
+def main(argv=None):
+    options = get_options(argv)
+    # import plotting classes after the backend is set
+    from src.plotting.timeseries_plot import TimeSeriesPlots
+    from src.plotting.longitudinal_plot import LongitudinalPlot
+    figure_output = get_figure_output(options)
+    cell_selection = get_cell_selection(options)
+    try:
+        if options['replot_from'] is not None:
+            plots = TimeSeriesPlots.from_results(options['replot_from'], options['output_dir'])
+            plot_kwargs = get_plot_kwargs(options, plots.num_sessions)
+            # use the barrier coordinates saved in the results file unless new ones are given
+            if len(options['barrier']) == 0:
+                plot_kwargs.pop('barrier_coords')
+            plots.replot_figures(options['replot_from'], options['output_folder_name'], *options['plots'],
+                                 num_workers=options['workers'], force=options['force'],
+                                 reuse_figure=options['reuse_figure'], figure_output=figure_output,
+                                 cell_selection=cell_selection, **plot_kwargs)
+        elif options['mode'] == 'timeseries':
+            plots = TimeSeriesPlots(options['spike_dir'], options['dlc_dir'], options['output_dir'],
+                                    options['framerate'], list(options['arena']), use_cache=not options['no_cache'])
+            if options['metrics_only']:
+                plots.export_tuning_metrics(options['output_folder_name'], options['metrics'], options['metric_shuffles'],
+                                            num_workers=options['workers'])
+                return 0
+            plot_kwargs = get_plot_kwargs(options, plots.num_sessions)
+            plots.plot_figures(options['output_folder_name'], *options['plots'], num_workers=options['workers'],
+                               save_results=not options['no_results'], force=options['force'],
+                               reuse_figure=options['reuse_figure'], figure_output=figure_output,
+                               metrics_format=options['metrics'], metric_shuffles=options['metric_shuffles'],
+                               cell_selection=cell_selection, **plot_kwargs)
+        else:
+            plots = LongitudinalPlot(options['spike_dir'], options['dlc_dir'], options['output_dir'],
+                                     options['framerate'], list(options['arena']), use_cache=not options['no_cache'],
+                                     max_loaded_sessions=options['max_loaded_sessions'])
+            if options['metrics_only']:
+                plots.export_tuning_metrics(options['output_folder_name'], options['metrics'], options['metric_shuffles'])
+                return 0
+            plot_kwargs = get_plot_kwargs(options, plots.num_sessions)
+            plots.plot_LR_figures(options['output_folder_name'], options['plots'][0], force=options['force'],
+                                  reuse_figure=options['reuse_figure'], figure_output=figure_output,
+                                  metrics_format=options['metrics'], metric_shuffles=options['metric_shuffles'],
+                                  cell_selection=cell_selection, **plot_kwargs)
+    except Exception as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import src.plotting.plot_utils as plt_util
+
+# index of the events in a spike file grouped by cell -> built once per session instead of comparing cell names for every cell
+# events are sorted by cell and then time so the events of a cell are one contiguous block of self.times
+# offsets[i]:offsets[i+1] is the block of the cell in cell_names[i], so getting the events of a cell is a slice (no copy)
+# cell_names defaults to the sorted unique cell names in the file, events of cells not in cell_names are dropped
+class CellEventIndex(object):
+    def __init__(self, spike_data, cell_names=None):
+        names = np.asarray(spike_data[' Cell Name'])
+        times = np.asarray(spike_data['Time (s)'], dtype=np.float64)
+        if cell_names is None:
+            self.cell_names, codes = np.unique(names, return_inverse=True)
+        else:
+            self.cell_names = np.asarray(cell_names)
+            codes = pd.Index(cell_names).get_indexer(names)
+            times, codes = times[codes >= 0], codes[codes >= 0]
+        order = np.lexsort((times, codes))
+        self.times = times[order]
+        self.codes = codes[order].astype(np.int32)
+        self.offsets = np.zeros(len(self.cell_names) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(self.codes, minlength=len(self.cell_names)))
+
+    def __len__(self):
+        return len(self.cell_names)
+
+    # position of a cell name in cell_names
+    def cell_idx(self, cell):
+        matches = np.flatnonzero(self.cell_names == cell)
+        if len(matches) == 0:
+            raise ValueError(f'{cell} is not a cell in this session.')
+        return int(matches[0])
+
+    # sorted event times of the cell at cell_idx
+    def events(self, cell_idx):
+        return self.times[self.offsets[cell_idx]:self.offsets[cell_idx + 1]]
+
+    def cell_events(self, cell):
+        return self.events(self.cell_idx(cell))
+
+    # number of events of every cell
+    # cell_names gives the cells to count when they are different from the cells in the index (0 for cells without events)
+    def event_counts(self, cell_names=None):
+        counts = np.diff(self.offsets)
+        if cell_names is None:
+            return counts
+        rows = pd.Index(self.cell_names).get_indexer(cell_names)
+        return np.where(rows >= 0, counts[rows], 0)
+
+    # spike train of one cell -> number of its events closest to each frame
+    def spike_train(self, cell_idx, timestamps, dtype=np.uint16):
+        event_frames = plt_util.nearest_frame_indices(timestamps, self.events(cell_idx))
+        return np.bincount(event_frames, minlength=len(timestamps)).astype(dtype)
+
+    # spike trains of all cells as an array of shape (number of cells, number of frames)
+    # cell_names gives the rows of the output when it is different from the cells in the index (ex. cells from all days),
+    # rows of cells without events in this session are all 0
+    def spike_trains(self, timestamps, cell_names=None, dtype=np.uint16):
+        return self.sparse_spike_trains(timestamps, cell_names, dtype).toarray()
+
+    # spike trains of all cells kept as the frames of their events (see SparseSpikeTrains), rows are the same as spike_trains
+    def sparse_spike_trains(self, timestamps, cell_names=None, dtype=np.uint16):
+        codes = self.codes
+        num_rows = len(self.cell_names)
+        if cell_names is not None:
+            rows = pd.Index(cell_names).get_indexer(self.cell_names)
+            codes = rows[codes]
+            num_rows = len(cell_names)
+        keep = codes >= 0
+        event_frames = plt_util.nearest_frame_indices(timestamps, self.times[keep])
+        return SparseSpikeTrains(codes[keep], event_frames, num_rows, len(timestamps), dtype)
+
+# spike trains of a session as the frame of every event grouped by row (cell) instead of a dense cells x frames array
+# -> memory scales with the number of events instead of cells x frames (ex. 400 cells x 75k frames is ~60 MB as uint16)
+# indexing a row (spike_trains[cell_idx]) builds the dense spike train of that cell, toarray builds all of them
+class SparseSpikeTrains(object):
+    def __init__(self, rows, event_frames, num_rows, num_frames, dtype=np.uint16):
+        order = np.lexsort((event_frames, rows))
+        self.frames = np.asarray(event_frames)[order].astype(np.int64)
+        self.offsets = np.zeros(num_rows + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(np.asarray(rows)[order], minlength=num_rows))
+        self.shape = (num_rows, num_frames)
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, row):
+        frames = self.frames[self.offsets[row]:self.offsets[row + 1]]
+        return np.bincount(frames, minlength=self.shape[1]).astype(self.dtype)
+
+    # number of events of every row
+    def event_counts(self):
+        return np.diff(self.offsets)
+
+    # scipy sparse (csr) matrix of the spike trains -> made from the events without building the dense array
+    def tocsr(self):
+        return sparse.csr_matrix((np.ones(len(self.frames), dtype=self.dtype), self.frames, self.offsets), shape=self.shape)
+
+    def toarray(self):
+        spike_trains = np.zeros(self.shape, dtype=self.dtype)
+        rows = np.repeat(np.arange(self.shape[0]), self.event_counts())
+        np.add.at(spike_trains, (rows, self.frames), 1)
+        return spike_trains
@@ -0,0 +1,71 @@
+import numpy as np
+from src.plotting.tuning_metrics import METRIC_NAMES, P_VALUE_METRICS
+
+# which cells to plot -> checked before any figure is drawn, so rendering only costs as much as the cells selected
+# cells is a list of the names of the cells to plot (None for every cell), names are compared without surrounding spaces
+# min_events is the minimum number of events and min_rate the minimum event rate (events / s) of a cell
+# metric and metric_threshold select cells by a tuning metric (see tuning_metrics) -> cells need at least metric_threshold,
+# or at most metric_threshold for p values (ex. 'spatial_information_p_value', computed with metric_shuffles shuffles)
+# all_sessions=False selects the cells that pass in any session, all_sessions=True the cells that pass in every session
+# event counts and rates only need the spike files and the length of each session, so they are checked before any
+# ratemaps are made, the metric is only computed for the cells that passed the other filters
+class CellSelection(object):
+    def __init__(self, cells=None, min_events=0, min_rate=0., metric=None, metric_threshold=None, all_sessions=False,
+                 metric_shuffles=1000, seed=None):
+        if (metric is not None) and (metric not in METRIC_NAMES + P_VALUE_METRICS):
+            raise ValueError(f'{metric} is not a valid tuning metric, use one of {METRIC_NAMES + P_VALUE_METRICS}.')
+        if (metric is not None) and (metric_threshold is None):
+            raise ValueError(f'A threshold is needed to select cells by {metric}.')
+        if (min_events < 0) or (min_rate < 0):
+            raise ValueError('The minimum number of events and event rate cannot be negative.')
+        self.cells = None if cells is None else set(str(cell).strip() for cell in cells)
+        self.min_events = min_events
+        self.min_rate = min_rate
+        self.metric = metric
+        self.metric_threshold = metric_threshold
+        self.all_sessions = all_sessions
+        self.metric_shuffles = metric_shuffles
+        self.seed = seed
+
+    # criteria of the selection -> part of the options in the manifest of an output folder, so figures made from a different
+    # selection of cells (ex. the pages of a multi-page pdf) are not taken as up to date
+    def get_options(self):
+        return {'cells': None if self.cells is None else sorted(self.cells), 'min_events': self.min_events,
+                'min_rate': self.min_rate, 'metric': self.metric, 'metric_threshold': self.metric_threshold,
+                'all_sessions': self.all_sessions, 'metric_shuffles': self.get_metric_shuffles(), 'seed': self.seed}
+
+    # the metric needs the ratemaps of the cells, so it can only be checked once the sessions are prepared
+    def uses_metric(self):
+        return self.metric is not None
+
+    # number of shuffles needed for the metric (0 unless it is a p value)
+    def get_metric_shuffles(self):
+        return self.metric_shuffles if self.metric in P_VALUE_METRICS else 0
+
+    # one value per cell from a sessions x cells array of which cells passed in each session
+    def combine_sessions(self, passed):
+        return passed.all(axis=0) if self.all_sessions else passed.any(axis=0)
+
+    # mask of the cells in cell_names that are in the cell list and have enough events
+    # session_event_counts is a sessions x cells array of event counts and session_durations the length (s) of each session
+    def select_by_events(self, cell_names, session_event_counts, session_durations):
+        session_event_counts = np.atleast_2d(session_event_counts)
+        session_rates = session_event_counts / np.asarray(session_durations, dtype=float)[:, np.newaxis]
+        selected = self.combine_sessions((session_event_counts >= self.min_events) & (session_rates >= self.min_rate))
+        if self.cells is not None:
+            selected &= np.array([str(cell).strip() in self.cells for cell in cell_names], dtype=bool)
+        return selected
+
+    # mask of the cells in cell_names whose metric passes the threshold -> metrics_table from tuning_metrics.get_metrics_table
+    # cells without a value (ex. no events in a session) do not pass
+    def select_by_metric(self, cell_names, metrics_table):
+        if self.metric is None:
+            return np.ones(len(cell_names), dtype=bool)
+        values = metrics_table.pivot(index='session', columns='cell', values=self.metric)
+        values = values.reindex(columns=[str(cell).lstrip() for cell in cell_names]).to_numpy(dtype=float)
+        with np.errstate(invalid='ignore'):
+            if self.metric in P_VALUE_METRICS:
+                passed = values <= self.metric_threshold
+            else:
+                passed = values >= self.metric_threshold
+        return self.combine_sessions(passed)
@@ -2,54 +2,73 @@ import sys
 sys.path.append(r'C:\Users\Gianna\Documents\Python Scripts\rsc_ca_plotting')
 import os 
 import re
-import pandas as pd
 import numpy as np
 import src.plotting.plot_utils as plt_util
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 from src.plotting.subplot import Subplot
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.cell_events import CellEventIndex
+from src.plotting.ratemaps import compute_ratemaps
+import src.plotting.tuning_metrics as tuning_metrics
 from src.workutils.PlotEmitterSignals import EmittedPlotSignals
-from src.workutils.longitudinal_utils import get_cell_names_from_max, get_day_digit
+from src.workutils.longitudinal_utils import get_cell_names_from_max, get_day_digit, get_session_sort_key, get_file_session_number
+from src.workutils.session_cache import SessionCache
+from src.workutils.run_manifest import RunManifest, get_inputs_hash, get_options_hash
+from src.workutils.figure_output import FigureOutput, MULTIPAGE_PDF_NAME
+from src.workutils.cancellation import check_cancelled
+from src.workutils.file_cache import get_cache_dir, read_dlc_file, read_spike_file, read_frame_times
+from src.workutils.handle_dirs import is_frame_time_file
 
 
 # class to represent the functions of longitudinal plotting
-# day_and_sessions_data is an array that contains all the data needed for plots 
+# day_sessions is an index of the files needed for plots -> data is only read when a session is used
 # length of outer list represents number of days -> ex. [day_1, day_2, day_3]
-# each item in that list (representing days) is a 2-item array -> 
-# ex. [[[dlc1, dlc1], [spike1,spike1]], [[dlc2, dlc2], [spike2, spike2]]] (represents 2 days with 2 sessions each)
-# Every 2-item array contains the DLC files for all sessions on the that day as the first element (index 0),
-# and the aligned longitudinal spike files for all sessions on that day as the second element (index 1)
+# each item in that list (representing days) is a list of sessions for that day, ordered by session number ->
+# ex. [[session1, session2], [session1, session2]] (represents 2 days with 2 sessions each)
+# every session is a dict with the day label, session number, DLC file path ('dlc_file'), aligned
+# longitudinal spike file path ('spike_file') and the frame time file path ('frame_time_file', an LOF file or another csv of
+# frame times, see handle_dirs.is_frame_time_file, None if there is none)
+# at most max_loaded_sessions sessions of csv data are held in memory at once
 class LongitudinalPlot(object):
 
-    def __init__(self, spike_directory, dlc_directory, output_folder_path, framerate, two_dim_arena_coords):
+    # use_cache=False parses every csv again instead of reading the cached copies in the output folder
+    def __init__(self, spike_directory, dlc_directory, output_folder_path, framerate, two_dim_arena_coords, use_cache=True,
+                 max_loaded_sessions=4):
         self.framerate = framerate
+        self.use_cache = use_cache
         self.spike_dir = spike_directory
         self.dlc_dir = dlc_directory
         self.output_folder_path = output_folder_path
         if not os.path.exists(self.output_folder_path):
             os.mkdir(output_folder_path)
+        self.cache_dir = get_cache_dir(self.output_folder_path)
         #self.main_dir = main_dir
         #self.directory = sorted(os.listdir(self.main_dir))
         self.splt = Subplot(self.framerate, two_dim_arena_coords)
         # coordinates provided as 2-dim array
         self.arena_x_length = two_dim_arena_coords[0]
         self.arena_y_length = two_dim_arena_coords[1]
-        self.day_and_sessions_data = self.get_files()
-        self.cell_names = get_cell_names_from_max(self.day_and_sessions_data)
+        self.day_sessions = self.get_files()
+        self.session_cache = SessionCache(self.read_session, max_loaded_sessions)
+        self.sessions_in_each_day = [len(sessions) for sessions in self.day_sessions]
         # get max amount of row specs needed for plot using day with most sessions 
         self.max_row_num = np.max(self.sessions_in_each_day)
         # get number of cols needed based on number of days
         self.num_days = len(self.sessions_in_each_day)
         self.num_sessions = np.sum(self.sessions_in_each_day)
+        # cell names are found from the first session of every day
+        self.cell_names = get_cell_names_from_max(self.load_session(day_idx, 0)[1] for day_idx in range(self.num_days))
         self.signals = EmittedPlotSignals()
+        # format and resolution figures are saved with -> set by plot_LR_figures
+        self.figure_output = FigureOutput()
     
-    ## 
+    # index the DLC and longitudinal spike files of every day without reading them
     def get_files(self):
         dlc_dict = {}
         spike_dict = {}
+        frame_time_dict = {}
         date_regex = re.compile(pattern=r'^[0-9]{8}')
-        sessions_data = []
-        sessions_in_each_day = []
         self.dlc_files = os.listdir(self.dlc_dir)
         self.spike_files = os.listdir(self.spike_dir)
         if self.dlc_dir != self.spike_dir:
@@ -57,61 +76,102 @@ class LongitudinalPlot(object):
         else:
             self.directory = os.listdir(self.spike_dir)
         # for every file in directory, check if it is a spike file or a DLC file
-        # when found -> get the day of recording from file and add it to the 'spike_dict' or 'dlc_dict' dictionary, respectively
-        for file in self.directory:
+        # when found -> get the day of recording from file and add its path to the 'spike_dict' or 'dlc_dict' dictionary, respectively
+        # LOF files first, so a session's LOF file is used if it also has another frame time file
+        for file in sorted(self.directory, key=lambda file: not file.lower().endswith('_lof.csv')):
             if (('longitudinal_spikes'.lower() in file.lower()) & ('.csv' in file.lower())):
                 day = get_day_digit(file)
-                # case if date hasnt bee added to dictionary yet
-                if day not in spike_dict:
-                    spike_dict[day]= [pd.read_csv(os.path.join(self.spike_dir ,file))]
-                else:
-                    day_list = spike_dict[day]
-                    spike_dict[day]= day_list + [pd.read_csv(os.path.join(self.spike_dir,file))]
-
-            if (bool(date_regex.search(file))):
-                m = date_regex.search(file)
-                if m:
-                    date = m.group()
-                    if (('DLC'.lower() in file.lower()) & ('.csv' in file)):
-                        if date not in dlc_dict:
-                            #create new date and add new dlc csv to date key value
-                            dlc_dict[date] = [pd.read_csv(os.path.join(self.dlc_dir,file), header=[1,2])]
-                        else:
-                            dlc_list = dlc_dict[date]
-                            dlc_dict[date] = dlc_list + [pd.read_csv(os.path.join(self.dlc_dir,file), header=[1,2])]
-        
-        # add a nested list for every day -> end result will be list equal to the length of days, and inner lists contain dlc files as 
-        # the first list and spike files as the second list 
-        for day in spike_dict.keys():
-            day_label = day
-            sessions_data.append([[], spike_dict[day_label]])
-
-        # iterate through dlc dictionary to add to sessions data info
-        idx = 0
-        for day in dlc_dict.keys():
-            day_num = day
-            sessions_data[idx][0] += dlc_dict[day_num]
-            # add num of sessions to list with num sessions for each day
-            sessions_in_each_day.append(len(dlc_dict[day_num]))
-            idx += 1
-        self.sessions_in_each_day = sessions_in_each_day
-        return sessions_data
-    
-    
-
+                spike_dict.setdefault(day, []).append(os.path.join(self.spike_dir, file))
+
+            m = date_regex.search(file)
+            if m:
+                date = m.group()
+                if (('DLC'.lower() in file.lower()) & ('.csv' in file)):
+                    dlc_dict.setdefault(date, []).append(os.path.join(self.dlc_dir, file))
+                elif (file.lower().endswith('_lof.csv') or
+                      (file.lower().endswith('.csv') & ('longitudinal_spikes' not in file.lower()) &
+                       is_frame_time_file(os.path.join(self.dlc_dir, file)))):
+                    session_num = get_file_session_number(file)
+                    if session_num is not None:
+                        frame_time_dict.setdefault(date, {}).setdefault(session_num, os.path.join(self.dlc_dir, file))
+
+        if len(spike_dict) != len(dlc_dict):
+            raise Exception('The longitudinal spike files and DLC files provided do not include the same number of days.')
+        # days are ordered by date and paired in that order, sessions in a day are ordered by session number
+        day_sessions = []
+        for spike_day, dlc_date in zip(sorted(spike_dict.keys()), sorted(dlc_dict.keys())):
+            dlc_paths = sorted(dlc_dict[dlc_date], key=lambda path: get_session_sort_key(os.path.basename(path)))
+            spike_paths = sorted(spike_dict[spike_day], key=lambda path: get_session_sort_key(os.path.basename(path)))
+            if len(dlc_paths) != len(spike_paths):
+                raise Exception(f'{dlc_date} does not have the same number of DLC files and longitudinal spike files.')
+            # frame time files are matched to the DLC file with the same session number
+            day_frame_times = frame_time_dict.get(dlc_date, {})
+            day_sessions.append([{'day': spike_day, 'session': session_idx + 1, 'dlc_file': dlc_path, 'spike_file': spike_path,
+                                  'frame_time_file': day_frame_times.get(get_file_session_number(os.path.basename(dlc_path)))}
+                                 for session_idx, (dlc_path, spike_path) in enumerate(zip(dlc_paths, spike_paths))])
+            for session in day_sessions[-1]:
+                if session['frame_time_file'] is None:
+                    print(f"No frame time file found for {os.path.basename(session['dlc_file'])}, its frames are timed as frame / framerate.")
+        return day_sessions
+
+    # read the csv files of a session -> key is (day index, session index)
+    # only the events grouped by cell are kept from the spike file
+    def read_session(self, key):
+        session = self.day_sessions[key[0]][key[1]]
+        frame_times = None
+        if session['frame_time_file'] is not None:
+            frame_times = read_frame_times(session['frame_time_file'], self.cache_dir, self.use_cache)
+        return (read_dlc_file(session['dlc_file'], self.cache_dir, self.use_cache),
+                CellEventIndex(read_spike_file(session['spike_file'], self.cache_dir, self.use_cache)),
+                frame_times)
+
+    # get [dlc data, cell event index, frame times] for a session, loading it if it is not in the session cache
+    def load_session(self, day, session):
+        return self.session_cache.get((day, session))
+
+    # timestamps come from the session's LOF frame times when it has them, otherwise from the framerate
     def get_timestamps(self, day, session):
-        frames = [i for i in range(len(self.day_and_sessions_data[day][0][session]))]
-        timestamp_data = [float(frame / self.framerate) for frame in frames]
-        #start the session at time 0
-        timestamp_data = timestamp_data - np.min(timestamp_data)
-        #make an array for easy use
-        timestamps = np.array(timestamp_data).flatten()
-        return timestamps
+        dlc_df, _, frame_times = self.load_session(day, session)
+        return plt_util.get_frame_timestamps(len(dlc_df), self.framerate, frame_times)
+
+    # align the events of every cell to the video frames and compute the tracking geometry once for each session of each day
+    # each session is loaded once, so only the arrays needed for plotting are kept for every session
+    # ratemaps of all cells are computed at the same time when plot_type_arg is a ratemap plot (EBC boundary, heatmap or HD curve)
+    # returns three nested lists indexed as [day][session] -> SparseSpikeTrains (one row per cell in self.cell_names),
+    # SessionGeometry and array of smoothed ratemaps (one per cell in self.cell_names, None for other plot types)
+    # memory kept for every session is the events, the tracking and the ratemaps -> spike trains are never made dense and the
+    # occupancy (frame and bin indices) only exists while the ratemaps of a session are computed
+    # cancel_token (a CancellationToken) is checked before each session
+    def prepare_sessions(self, plot_type_arg=None, cancel_token=None):
+        day_spike_trains = []
+        day_geometries = []
+        day_ratemaps = []
+        for day_idx in range(self.num_days):
+            session_spike_trains = []
+            session_geometries = []
+            session_ratemaps = []
+            for session_idx in range(self.sessions_in_each_day[day_idx]):
+                check_cancelled(cancel_token)
+                dlc_df, cell_events, _ = self.load_session(day_idx, session_idx)
+                timestamps = self.get_timestamps(day_idx, session_idx)
+                spike_trains = cell_events.sparse_spike_trains(timestamps, self.cell_names)
+                geometry = SessionGeometry(dlc_df, timestamps, self.framerate, [self.arena_x_length, self.arena_y_length])
+                ratemaps = None
+                if plot_type_arg in ['ebc_boundary', 'heatmap', 'hd_curve']:
+                    ratemaps = compute_ratemaps(geometry, spike_trains, kind=plot_type_arg, smooth=True)
+                    geometry.clear_occupancy()
+                session_spike_trains.append(spike_trains)
+                session_geometries.append(geometry)
+                session_ratemaps.append(ratemaps)
+            day_spike_trains.append(session_spike_trains)
+            day_geometries.append(session_geometries)
+            day_ratemaps.append(session_ratemaps)
+        return day_spike_trains, day_geometries, day_ratemaps
 
     #scale head and angle pixel positions to arena by taking the minimum x and y values and 
 
     def get_head_and_angles(self, day, session):
-        head_x, head_y, angles = plt_util.calc_positions(self.day_and_sessions_data[day][0][session])
+        head_x, head_y, angles = plt_util.calc_positions(self.load_session(day, session)[0])
         head_x -= np.min(head_x)
         head_x *= (self.arena_x_length/np.max(head_x))
         head_y -= np.min(head_y)
@@ -125,187 +185,324 @@ class LongitudinalPlot(object):
     #                       + for spike plots: {"spike_line_color": #XXXXXX, "line_size": xx, "spike_size": xx}
     #                       + for barrier plots: {"barrier_coord1": [[x1,y1], [x2, y2]], "barrier_coord2": [[x3, y3], [x4, y4], 'barrier_coord3' = [[None, None], [None, None]]]
     #                       + for HD plots: {"hd_line_color": xx}
-    def plot_LR_figures(self, output_folder_name, plot_type_arg, **kwargs):
+    # figures that are already in the output folder and were made from the same input files and plot options are skipped,
+    # force=True makes every figure again
+    # reuse_figure=True builds the grid of axes and its layout once and only updates the data of the plots for every other cell,
+    # so the figure emitted to the GUI is the same figure for every cell
+    # figure_output sets the format, DPI, thumbnails and multi-page pdf output of the figures (png at 300 dpi by default),
+    # a multi-page pdf is made again with every cell when any of them changed
+    # figures are written to disk in the background unless figure_output says otherwise, and recorded in the manifest once written
+    # metrics_format='csv' or 'parquet' also saves the tuning metrics of every cell in every session (see get_tuning_metrics),
+    # with shuffle p values from metric_shuffles shuffles (seeded with metric_seed) when metric_shuffles > 0
+    # cell_selection (a CellSelection) only plots the cells it selects from the sessions of every day, cells are selected by
+    # their events before anything is computed and by their tuning metric (if it has one) once the sessions are prepared
+    # cancel_token (a CancellationToken) stops plotting between sessions and cells with PlotCancelled -> the figures queued
+    # before it stopped are still written and recorded in the manifest, a multi-page pdf is thrown away and the old one kept
+    # plot_LR_figures is prepare_LR_figures followed by render_prepared_LR_figures, the TaskManager runs them as separate tasks
+    def plot_LR_figures(self, output_folder_name, plot_type_arg, force=False, reuse_figure=False, figure_output=None,
+                        metrics_format=None, metric_shuffles=0, metric_seed=None, cell_selection=None, cancel_token=None,
+                        **kwargs):
+        prepared = self.prepare_LR_figures(output_folder_name, plot_type_arg, force, figure_output, metrics_format,
+                                           metric_shuffles, metric_seed, cell_selection, cancel_token, **kwargs)
+        self.render_prepared_LR_figures(prepared, plot_type_arg, reuse_figure, cancel_token, **kwargs)
+
+    # everything plot_LR_figures does before drawing -> selects the cells, prepares the sessions of every day and saves the
+    # tuning metrics, no figures are drawn so it can run while another job is rendering
+    # returns (output path, indices of the cells to plot, manifest, arrays from prepare_sessions) for
+    # render_prepared_LR_figures, or None if there is nothing to plot
+    def prepare_LR_figures(self, output_folder_name, plot_type_arg, force=False, figure_output=None, metrics_format=None,
+                           metric_shuffles=0, metric_seed=None, cell_selection=None, cancel_token=None, **kwargs):
         output_path = os.path.join(self.output_folder_path, output_folder_name)
-        num_rows = self.max_row_num
-        num_cols = self.num_days
         if not os.path.exists(output_path):
             os.mkdir(output_path)
-        for cell in self.cell_names:
-            print(cell)
-            figure = plt.figure()
-            plt.rcParams.update({'figure.max_open_warning': 0})
-            axes = []
-            ax_indices = []
-            gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
-            polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
-            for row_idx in range(num_rows):
-                for col_idx in range(num_cols):
-                    if plot_type_arg in polar_plots:
-                        axes.append(figure.add_subplot(gs[row_idx, col_idx], projection="polar"))
-                    else:
-                        axes.append(figure.add_subplot(gs[row_idx, col_idx]))
-                    ax_indices.append([row_idx, col_idx])
-                    
-            for day_idx in range(self.num_days):
-
-                num_sessions_for_day = len(self.day_and_sessions_data[day_idx][1])
-                if num_sessions_for_day < num_rows:
-                    # exclude the indices of axis that will not be plotted for that day 
-                    ax_indices_to_turn_off = range(self.max_row_num)[num_sessions_for_day:]
-                    for index in ax_indices_to_turn_off:
-                        idx_in_axes = next((i for i, sublist in enumerate(ax_indices) if sublist == [index, day_idx]), None)
-                        axes[idx_in_axes].axis('off')
-
-                for session_idx in range(num_sessions_for_day):
-
-                    ax_to_plot_index = next((i for i, sublist in enumerate(ax_indices) if sublist == [session_idx, day_idx]), None)
-                    axis_to_plot = axes[ax_to_plot_index]
-                    axis_to_plot.axis('off')
-
-                    timestamps = self.get_timestamps(day_idx, session_idx)
-                    cell_df = self.day_and_sessions_data[day_idx][1][session_idx]
-                    cell_event_timestamps = cell_df['Time (s)'][cell_df[' Cell Name']==cell]
-                    spike_train = np.zeros_like(timestamps)
-
-                    if cell_event_timestamps is not None:
-                        for event_ts in cell_event_timestamps:
-                            abs_diffs= abs(timestamps - event_ts)
-                            min_idx = np.argmin(abs_diffs, axis=0)
-                            spike_train[min_idx] = 1
-
-                    head_x, head_y, angles = self.get_head_and_angles(day_idx, session_idx)
-                    head_x, head_y, angles = head_x[:-1], head_y[:-1], angles[:-1]
-                    spike_train = spike_train[:-1]
-                    # find index in indices list to find the axis to plot on
-                    # ax_to_plot_index = next((i for i, sublist in enumerate(ax_indices) if sublist == [session_idx, day_idx]), None)
-                    # print(ax_to_plot_index)
-                    # axis_to_plot = axes[ax_to_plot_index]
-                    # axis_to_plot.axis('off')
-                    # plot based on provided arg type -> LR plots cant be made with barriers yet
-                    if (plot_type_arg == 'spike_plot')  & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs):
-                        self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'],
-                        spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
-                    
-                    elif (plot_type_arg == 'hd_curve') & ('hd_line_color' in kwargs):
-                        self.splt.hd_curve_subplot(angles, spike_train, line_color= kwargs['hd_line_color'], destination=None, axis=axis_to_plot)
-                        
-                    elif (plot_type_arg == 'heatmap'):
-                        self.splt.heatmap_subplot(head_x, head_y, spike_train, destination=None, axis= axis_to_plot)
+        self.figure_output = figure_output if figure_output is not None else FigureOutput()
+        manifest = self.get_manifest(output_path, plot_type_arg, kwargs, cell_selection)
+        selected = self.select_cells(cell_selection)
+        cells_to_plot = set(cell_idx for cell_idx, cell in enumerate(self.cell_names)
+                            if selected[cell_idx] & (force or (not manifest.is_up_to_date(self.get_figure_name(cell)))))
+        if ((len(cells_to_plot) == 0) &
+            ((metrics_format is None) or tuning_metrics.has_metrics_table(output_path, metrics_format, metric_shuffles > 0))):
+            print('All figures are up to date.' if selected.any() else 'No cells were selected to plot.')
+            return
+        day_spike_trains, day_geometries, day_ratemaps = self.prepare_sessions(plot_type_arg, cancel_token)
+        metrics_table = None
+        if metrics_format is not None:
+            metrics_table = self.save_tuning_metrics(output_path, metrics_format, day_spike_trains, day_geometries, day_ratemaps,
+                                                     plot_type_arg, metric_shuffles, metric_seed, cancel_token)
+        if (cell_selection is not None) and cell_selection.uses_metric():
+            if (metrics_table is None) or (cell_selection.metric not in metrics_table):
+                metrics_table = self.get_tuning_metrics(day_spike_trains, day_geometries, day_ratemaps, plot_type_arg,
+                                                        cell_selection.get_metric_shuffles(), cell_selection.seed, cancel_token)
+            selected = cell_selection.select_by_metric(self.cell_names, metrics_table)
+            selected_cells = set(cell_idx for cell_idx in cells_to_plot if selected[cell_idx])
+            print(f'{len(selected_cells)} of {len(cells_to_plot)} cells to plot have {cell_selection.metric} past the threshold')
+            cells_to_plot = selected_cells
+        # only the tuning metrics were out of date
+        if len(cells_to_plot) == 0:
+            return
+        return output_path, cells_to_plot, manifest, (day_spike_trains, day_geometries, day_ratemaps)
+
+    # draw and save the figures of the cells prepared by prepare_LR_figures (nothing is drawn when prepared is None)
+    def render_prepared_LR_figures(self, prepared, plot_type_arg, reuse_figure=False, cancel_token=None, **kwargs):
+        if prepared is None:
+            return
+        output_path, cells_to_plot, manifest, (day_spike_trains, day_geometries, day_ratemaps) = prepared
+        figure_template = None
+        self.figure_output.open(output_path)
+        try:
+            for cell_idx, cell in enumerate(self.cell_names):
+                if cell_idx not in cells_to_plot:
+                    continue
+                check_cancelled(cancel_token)
+                print(cell)
+                if reuse_figure & (figure_template is not None):
+                    figure, drawn_axes = figure_template
+                    self.update_LR_figure(drawn_axes, cell_idx, plot_type_arg, day_spike_trains, day_geometries, day_ratemaps)
+                else:
+                    figure, axes = self.create_LR_figure(plot_type_arg)
+                    drawn_axes = self.draw_LR_figure(axes, cell_idx, plot_type_arg, day_spike_trains, day_geometries, day_ratemaps, **kwargs)
+                    figure.tight_layout(pad=1)
+                    if reuse_figure:
+                        figure_template = (figure, drawn_axes)
+                self.signals.figure_closed.emit()
+                self.signals.figure_plotted.emit(figure)
+                self.signals.cell_plotted.emit(cell)
+                self.figure_output.save(figure, output_path, cell)
+                self.record_saved_figures(manifest)
+                if not reuse_figure:
+                    plt.close(figure)
+        except BaseException:
+            self.figure_output.close(keep=False)
+            self.record_saved_figures(manifest)
+            raise
+        finally:
+            if figure_template is not None:
+                plt.close(figure_template[0])
+        self.figure_output.close()
+        self.record_saved_figures(manifest)
+        if self.figure_output.multipage_pdf:
+            manifest.figure_saved(MULTIPAGE_PDF_NAME)
+
+    # mask of the cells in self.cell_names selected by cell_selection (a CellSelection) from their events in the spike file and
+    # the length of every session of every day (every cell when cell_selection is None)
+    def select_cells(self, cell_selection=None):
+        if cell_selection is None:
+            return np.ones(len(self.cell_names), dtype=bool)
+        session_event_counts = []
+        session_durations = []
+        for day_idx in range(self.num_days):
+            for session_idx in range(self.sessions_in_each_day[day_idx]):
+                session_event_counts.append(self.load_session(day_idx, session_idx)[1].event_counts(self.cell_names))
+                timestamps = self.get_timestamps(day_idx, session_idx)
+                # the last frame is not used in the plots
+                session_durations.append(np.sum(plt_util.get_frame_durations(timestamps, self.framerate)[:-1]))
+        selected = cell_selection.select_by_events(self.cell_names, session_event_counts, session_durations)
+        print(f'{np.count_nonzero(selected)} of {len(self.cell_names)} cells selected')
+        return selected
+
+    # table of tuning metrics (see tuning_metrics) of every cell in every session of every day from the arrays made by
+    # prepare_sessions, sessions are numbered in order through the days (dense spike trains are made one session at a time)
+    # ratemaps of plot_type_arg are reused, the other ratemaps the metrics need are computed here
+    # cancel_token (a CancellationToken) is checked before each session
+    def get_tuning_metrics(self, day_spike_trains, day_geometries, day_ratemaps, plot_type_arg=None, num_shuffles=0, seed=None,
+                           cancel_token=None):
+        session_metrics = []
+        for day_idx in range(self.num_days):
+            for session_idx in range(self.sessions_in_each_day[day_idx]):
+                check_cancelled(cancel_token)
+                ratemaps = day_ratemaps[day_idx][session_idx]
+                geometry = day_geometries[day_idx][session_idx]
+                session_metrics.append(tuning_metrics.get_session_metrics(geometry,
+                                                                          day_spike_trains[day_idx][session_idx].toarray(),
+                                                                          None if ratemaps is None else {plot_type_arg: ratemaps},
+                                                                          num_shuffles, seed))
+                # occupancy of one session at a time is kept
+                geometry.clear_occupancy()
+        return tuning_metrics.get_metrics_table(self.cell_names, session_metrics)
+
+    # save the table from get_tuning_metrics to output_path as csv or parquet
+    def save_tuning_metrics(self, output_path, metrics_format, day_spike_trains, day_geometries, day_ratemaps, plot_type_arg=None,
+                            num_shuffles=0, seed=None, cancel_token=None):
+        metrics_path = tuning_metrics.get_metrics_path(output_path, metrics_format)
+        table = self.get_tuning_metrics(day_spike_trains, day_geometries, day_ratemaps, plot_type_arg, num_shuffles, seed,
+                                        cancel_token)
+        tuning_metrics.save_metrics_table(table, metrics_path)
+        print(f'Tuning metrics saved to {metrics_path}')
+        return table
+
+    # compute and save the tuning metrics of every cell in every session to output_folder_name without drawing any figures
+    # ex. to screen the cells tracked over all days and only plot the cells that are tuned
+    def export_tuning_metrics(self, output_folder_name, metrics_format='csv', num_shuffles=0, seed=None, cancel_token=None):
+        output_path = os.path.join(self.output_folder_path, output_folder_name)
+        if not os.path.exists(output_path):
+            os.mkdir(output_path)
+        day_spike_trains, day_geometries, day_ratemaps = self.prepare_sessions(None, cancel_token)
+        return self.save_tuning_metrics(output_path, metrics_format, day_spike_trains, day_geometries, day_ratemaps,
+                                        num_shuffles=num_shuffles, seed=seed, cancel_token=cancel_token)
+
+    # record the figures figure_output has written since the last call in the manifest
+    def record_saved_figures(self, manifest):
+        for figure_name in self.figure_output.pop_saved_figures():
+            manifest.figure_saved(figure_name)
+
+    # figure with a grid of axes -> one row per session and one column per day, axes[session_idx][day_idx]
+    # axes of sessions a day does not have are turned off
+    def create_LR_figure(self, plot_type_arg):
+        num_rows = self.max_row_num
+        num_cols = self.num_days
+        figure = plt.figure()
+        gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
+        polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
+        axes = []
+        for row_idx in range(num_rows):
+            if plot_type_arg in polar_plots:
+                axes.append([figure.add_subplot(gs[row_idx, col_idx], projection="polar") for col_idx in range(num_cols)])
+            else:
+                axes.append([figure.add_subplot(gs[row_idx, col_idx]) for col_idx in range(num_cols)])
+        for day_idx in range(self.num_days):
+            # exclude the axis that will not be plotted for that day 
+            for row_idx in range(self.sessions_in_each_day[day_idx], num_rows):
+                axes[row_idx][day_idx].axis('off')
+        return figure, axes
+
+    # draw the plots of one cell on the axes from create_LR_figure
+    # returns the (day index, session index, axis) of every plot drawn so they can be updated with another cell
+    def draw_LR_figure(self, axes, cell_idx, plot_type_arg, day_spike_trains, day_geometries, day_ratemaps, **kwargs):
+        drawn_axes = []
+        for day_idx in range(self.num_days):
+            for session_idx in range(self.sessions_in_each_day[day_idx]):
+                axis_to_plot = axes[session_idx][day_idx]
+                axis_to_plot.axis('off')
+
+                spike_train = day_spike_trains[day_idx][session_idx][cell_idx][:-1]
+                geometry = day_geometries[day_idx][session_idx]
+                ratemaps = day_ratemaps[day_idx][session_idx]
+                head_x, head_y, angles = geometry.head_x, geometry.head_y, geometry.angles
+                # plot based on provided arg type -> LR plots cant be made with barriers yet
+                if (plot_type_arg == 'spike_plot')  & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs):
+                    self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'],
+                    spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
+                
+                elif (plot_type_arg == 'hd_curve') & ('hd_line_color' in kwargs):
+                    self.splt.hd_ratemap_subplot(ratemaps[cell_idx], line_color= kwargs['hd_line_color'],
+                                                 destination=None, axis=axis_to_plot)
                     
-                    elif (plot_type_arg == 'ebc_boundary'):
-                        boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(head_x, head_y, angles)
-                        boundary_bearings, boundary_distances = boundary_bearings[:-1], boundary_distances[:-1]
-                        self.splt.ebc_subplot(boundary_bearings, boundary_distances, spike_train, destination= None, axis= axis_to_plot)
+                elif (plot_type_arg == 'heatmap'):
+                    self.splt.heatmap_ratemap_subplot(ratemaps[cell_idx], destination=None, axis= axis_to_plot, smoothed=True)
                 
+                elif (plot_type_arg == 'ebc_boundary'):
+                    self.splt.ebc_ratemap_subplot(ratemaps[cell_idx], destination= None, axis= axis_to_plot, smoothed=True)
 
-                
-                # elif ((plot_type_arg == 'ebc_barrier') & ('barrier_coords' in kwargs)):
-                #     if ((kwargs['barrier_coords'][session_idx][0][0] is not None) & (kwargs['barrier_coords'][session_idx][1][0] is not None)):
-
-                #         barrier_start = kwargs['barrier_coords'][session_idx][0]
-                #         barrier_end = kwargs['barrier_coords'][session_idx][1]
-
-                #         barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(head_x, head_y, angles, barrier_start, barrier_end)
-                #         barrier_bearings, barrier_distances = barrier_bearings[:-1], barrier_distances[:-1]
-                #         self.splt.ebc_subplot(barrier_bearings, barrier_distances, spike_train, destination=None, axis= axis_to_plot)
-
-                # elif ((plot_type_arg == 'ebc_boundary_barrier')):
-
-                #     if ((kwargs['barrier_coords'][session_idx][0][0] is not None) &
-                #             (kwargs['barrier_coords'][session_idx][1][0] is not None)):
-                #         barrier_start = kwargs['barrier_coords'][session_idx][0]
-                #         barrier_end = kwargs['barrier_coords'][session_idx][1]
-                #         boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(head_x, head_y, angles)
-                #         boundary_bearings, boundary_distances = boundary_bearings[:-1], boundary_distances[:-1]
-                #         barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(head_x, head_y, angles, barrier_start, barrier_end)
-                #         barrier_bearings, barrier_distances = barrier_bearings[:-1], barrier_distances[:-1]
-                #         all_bearings = np.concatenate([boundary_bearings, barrier_bearings],axis=1)
-                #         all_dists = np.concatenate([boundary_distances, barrier_distances],axis=1)
-                #         all_bearings, all_dists = all_bearings[:-1], all_dists[:-1]
-                #         self.splt.ebc_subplot(all_bearings, all_dists,
-                #                                 spike_train, destination=None, axis=axis_to_plot)    
-            destination = os.path.join(output_path, f'{cell}')
-            self.signals.figure_closed.emit()
-            self.signals.figure_plotted.emit(figure)
-            self.signals.cell_plotted.emit(cell)
-            figure.tight_layout(pad=1)
-            figure.savefig(destination,dpi=300)
-            plt.close()
-
-
-    def get_LR_plots_all_days_have_cell(self, output_folder_name, plot_type_arg, **kwargs):
-        output_path = os.path.join(self.main_dir, output_folder_name)
+                else:
+                    continue
+                drawn_axes.append((day_idx, session_idx, axis_to_plot))
+        return drawn_axes
+
+    # replace the data of the plots drawn by draw_LR_figure with the data of another cell
+    def update_LR_figure(self, drawn_axes, cell_idx, plot_type_arg, day_spike_trains, day_geometries, day_ratemaps):
+        for day_idx, session_idx, axis in drawn_axes:
+            ratemaps = day_ratemaps[day_idx][session_idx]
+            if plot_type_arg == 'spike_plot':
+                geometry = day_geometries[day_idx][session_idx]
+                spike_train = day_spike_trains[day_idx][session_idx][cell_idx][:-1]
+                self.splt.update_path_spike_plot_subplot(geometry.head_x, geometry.head_y, geometry.angles, spike_train, axis)
+            elif plot_type_arg == 'hd_curve':
+                self.splt.update_hd_ratemap_subplot(ratemaps[cell_idx], axis)
+            elif plot_type_arg == 'heatmap':
+                self.splt.update_heatmap_ratemap_subplot(ratemaps[cell_idx], axis, smoothed=True)
+            elif plot_type_arg == 'ebc_boundary':
+                self.splt.update_ebc_ratemap_subplot(ratemaps[cell_idx], axis, smoothed=True)
+
+    # file name the figure of a cell is saved as (the multi-page pdf when all figures are saved to one file)
+    def get_figure_name(self, cell):
+        return self.figure_output.get_figure_name(cell)
+
+    # manifest of the figures in output_path for a run with this plot type and options
+    # and the cells selected by cell_selection (a CellSelection, None for every cell)
+    def get_manifest(self, output_path, plot_type_arg, kwargs, cell_selection=None):
+        input_files = [session[file_key] for sessions in self.day_sessions for session in sessions
+                       for file_key in ['dlc_file', 'spike_file', 'frame_time_file']]
+        options = {'plots': [plot_type_arg], 'plot_options': kwargs, 'framerate': self.framerate,
+                   'arena': [self.arena_x_length, self.arena_y_length], 'output': self.figure_output.get_options()}
+        # options without a selection are left as they were, so folders plotted before keep their figures
+        if cell_selection is not None:
+            options['cell_selection'] = cell_selection.get_options()
+        return RunManifest(output_path, get_inputs_hash(input_files), get_options_hash(options))
+
+
+    def get_LR_plots_all_days_have_cell(self, output_folder_name, plot_type_arg, figure_output=None, **kwargs):
+        output_path = os.path.join(self.output_folder_path, output_folder_name)
         num_rows = self.max_row_num
         num_cols = self.num_days
         if not os.path.exists(output_path):
             os.mkdir(output_path)
-        for cell in self.cell_names:
-            print(cell)
-            figure = plt.figure(figsize=(5,5))
-            plt.rcParams.update({'figure.max_open_warning': 0})
-            axes = []
-            ax_indices = []
-            gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
-            polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
-            for row_idx in range(num_rows):
-                for col_idx in range(num_cols):
-                    if plot_type_arg in polar_plots:
-                        axes.append(figure.add_subplot(gs[row_idx, col_idx], projection="polar"))
-                    else:
-                        axes.append(figure.add_subplot(gs[row_idx, col_idx]))
-                    ax_indices.append([row_idx, col_idx])
-            day_has_cell = True
-
-            for day_idx in range(0, len(self.day_and_sessions_data)): 
-                for session in range(0, len(self.day_and_sessions_data[day_idx][1])):
-
-                    timestamps = self.get_timestamps(day_idx, session)
-                    cell_df = self.day_and_sessions_data[day_idx][1][session]
-                    cell_event_timestamps = cell_df['Time (s)'][cell_df[' Cell Name']==cell]
-                    spike_train = np.zeros_like(timestamps)
-
-                    #exclude cell from being plotted if not all days contain a spike
-                    if len(cell_event_timestamps) == 0:
-                        day_has_cell = False
-                        break
-
-                    if cell_event_timestamps is not None:
-                        for event_ts in cell_event_timestamps:
-                            abs_diffs= abs(timestamps - event_ts)
-                            min_idx = np.argmin(abs_diffs, axis=0)
-                            spike_train[min_idx] = 1
-
-                    head_x, head_y, angles = self.get_head_and_angles(day_idx, session)
-                    head_x, head_y, angles = head_x[:-1], head_y[:-1], angles[:-1]
-                    # find index in indices list to find the axis to plot on
-                    ax_to_plot_index = next((i for i, sublist in enumerate(ax_indices) if sublist == [session, day_idx]), None)
-                    axis_to_plot = axes[ax_to_plot_index]
-                    axis_to_plot.axis('off')
-                    # plot based on provided arg type -> LR plots cant be made with barriers yet
-                    if (plot_type_arg == 'spike_plot')  & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs):
-                        self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'],
-                        spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
+        self.figure_output = figure_output if figure_output is not None else FigureOutput()
+        day_spike_trains, day_geometries, day_ratemaps = self.prepare_sessions(plot_type_arg)
+        self.figure_output.open(output_path)
+        # the background writer is stopped and a multi-page pdf thrown away if a figure fails, so no writer thread is left running
+        try:
+            for cell_idx, cell in enumerate(self.cell_names):
+                print(cell)
+                figure = plt.figure(figsize=(5,5))
+                try:
+                    axes = []
+                    ax_indices = []
+                    gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
+                    polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
+                    for row_idx in range(num_rows):
+                        for col_idx in range(num_cols):
+                            if plot_type_arg in polar_plots:
+                                axes.append(figure.add_subplot(gs[row_idx, col_idx], projection="polar"))
+                            else:
+                                axes.append(figure.add_subplot(gs[row_idx, col_idx]))
+                            ax_indices.append([row_idx, col_idx])
+                    day_has_cell = True
+
+                    for day_idx in range(0, self.num_days): 
+                        for session in range(0, self.sessions_in_each_day[day_idx]):
+
+                            spike_train = day_spike_trains[day_idx][session][cell_idx]
+
+                            #exclude cell from being plotted if not all days contain a spike
+                            if not spike_train.any():
+                                day_has_cell = False
+                                break
+
+                            spike_train = spike_train[:-1]
+                            geometry = day_geometries[day_idx][session]
+                            ratemaps = day_ratemaps[day_idx][session]
+                            head_x, head_y, angles = geometry.head_x, geometry.head_y, geometry.angles
+                            # find index in indices list to find the axis to plot on
+                            ax_to_plot_index = next((i for i, sublist in enumerate(ax_indices) if sublist == [session, day_idx]), None)
+                            axis_to_plot = axes[ax_to_plot_index]
+                            axis_to_plot.axis('off')
+                            # plot based on provided arg type -> LR plots cant be made with barriers yet
+                            if (plot_type_arg == 'spike_plot')  & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs):
+                                self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'],
+                                spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
                     
-                    elif (plot_type_arg == 'hd_curve') & ('hd_line_color' in kwargs):
-                        axis_to_plot.axis('on')
-                        self.splt.hd_curve_subplot(angles, spike_train, line_color= kwargs['hd_line_color'], destination=None, axis=axis_to_plot)
+                            elif (plot_type_arg == 'hd_curve') & ('hd_line_color' in kwargs):
+                                axis_to_plot.axis('on')
+                                self.splt.hd_ratemap_subplot(ratemaps[cell_idx], line_color= kwargs['hd_line_color'],
+                                                             destination=None, axis=axis_to_plot)
 
-                    elif (plot_type_arg == 'heatmap'):
-                        self.splt.heatmap_subplot(head_x, head_y, spike_train, destination=None, axis= axis_to_plot)
+                            elif (plot_type_arg == 'heatmap'):
+                                self.splt.heatmap_ratemap_subplot(ratemaps[cell_idx], destination=None, axis= axis_to_plot, smoothed=True)
                     
-                    elif (plot_type_arg == 'ebc_boundary'):
-                        boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(head_x, head_y, angles)
-                        boundary_bearings, boundary_distances = boundary_bearings[:-1], boundary_distances[:-1]
-                        self.splt.ebc_subplot(boundary_bearings, boundary_distances, spike_train, destination= None, axis= axis_to_plot)
-            if day_has_cell:
-                destination = os.path.join(output_path, f'{cell}')
-                figure.tight_layout(pad=1)
-                figure.savefig(destination,dpi=300)
-                self.signals.figure_closed.emit()
-                self.signals.figure_plotted.emit(figure)
-                self.signals.cell_plotted.emit(cell)
-                plt.close()
+                            elif (plot_type_arg == 'ebc_boundary'):
+                                self.splt.ebc_ratemap_subplot(ratemaps[cell_idx], destination= None, axis= axis_to_plot, smoothed=True)
+                    if day_has_cell:
+                        figure.tight_layout(pad=1)
+                        self.figure_output.save(figure, output_path, cell)
+                        self.signals.figure_closed.emit()
+                        self.signals.figure_plotted.emit(figure)
+                        self.signals.cell_plotted.emit(cell)
+                finally:
+                    plt.close(figure)
+        except BaseException:
+            self.figure_output.close(keep=False)
+            raise
+        self.figure_output.close()
 
 
 
@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import sparse
+
+# class to hold which bins are occupied on each video frame of a session and the total time spent in each bin
+# bins are stored as flat (frame, bin) index pairs instead of a frames x bins array, so only the bins occupied on each frame are
+# kept -> memory still grows with the length of the session: one pair per frame for position and head direction bins, and for
+# EBC bins one pair for every bin seen by a wall point on a frame (up to frames x wall points, ~33 pairs per frame on a
+# 60 cm arena, so ~20 MB of indices for a 75k frame session), only the occupancy (occ) is one value per bin
+# occupancy is computed once when the object is made, and every cell only needs its spike counts summed into the same bins
+# frame_duration is the time (s) of one frame, or an array with the time of every frame when frames are not evenly spaced
+# bin_edges optionally holds the lower bin edges along each dimension for plotting
+class OccupancyBins(object):
+    def __init__(self, frame_idx, bin_idx, shape, frame_duration, bin_edges=None):
+        self.frame_idx = frame_idx
+        self.bin_idx = bin_idx
+        self.shape = tuple(shape)
+        self.bin_edges = bin_edges
+        self._occupancy_matrix = None
+        self._frame_matrix = None
+        self.num_bins = int(np.prod(self.shape))
+        # time in seconds spent in each bin
+        if np.ndim(frame_duration) == 0:
+            self.occ = np.bincount(self.bin_idx, minlength=self.num_bins).reshape(self.shape) * frame_duration
+        else:
+            self.occ = np.bincount(self.bin_idx, weights=np.asarray(frame_duration, dtype=float)[self.frame_idx],
+                                   minlength=self.num_bins).reshape(self.shape)
+
+    # sum the events of a spike train into the occupied bins of each frame
+    def spike_counts(self, spike_train):
+        weights = np.asarray(spike_train, dtype=float)[self.frame_idx]
+        return np.bincount(self.bin_idx, weights=weights, minlength=self.num_bins).reshape(self.shape)
+
+    # divide events by occupancy time to get a ratemap (bins that were never occupied are nan)
+    def ratemap(self, spike_train):
+        return self.spike_counts(spike_train) / self.occ
+
+    # sparse bins x frames matrix with a 1 for every bin occupied on a frame -> made on first use and kept, it holds every
+    # (frame, bin) pair again (~1.5x the memory of the indices)
+    def occupancy_matrix(self, num_frames):
+        if (self._occupancy_matrix is None) or (self._occupancy_matrix.shape[1] != num_frames):
+            in_frames = self.frame_idx < num_frames
+            self._occupancy_matrix = sparse.csr_matrix((np.ones(np.count_nonzero(in_frames)),
+                                                        (self.bin_idx[in_frames], self.frame_idx[in_frames])),
+                                                       shape=(self.num_bins, num_frames))
+        return self._occupancy_matrix
+
+    # ratemaps of many cells at once -> spike_trains is a cells x frames array, a scipy sparse matrix or SparseSpikeTrains
+    # the spike counts of all cells come from one sparse matrix product over the frames with events, so the spike trains are
+    # never copied into a dense float array, returns an array of shape (cells, *self.shape)
+    def ratemaps(self, spike_trains):
+        if hasattr(spike_trains, 'tocsr'):
+            spike_trains = spike_trains.tocsr()
+        else:
+            spike_trains = sparse.csr_matrix(np.atleast_2d(np.asarray(spike_trains)))
+        spike_counts = (spike_trains @ self.occupancy_matrix(spike_trains.shape[1]).T).toarray()
+        return spike_counts.reshape((spike_trains.shape[0],) + self.shape) / self.occ
+
+    # sparse frames x bins matrix (occupancy_matrix transposed) to look up the bins of any frame -> made on first use and kept
+    # next to occupancy_matrix, so the pairs are held a third time (only used by the shuffles)
+    def frame_matrix(self, num_frames):
+        if (self._frame_matrix is None) or (self._frame_matrix.shape[0] != num_frames):
+            self._frame_matrix = self.occupancy_matrix(num_frames).T.tocsr()
+        return self._frame_matrix
+
+    # spike counts of circularly shifted copies of one spike train -> the events of the spike train are moved forward by
+    # each of shifts (frames), wrapping around the end of the session, and summed into the bins occupied on their new frames
+    # only the frames with events are shifted, so every shift costs as much as the number of events and not the session length
+    # returns an array of shape (len(shifts), *self.shape)
+    def shifted_spike_counts(self, spike_train, shifts):
+        num_frames = len(spike_train)
+        shifts = np.asarray(shifts)
+        event_frames = np.flatnonzero(spike_train)
+        event_counts = np.asarray(spike_train, dtype=float)[event_frames]
+        shifted_frames = (event_frames[np.newaxis, :] + shifts[:, np.newaxis]) % num_frames
+        shift_rows = np.repeat(np.arange(len(shifts)), len(event_frames))
+        shifted_trains = sparse.csr_matrix((np.tile(event_counts, len(shifts)), (shift_rows, shifted_frames.ravel())),
+                                           shape=(len(shifts), num_frames))
+        spike_counts = (shifted_trains @ self.frame_matrix(num_frames)).toarray()
+        return spike_counts.reshape((len(shifts),) + self.shape)
@@ -1,5 +1,6 @@
 import numpy as np
 from scipy.stats import zscore
+from src.plotting.occupancy import OccupancyBins
 
 ##** utility functions to use in plots-> includes calculations for spike/ebc plots **##
 
@@ -22,31 +23,11 @@ def calc_positions(tracking_data):
     positions = np.stack((left_ear_x,left_ear_y,right_ear_x,right_ear_y)).T
     
     #try to detect and remove outliers
-    for i in range(4):
-        zscores = np.abs(zscore(positions[:,i]))
-        for j in np.where(zscores>2)[0]:
-            positions[j,i] = 0 
+    zscores = np.abs(zscore(positions, axis=0))
+    positions[zscores > 2] = 0
     
     #linear interpolation of nondetects
-    for i in range(len(positions)):
-        for j in range(4):
-            if positions[i][j] == 0:
-                x = 0
-                count = 1
-                while x == 0:
-                    if i+count < len(positions):
-                        if positions[i+count][j] == 0:
-                            count +=1
-                        elif positions[i+count][j] > 0:
-                            if i>0:
-                                positions[i][j] = positions[i-1][j] + (positions[i+count][j] - positions[i-1][j])/count
-                                x=1
-                            else:
-                                positions[i][j] = positions[i+count][j]
-                                x=1
-                    else:
-                        positions[i][j] = positions[i-1][j]
-                        x=1
+    positions = interpolate_nondetects(positions)
     
     #compute head direction from ear positions (then add 90 so hd = 0deg when animal faces East)
     angles = np.rad2deg(np.arctan2(positions[:,3] - positions[:,1], positions[:,2] - positions[:,0]))
@@ -59,15 +40,92 @@ def calc_positions(tracking_data):
     return head_x, head_y, angles
 
 
-def ego_boundary_measurements(head_x,head_y,angles):
-    ''' compute the ego bearings and distances of points along the walls '''
+# fill nondetects (zeros) in each column of the position array
+# frames in a gap are stepped linearly from the last detected value so the final frame of the gap reaches the next detected value
+# gaps at the start of the session take the first detected value and gaps at the end take the last detected value
+def interpolate_nondetects(positions):
+    positions = np.array(positions, dtype=float)
+    positions[positions == 0] = np.nan
+    frames = np.arange(len(positions))
+    for col in range(positions.shape[1]):
+        column = positions[:,col]
+        detected = ~np.isnan(column)
+        if not detected.any():
+            column[:] = 0
+            continue
+        detected_frames = frames[detected]
+        missing_frames = frames[~detected]
+        #index of the next detected frame after each missing frame, and the one before it
+        next_idx = np.searchsorted(detected_frames, missing_frames)
+        prev_idx = next_idx - 1
+        has_prev = prev_idx >= 0
+        has_next = next_idx < len(detected_frames)
+        prev_frames = detected_frames[np.clip(prev_idx, 0, None)]
+        next_frames = detected_frames[np.clip(next_idx, None, len(detected_frames)-1)]
+        prev_vals = column[prev_frames]
+        next_vals = column[next_frames]
+        in_gap = has_prev & has_next
+        gap_length = np.where(in_gap, next_frames - prev_frames - 1, 1)
+        steps = (missing_frames - prev_frames) * (next_vals - prev_vals) / gap_length
+        #edge fill for gaps without a detected frame before or after them
+        column[missing_frames] = np.where(in_gap, prev_vals + steps, np.where(has_prev, prev_vals, next_vals))
+    return positions
+
+
+def ego_point_measurements(point_x,point_y,head_x,head_y,angles,chunk_size=None,dtype=np.float64,bin_sizes=None,dist_cutoff=None):
+    ''' compute the ego bearings and distances (frames x points) from the animal to a set of fixed points
+    frames are processed in blocks of chunk_size so only chunk_size x points values are computed at a time
+    if bin_sizes = [bearing_bin_size, dist_bin_size] is given, bearing and distance bin indices are returned instead
+    of raw values (uint8 or uint16) and points farther than dist_cutoff get the largest value of the bin dtype '''
+    
+    point_x = np.asarray(point_x, dtype=float)
+    point_y = np.asarray(point_y, dtype=float)
+    num_frames = len(head_x)
+    if (chunk_size is None) or (chunk_size < 1):
+        chunk_size = max(num_frames, 1)
+    
+    if bin_sizes is None:
+        bearings = np.empty((num_frames,len(point_x)), dtype=dtype)
+        dists = np.empty((num_frames,len(point_x)), dtype=dtype)
+    else:
+        if dist_cutoff is None:
+            raise ValueError('A distance cutoff is needed to bin ego bearings and distances.')
+        bearing_bin_size, dist_bin_size = bin_sizes
+        bearing_bin_num = int(np.ceil(360 / bearing_bin_size))
+        dist_bin_num = int(np.ceil(dist_cutoff / dist_bin_size))
+        bin_dtype = np.uint8 if max(bearing_bin_num, dist_bin_num) < np.iinfo(np.uint8).max else np.uint16
+        out_of_cutoff = np.iinfo(bin_dtype).max
+        bearings = np.empty((num_frames,len(point_x)), dtype=bin_dtype)
+        dists = np.empty((num_frames,len(point_x)), dtype=bin_dtype)
+    
+    for start in range(0, num_frames, chunk_size):
+        stop = min(start + chunk_size, num_frames)
+        #vectors for distance from animal along x and y dimensions
+        point_dx = point_x[np.newaxis,:] - np.asarray(head_x[start:stop], dtype=float)[:,np.newaxis]
+        point_dy = point_y[np.newaxis,:] - np.asarray(head_y[start:stop], dtype=float)[:,np.newaxis]
+        #compute egocentric bearings and distances
+        chunk_bearings = (np.rad2deg(np.arctan2(point_dy,point_dx))%360 - np.asarray(angles[start:stop])[:,np.newaxis])%360
+        chunk_dists = np.sqrt(point_dx**2 + point_dy**2)
+        if bin_sizes is None:
+            bearings[start:stop] = chunk_bearings
+            dists[start:stop] = chunk_dists
+        else:
+            #bearings of exactly 360 (from rounding) go in the last bin, same as np.digitize
+            bearings[start:stop] = np.minimum(chunk_bearings // bearing_bin_size, bearing_bin_num - 1)
+            chunk_dist_bins = chunk_dists // dist_bin_size
+            chunk_dist_bins[chunk_dists > dist_cutoff] = out_of_cutoff
+            dists[start:stop] = chunk_dist_bins
     
+    return bearings, dists
+
+# get the points along the walls of the arena
+# walls are defined as 1cm beyond the animal's min and max x and y positions
+def get_wall_points(head_x,head_y):
     #how many points to break the walls into along x and y dimensions
     x_bins = 30
     y_bins = 30
     
     #linear interpolate "wall points" between each corner
-    #walls are defined as 1cm beyond the animal's min and max x and y positions
     xcoords = np.linspace(np.min(head_x)-1.,np.max(head_x)+1.,x_bins+1,endpoint=True)
     ycoords = np.linspace(np.min(head_y)-1.,np.max(head_y)+1.,y_bins+1,endpoint=True)
     
@@ -76,24 +134,17 @@ def ego_boundary_measurements(head_x,head_y,angles):
     w3 = np.stack((xcoords,np.repeat(np.min(ycoords)-1.,x_bins+1)))
     w2 = np.stack((np.repeat(np.max(xcoords)+1.,y_bins+1),ycoords))
     w4 = np.stack((np.repeat(np.min(xcoords)-1.,y_bins+1),ycoords))
-    all_walls = np.concatenate((w1,w2,w3,w4),axis=1)
-    
-    #vectors for distance from animal along x and y dimensions
-    wall_x = np.zeros((len(all_walls[0]),len(head_x)))
-    wall_y = np.zeros((len(all_walls[1]),len(head_y)))
-    
-    #calculate the distances
-    for i in range(len(head_x)):
-        wall_x[:,i] = all_walls[0] - head_x[i]
-        wall_y[:,i] = all_walls[1] - head_y[i]
-        
-    #compute egocentric bearings and distances
-    wall_bearings = (np.rad2deg(np.arctan2(wall_y,wall_x))%360 - angles)%360
-    wall_dists = np.sqrt(wall_x**2 + wall_y**2)
+    return np.concatenate((w1,w2,w3,w4),axis=1)
+
+def ego_boundary_measurements(head_x,head_y,angles,chunk_size=None,dtype=np.float64,bin_sizes=None,dist_cutoff=None):
+    ''' compute the ego bearings and distances of points along the walls
+    see ego_point_measurements for the chunk_size, dtype and binning options '''
     
-    return wall_bearings.T, wall_dists.T
+    all_walls = get_wall_points(head_x,head_y)
+    return ego_point_measurements(all_walls[0],all_walls[1],head_x,head_y,angles,
+                                  chunk_size=chunk_size,dtype=dtype,bin_sizes=bin_sizes,dist_cutoff=dist_cutoff)
 
-def inserted_barrier_measurements(head_x,head_y,angles,barrier_coord_1,barrier_coord_2):
+def inserted_barrier_measurements(head_x,head_y,angles,barrier_coord_1,barrier_coord_2,chunk_size=None,dtype=np.float64,bin_sizes=None,dist_cutoff=None):
     ''' similar to ego_boundary_measurements but for a single inserted barrier with endpoints specified
     barrier_coord_1 = [x,y]
     barrier_coord_2 = [x,y] '''
@@ -104,23 +155,56 @@ def inserted_barrier_measurements(head_x,head_y,angles,barrier_coord_1,barrier_c
     #linear interpolate "barrier points" between the ends of the barrier
     barrier_xcoords = np.linspace(barrier_coord_1[0],barrier_coord_2[0],barrier_bins+1,endpoint=True)
     barrier_ycoords = np.linspace(barrier_coord_1[1],barrier_coord_2[1],barrier_bins+1,endpoint=True)
+    
+    return ego_point_measurements(barrier_xcoords,barrier_ycoords,head_x,head_y,angles,
+                                  chunk_size=chunk_size,dtype=dtype,bin_sizes=bin_sizes,dist_cutoff=dist_cutoff)
 
+# bin egocentric bearings and distances for EBC ratemaps
+# wall points farther than the distance cutoff are given a bin of -1 so they can be discarded
+def get_ebc_bins(bearings, distances, ebc_cutoff, bearing_bin_size=3, dist_bin_size=2.5):
+    bearing_bins = (np.digitize(bearings, bins=np.arange(0,360,bearing_bin_size)) - 1).astype(np.int16)
+    dist_bins = (np.digitize(distances, bins=np.arange(0,np.max(distances),dist_bin_size)) - 1).astype(np.int16)
+    bearing_bins[distances > ebc_cutoff] = -1
+    dist_bins[distances > ebc_cutoff] = -1
+    return bearing_bins, dist_bins
 
-    #vectors for distance from animal along x and y dimensions
-    barrier_x = np.zeros((len(barrier_xcoords),len(head_x)))
-    barrier_y = np.zeros((len(barrier_ycoords),len(head_y)))
-    
-    #calculate the distances
-    for i in range(len(head_x)):
-        barrier_x[:,i] = barrier_xcoords - head_x[i]
-        barrier_y[:,i] = barrier_ycoords - head_y[i]
-        
-    #compute egocentric bearings and distances
-    barrier_bearings = (np.rad2deg(np.arctan2(barrier_y,barrier_x))%360 - angles)%360
-    barrier_dists = np.sqrt(barrier_x**2 + barrier_y**2)
-    
-    return barrier_bearings.T, barrier_dists.T
+# turn binned EBC bearings and distances (frames x wall points) into occupancy for the bearing x distance bins
+# a bin seen by several wall points on the same frame is only counted once for that frame, so the occupancy keeps up to
+# frames x wall points (frame, bin) pairs (see OccupancyBins)
+# frame_durations gives the time (s) of each frame, every frame lasts 1 / framerate if it is not provided
+def get_ebc_occupancy(bearing_bins, dist_bins, ebc_cutoff, framerate, bearing_bin_size=3, dist_bin_size=2.5, frame_durations=None):
+    bearing_bin_num = int(np.ceil(360 / bearing_bin_size))
+    dist_bin_num = int(np.ceil(ebc_cutoff / dist_bin_size))
+    num_bins = bearing_bin_num * dist_bin_num
+    in_cutoff = (dist_bins >= 0) & (dist_bins < dist_bin_num)
+    frame_idx = np.nonzero(in_cutoff)[0].astype(np.int64)
+    flat_bins = bearing_bins[in_cutoff].astype(np.int64) * dist_bin_num + dist_bins[in_cutoff]
+    frame_bin_pairs = np.unique(frame_idx * num_bins + flat_bins)
+    return OccupancyBins((frame_bin_pairs // num_bins).astype(np.int32), (frame_bin_pairs % num_bins).astype(np.int32),
+                         (bearing_bin_num, dist_bin_num), 1./framerate if frame_durations is None else frame_durations)
+
+# occupancy for bins where every frame falls in exactly one bin (ex. position or head direction bins)
+# bin_indices is a list with the bin index of every frame along each dimension of shape, indices are wrapped like python indexing
+def get_frame_occupancy(bin_indices, shape, frame_durations, bin_edges=None):
+    wrapped = [np.mod(bins, size) for bins, size in zip(bin_indices, shape)]
+    flat_bins = np.ravel_multi_index(wrapped, shape).astype(np.int32)
+    frame_idx = np.arange(len(flat_bins), dtype=np.int32)
+    return OccupancyBins(frame_idx, flat_bins, shape, frame_durations, bin_edges)
 
+# occupancy for position heatmaps -> binsize (cm) square bins from the minimum head position
+def get_heatmap_occupancy(head_x, head_y, frame_durations, binsize=3.):
+    xbin_edges = np.arange(np.min(head_x),np.max(head_x),binsize)
+    ybin_edges = np.arange(np.min(head_y),np.max(head_y),binsize)
+    xbins = np.digitize(head_x, bins=xbin_edges) - 1
+    ybins = np.digitize(head_y, bins=ybin_edges) - 1
+    return get_frame_occupancy([xbins, ybins], (len(xbin_edges), len(ybin_edges)), frame_durations,
+                               [xbin_edges, ybin_edges])
+
+# occupancy for head direction curves -> binsize (degrees) bins from 0 to 360
+def get_hd_occupancy(angles, frame_durations, binsize=12.):
+    bin_edges = np.arange(0,360,binsize)
+    angle_bins = np.digitize(angles,bins=bin_edges) - 1
+    return get_frame_occupancy([angle_bins], (len(bin_edges),), frame_durations, [bin_edges])
 
 #scale head and angle pixel positions to arena by taking the minimum x and y values and 
 def get_head_and_angles(dlc_file, arena_x_length, arena_y_length):
@@ -136,11 +220,18 @@ def frame_num_to_seconds(framerate, frame_num):
     return frame_num / framerate
 
 # create array of timestamps to use 
+# sessions with a frame time (LOF) file use the recorded time of every frame, other sessions use frame / framerate
 def get_timestamps(sessions_data, session_idx, framerate):
     dlc_file = sessions_data[session_idx][0]
-    length = len(dlc_file)
+    frame_times = sessions_data[session_idx][2] if len(sessions_data[session_idx]) > 2 else None
+    return get_frame_timestamps(len(dlc_file), framerate, frame_times)
+
+# timestamps (s) of num_frames video frames starting at 0
+def get_frame_timestamps(num_frames, framerate, frame_times=None):
+    if frame_times is not None:
+        return frame_times_to_timestamps(frame_times, num_frames, framerate)
 #     #get number of frames from length of DLC file
-    frames = [frame for frame in range(0, length)]
+    frames = [frame for frame in range(0, num_frames)]
     #convert frames to timestamps
     timestamp_data = [float(frame_num_to_seconds(framerate, frame)) for frame in frames]
 
@@ -150,3 +241,42 @@ def get_timestamps(sessions_data, session_idx, framerate):
     timestamps = np.array(timestamp_data).flatten()
 
     return timestamps
+
+# convert the epoch ms frame times of an LOF file to seconds from the first frame
+# dropped frames show up as longer gaps between frame times, so events are still matched to the right frame
+# if the LOF file and DLC file do not have the same number of frames, extra frame times are ignored and
+# missing frame times at the end are filled in using the framerate
+def frame_times_to_timestamps(frame_times, num_frames, framerate):
+    frame_times = np.asarray(frame_times, dtype=np.float64)
+    timestamps = (frame_times - frame_times[0]) / 1000.
+    # clock resets or repeated times would break the sorted search used to align events
+    timestamps = np.maximum.accumulate(timestamps)
+    if len(timestamps) != num_frames:
+        print(f'Frame time file has {len(timestamps)} frames but the DLC file has {num_frames} frames.')
+        if len(timestamps) > num_frames:
+            timestamps = timestamps[:num_frames]
+        else:
+            num_missing = num_frames - len(timestamps)
+            timestamps = np.concatenate([timestamps, timestamps[-1] + np.arange(1, num_missing + 1) / framerate])
+    return timestamps
+
+# time (s) each frame lasts -> the time until the next frame, the last frame gets the median frame time
+def get_frame_durations(timestamps, framerate):
+    if len(timestamps) < 2:
+        return np.full(len(timestamps), 1./framerate)
+    durations = np.diff(timestamps)
+    return np.append(durations, np.median(durations))
+
+
+# find the video frame closest in time to each event with a sorted search over the frame timestamps
+# ties go to the earlier frame (same as taking argmin of the absolute differences), also between frames with the same time
+def nearest_frame_indices(timestamps, event_timestamps):
+    timestamps = np.asarray(timestamps, dtype=float)
+    event_timestamps = np.asarray(event_timestamps, dtype=float)
+    if len(timestamps) < 2:
+        return np.zeros(len(event_timestamps), dtype=np.intp)
+    right = np.clip(np.searchsorted(timestamps, event_timestamps, side='left'), 1, len(timestamps) - 1)
+    # frames with the same time (LOF files often log two frames at once) -> use the first of them, like argmin
+    left = np.searchsorted(timestamps, timestamps[right - 1], side='left')
+    use_left = (event_timestamps - timestamps[left]) <= (timestamps[right] - event_timestamps)
+    return np.where(use_left, left, right)
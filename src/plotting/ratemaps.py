@@ -0,0 +1,52 @@
+import numpy as np
+from src.plotting.smoothing import smooth_ratemaps
+
+# ratemaps of every cell in a session computed together instead of one cell at a time while plotting
+# occupancy only depends on the session, so it is taken from the SessionGeometry once and all spike counts
+# are summed into its bins with a single sparse matrix product
+
+EBC_PLOTS = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier']
+RATEMAP_PLOTS = EBC_PLOTS + ['heatmap', 'hd_curve']
+# bin sizes of heatmaps (cm) and HD curves (degrees)
+HEATMAP_BIN_SIZE = 3.
+HD_BIN_SIZE = 12.
+# gaussian smoothing (in bins) for each ratemap type -> higher values will smooth more, HD curves are not smoothed
+EBC_SMOOTHING_STDDEV = 2
+HEATMAP_SMOOTHING_STDDEV = 1
+
+# get the occupancy of a SessionGeometry used for a ratemap plot type
+# barrier plots need the barrier start and end coordinates as [x,y]
+def get_occupancy(geometry, kind, barrier_start=None, barrier_end=None):
+    if kind == 'heatmap':
+        return geometry.heatmap_occupancy()
+    elif kind == 'hd_curve':
+        return geometry.hd_occupancy()
+    elif kind in EBC_PLOTS:
+        return geometry.ebc_occupancy(kind, barrier_start, barrier_end)
+    else:
+        raise ValueError(fr"The argument {kind} provided is not a valid ratemap plot type.")
+
+# compute the raw (unsmoothed) ratemaps of many cells for one session
+# spike_trains is a cells x frames array (or sparse matrix, or SparseSpikeTrains) of spike trains aligned to the session's frames
+# cells is an optional list of row indices to use (all rows are used by default)
+# smooth=True smooths all ratemaps the same way the plots do
+# returns an array of shape (cells, bins...) -> ex. (cells, bearing bins, distance bins) for EBC plots
+def compute_ratemaps(geometry, spike_trains, cells=None, kind='ebc_boundary', barrier_start=None, barrier_end=None, smooth=False):
+    occupancy = get_occupancy(geometry, kind, barrier_start, barrier_end)
+    # sparse spike trains (ex. SparseSpikeTrains) stay sparse
+    spike_trains = spike_trains.tocsr() if hasattr(spike_trains, 'tocsr') else np.asarray(spike_trains)
+    if cells is not None:
+        spike_trains = spike_trains[cells]
+    # spike trains are trimmed to the frames used in the plots
+    ratemaps = occupancy.ratemaps(spike_trains[:, :len(geometry)])
+    if smooth:
+        ratemaps = smooth_plot_ratemaps(ratemaps, kind)
+    return ratemaps
+
+# smooth a stack of raw ratemaps of a plot type in one call -> EBC ratemaps wrap around the bearing axis
+def smooth_plot_ratemaps(ratemaps, kind):
+    if kind in EBC_PLOTS:
+        return smooth_ratemaps(ratemaps, EBC_SMOOTHING_STDDEV, circular=True)
+    elif kind == 'heatmap':
+        return smooth_ratemaps(ratemaps, HEATMAP_SMOOTHING_STDDEV)
+    return ratemaps
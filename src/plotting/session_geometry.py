@@ -0,0 +1,99 @@
+import numpy as np
+import src.plotting.plot_utils as plt_util
+from src.plotting.ratemaps import HEATMAP_BIN_SIZE, HD_BIN_SIZE
+
+# class to hold the tracking geometry of one session -> built once per session and shared by every cell plotted
+# head position and head direction are computed on creation, wall and barrier measurements are computed
+# the first time an EBC plot asks for them and then kept as bearing x distance occupancy
+# position and head direction occupancy are also computed on first use and shared by all cells
+# measurements are computed chunk_size frames at a time to keep memory low on long sessions
+# the last video frame is dropped from all arrays to match the spike trains used in the plots
+class SessionGeometry(object):
+    def __init__(self, dlc_file, timestamps, framerate, arena_coords, bearing_bin_size=3, dist_bin_size=2.5, chunk_size=10000):
+        self.framerate = framerate #Hz
+        self.arena_x_length = arena_coords[0] #cm
+        self.arena_y_length = arena_coords[1]
+        self.ebc_cutoff = np.max([self.arena_x_length, self.arena_y_length]) / 2.
+        self.bearing_bin_size = bearing_bin_size #degrees
+        self.dist_bin_size = dist_bin_size #cm
+        self.chunk_size = chunk_size
+        self.timestamps = timestamps
+        head_x, head_y, angles = plt_util.get_head_and_angles(dlc_file, self.arena_x_length, self.arena_y_length)
+        self.head_x, self.head_y, self.angles = head_x[:-1], head_y[:-1], angles[:-1]
+        # time spent on each frame -> taken from the timestamps so dropped frames are weighted by the real gap
+        self.frame_durations = plt_util.get_frame_durations(timestamps, framerate)[:-1]
+        # cache of EBC occupancy for each EBC plot type and barrier
+        self._ebc_occupancy = {}
+        self._heatmap_occupancy = None
+        self._hd_occupancy = None
+
+    # number of frames used in the plots
+    def __len__(self):
+        return len(self.head_x)
+
+    # options passed to the measurement functions -> binned measurements are returned as small integer bin indices
+    def _measurement_options(self, binned):
+        if binned:
+            return {'chunk_size': self.chunk_size, 'bin_sizes': [self.bearing_bin_size, self.dist_bin_size],
+                     'dist_cutoff': self.ebc_cutoff}
+        return {'chunk_size': self.chunk_size}
+
+    def boundary_measurements(self, binned=False):
+        boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(self.head_x, self.head_y, self.angles,
+                                                                                    **self._measurement_options(binned))
+        return boundary_bearings[:-1], boundary_distances[:-1]
+
+    def barrier_measurements(self, barrier_start, barrier_end, binned=False):
+        barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(self.head_x, self.head_y, self.angles,
+                                                                                      barrier_start, barrier_end,
+                                                                                      **self._measurement_options(binned))
+        return barrier_bearings[:-1], barrier_distances[:-1]
+
+    def boundary_barrier_measurements(self, barrier_start, barrier_end, binned=False):
+        boundary_bearings, boundary_distances = self.boundary_measurements(binned)
+        barrier_bearings, barrier_distances = self.barrier_measurements(barrier_start, barrier_end, binned)
+        all_bearings = np.concatenate([boundary_bearings, barrier_bearings],axis=1)
+        all_dists = np.concatenate([boundary_distances, barrier_distances],axis=1)
+        return all_bearings[:-1], all_dists[:-1]
+
+    # get the bearing and distance bins for an EBC plot type ('ebc_boundary', 'ebc_barrier' or 'ebc_boundary_barrier')
+    # barrier plots need the barrier start and end coordinates as [x,y]
+    def ebc_bins(self, plot_name, barrier_start=None, barrier_end=None):
+        if plot_name == 'ebc_boundary':
+            return self.boundary_measurements(binned=True)
+        elif plot_name == 'ebc_barrier':
+            return self.barrier_measurements(barrier_start, barrier_end, binned=True)
+        elif plot_name == 'ebc_boundary_barrier':
+            return self.boundary_barrier_measurements(barrier_start, barrier_end, binned=True)
+        else:
+            raise ValueError(fr"The argument {plot_name} provided is not a valid EBC plot type.")
+
+    # get the bearing x distance occupancy for an EBC plot type -> computed on first use and shared by all cells
+    def ebc_occupancy(self, plot_name, barrier_start=None, barrier_end=None):
+        key = (plot_name, None if barrier_start is None else tuple(barrier_start),
+                None if barrier_end is None else tuple(barrier_end))
+        if key not in self._ebc_occupancy:
+            bearing_bins, dist_bins = self.ebc_bins(plot_name, barrier_start, barrier_end)
+            self._ebc_occupancy[key] = plt_util.get_ebc_occupancy(bearing_bins, dist_bins, self.ebc_cutoff, self.framerate,
+                                                                  self.bearing_bin_size, self.dist_bin_size, self.frame_durations)
+        return self._ebc_occupancy[key]
+
+    # x by y position occupancy for heatmaps
+    def heatmap_occupancy(self):
+        if self._heatmap_occupancy is None:
+            self._heatmap_occupancy = plt_util.get_heatmap_occupancy(self.head_x, self.head_y, self.frame_durations,
+                                                                     HEATMAP_BIN_SIZE)
+        return self._heatmap_occupancy
+
+    # head direction occupancy for HD curves
+    def hd_occupancy(self):
+        if self._hd_occupancy is None:
+            self._hd_occupancy = plt_util.get_hd_occupancy(self.angles, self.frame_durations, HD_BIN_SIZE)
+        return self._hd_occupancy
+
+    # drop the cached occupancies -> their frame and bin indices take memory with the number of frames (and wall points for
+    # EBC plots), they are made again if they are used after this
+    def clear_occupancy(self):
+        self._ebc_occupancy = {}
+        self._heatmap_occupancy = None
+        self._hd_occupancy = None
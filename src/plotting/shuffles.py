@@ -0,0 +1,141 @@
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from src.plotting.ratemaps import EBC_PLOTS, get_occupancy, smooth_plot_ratemaps
+from src.workutils.shared_arrays import WORKER_CONTEXT
+
+# shuffle tests of how strongly each cell is tuned in a session -> egocentric boundary (EBC), head direction (HD curve)
+# or position (heatmap) tuning is scored on the ratemap of a cell, then on the ratemaps of num_shuffles copies of its spike
+# train circularly shifted in time, and the cell is significantly tuned when its score is above the percentile of the shuffles
+# every cell in a session is shifted by the same random shifts (at least min_shift_seconds away from the real alignment),
+# and each shift only moves the frames with events, so the bins of the session are binned once and shared by all shuffles
+# smoothing is done with one matrix product per cell for all of its shuffles (see get_smoothing_matrix)
+# scores:
+#   + EBC plots: mean resultant length of the (smoothed) ratemap collapsed over distance, in bearing
+#   + HD curves: mean resultant length of the HD curve
+#   + heatmaps: spatial information (bits / spike) of the (smoothed) heatmap
+
+# bearing or head direction (radians) of the center of each of num_bins angle bins covering 360 degrees
+def get_bin_angles(num_bins):
+    bin_size = 360. / num_bins
+    return np.deg2rad(np.arange(num_bins) * bin_size + bin_size / 2.)
+
+# mean resultant vector (complex) of firing rates over angle bins along the last axis
+# its length is the mean resultant length and its angle the preferred angle, bins that were never occupied (nan) are left out
+def mean_resultant_vector(rates, bin_angles):
+    rates = np.nan_to_num(rates)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (rates @ np.exp(1j * bin_angles)) / rates.sum(axis=-1)
+
+# mean resultant length of firing rates over angle bins along the last axis -> 0 (no preferred angle) to 1 (one angle)
+def mean_resultant_length(rates, bin_angles):
+    return np.abs(mean_resultant_vector(rates, bin_angles))
+
+# spatial information (bits / spike) of heatmaps -> ratemaps is (..., x bins, y bins) and occupancy is the time in each bin
+def spatial_information(ratemaps, occupancy):
+    occupied = (occupancy > 0) & ~np.isnan(ratemaps)
+    rates = np.where(occupied, ratemaps, 0.)
+    occupancy_prob = np.where(occupied, occupancy, 0.)
+    occupancy_prob = occupancy_prob / occupancy_prob.sum(axis=(-2, -1), keepdims=True)
+    mean_rate = (occupancy_prob * rates).sum(axis=(-2, -1), keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate_ratio = rates / mean_rate
+        information = np.where(rate_ratio > 0, occupancy_prob * rate_ratio * np.log2(rate_ratio), 0.)
+    return information.sum(axis=(-2, -1))
+
+# tuning score of a stack of raw ratemaps of a plot type -> ratemaps is (..., bins of the plot type), returns (...)
+# smooth=True scores the ratemaps smoothed the same way they are plotted
+def get_tuning_scores(ratemaps, occupancy, kind, smooth=True):
+    if smooth:
+        ratemaps = smooth_plot_ratemaps(ratemaps, kind)
+    if kind in EBC_PLOTS:
+        return mean_resultant_length(np.nansum(ratemaps, axis=-1), get_bin_angles(ratemaps.shape[-2]))
+    elif kind == 'hd_curve':
+        return mean_resultant_length(ratemaps, get_bin_angles(ratemaps.shape[-1]))
+    elif kind == 'heatmap':
+        return spatial_information(ratemaps, occupancy.occ)
+    else:
+        raise ValueError(fr"The argument {kind} provided is not a valid ratemap plot type.")
+
+# random circular shifts (frames) for a session of num_frames frames -> each shift is at least min_shift frames from
+# no shift in either direction (or as far as the session allows)
+def get_shuffle_shifts(num_frames, num_shuffles, min_shift, seed=None):
+    min_shift = int(min(max(min_shift, 1), num_frames // 2))
+    return np.random.default_rng(seed).integers(min_shift, num_frames - min_shift + 1, size=num_shuffles)
+
+# matrix that turns the spike counts of a ratemap (flattened) into the ratemap smoothed the same way it is plotted
+# -> smoothed ratemap = spike counts @ matrix
+# the bins that were never occupied are the same for every spike train of a session, so smoothing (which fills them in from
+# the bins around them) is the same linear function of the spike counts for every shuffle and can be found once per session
+# by smoothing the ratemap of one spike in each occupied bin
+def get_smoothing_matrix(occupancy, kind):
+    occ = occupancy.occ.ravel()
+    occupied_bins = np.flatnonzero(occ > 0)
+    spike_ratemaps = np.tile(np.where(occ > 0, 0., np.nan), (len(occupied_bins), 1))
+    spike_ratemaps[np.arange(len(occupied_bins)), occupied_bins] = 1. / occ[occupied_bins]
+    smoothed = smooth_plot_ratemaps(spike_ratemaps.reshape((-1,) + occupancy.shape), kind)
+    smoothing_matrix = np.zeros((occupancy.num_bins, occupancy.num_bins))
+    smoothing_matrix[occupied_bins] = smoothed.reshape(len(occupied_bins), -1)
+    return smoothing_matrix
+
+# scores of the unshifted spike train (column 0) and of every shift (columns 1 on) for each spike train in spike_trains
+# smoothing_matrix from get_smoothing_matrix scores smoothed ratemaps, raw ratemaps are scored when it is None
+def get_shuffled_scores(occupancy, spike_trains, shifts, kind, smoothing_matrix=None):
+    shifts = np.concatenate([[0], shifts])
+    scores = np.zeros((len(spike_trains), len(shifts)))
+    for row, spike_train in enumerate(spike_trains):
+        spike_counts = occupancy.shifted_spike_counts(spike_train, shifts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if smoothing_matrix is None:
+                ratemaps = spike_counts / occupancy.occ
+            else:
+                ratemaps = (spike_counts.reshape(len(shifts), -1) @ smoothing_matrix).reshape(spike_counts.shape)
+        scores[row] = get_tuning_scores(ratemaps, occupancy, kind, smooth=False)
+    return scores
+
+# shuffle test of every cell in a session
+# spike_trains is a cells x frames array of spike trains aligned to the frames of geometry (a SessionGeometry)
+# barrier plots need the barrier start and end coordinates as [x,y]
+# seed makes the shifts repeatable, num_workers > 1 splits the cells between that many worker processes
+# returns a dictionary of arrays with one value per cell:
+#   'score' (score of the cell), 'threshold' (percentile of the shuffled scores), 'p_value' (fraction of shuffles scoring at
+#   least as high as the cell, counting the cell itself) and 'significant' (score above threshold)
+def shuffle_test(geometry, spike_trains, kind='ebc_boundary', num_shuffles=1000, min_shift_seconds=20., percentile=99.,
+                 seed=None, barrier_start=None, barrier_end=None, smooth=True, num_workers=1):
+    occupancy = get_occupancy(geometry, kind, barrier_start, barrier_end)
+    spike_trains = np.asarray(spike_trains)[:, :len(geometry)]
+    shifts = get_shuffle_shifts(len(geometry), num_shuffles, min_shift_seconds * geometry.framerate, seed)
+    smoothing_matrix = get_smoothing_matrix(occupancy, kind) if (smooth & (kind != 'hd_curve')) else None
+    if (num_workers > 1) & (len(spike_trains) > 1):
+        # the bins of the session are sent once to every worker, and each task only sends the spike trains of some cells
+        occupancy.frame_matrix(len(geometry))
+        cell_chunks = np.array_split(np.arange(len(spike_trains)), min(len(spike_trains), num_workers * 4))
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=WORKER_CONTEXT, initializer=_init_shuffle_worker,
+                                 initargs=(occupancy, shifts, kind, smoothing_matrix)) as executor:
+            scores = np.concatenate(list(executor.map(_shuffle_cells_in_worker, [spike_trains[cells] for cells in cell_chunks])))
+    else:
+        scores = get_shuffled_scores(occupancy, spike_trains, shifts, kind, smoothing_matrix)
+    return get_shuffle_results(scores, percentile)
+
+# summarize scores from get_shuffled_scores (unshifted score in column 0) into the results of shuffle_test
+def get_shuffle_results(scores, percentile=99.):
+    observed = scores[:, 0]
+    shuffled = scores[:, 1:]
+    # cells without events have no scores (nan) -> their threshold is nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        threshold = np.nanpercentile(shuffled, percentile, axis=1) if shuffled.shape[1] > 0 else np.full(len(scores), np.nan)
+    p_value = (1 + np.sum(shuffled >= observed[:, np.newaxis], axis=1)) / (shuffled.shape[1] + 1)
+    return {'score': observed, 'threshold': threshold, 'p_value': p_value, 'significant': observed > threshold}
+
+
+# state of a worker process used for parallel shuffles -> set once per worker by the pool initializer
+_worker_shuffle = None
+
+def _init_shuffle_worker(occupancy, shifts, kind, smoothing_matrix):
+    global _worker_shuffle
+    _worker_shuffle = (occupancy, shifts, kind, smoothing_matrix)
+
+def _shuffle_cells_in_worker(spike_trains):
+    occupancy, shifts, kind, smoothing_matrix = _worker_shuffle
+    return get_shuffled_scores(occupancy, spike_trains, shifts, kind, smoothing_matrix)
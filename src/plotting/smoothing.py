@@ -0,0 +1,71 @@
+import numpy as np
+from functools import lru_cache
+
+# gaussian smoothing for ratemaps -> gives the same result as astropy's convolve with a Gaussian2DKernel
+# (kernel normalized, nan bins filled in from their neighbours, zeros outside the edges of the ratemap)
+# convolution is done with FFTs over a whole stack of ratemaps at once, and kernels and their FFTs are cached
+# so they are only made once per ratemap shape and smoothing width
+
+# gaussian kernel sampled at the center of each bin, 8 standard deviations wide (rounded up to an odd size) and summing to 1
+@lru_cache(maxsize=None)
+def gaussian_kernel(stddev):
+    size = int(np.ceil(8 * stddev))
+    size = size + 1 if size % 2 == 0 else size
+    offsets = np.arange(size) - size // 2
+    kernel_1d = np.exp(-offsets**2 / (2. * stddev**2))
+    kernel = np.outer(kernel_1d, kernel_1d)
+    kernel = kernel / kernel.sum()
+    kernel.setflags(write=False)
+    return kernel
+
+# FFT of the kernel padded to the size needed to convolve a padded ratemap of padded_shape
+@lru_cache(maxsize=64)
+def _kernel_fft(padded_shape, stddev):
+    kernel = gaussian_kernel(stddev)
+    fft_shape = tuple(size + kernel_size - 1 for size, kernel_size in zip(padded_shape, kernel.shape))
+    kernel_fft = np.fft.rfftn(kernel, fft_shape, axes=(0, 1))
+    kernel_fft.setflags(write=False)
+    return kernel_fft, fft_shape
+
+# convolve a stack of padded 2D arrays with the kernel and keep the part where the kernel fully overlaps
+def _convolve_valid(padded, stddev):
+    kernel_size = gaussian_kernel(stddev).shape[0]
+    kernel_fft, fft_shape = _kernel_fft(padded.shape[1:], stddev)
+    full = np.fft.irfftn(np.fft.rfftn(padded, fft_shape, axes=(1, 2)) * kernel_fft, fft_shape, axes=(1, 2))
+    return full[:, kernel_size-1:padded.shape[1], kernel_size-1:padded.shape[2]]
+
+# smooth one ratemap (2D) or a stack of ratemaps (cells x 2D) with a gaussian of stddev bins
+# circular=True wraps the first axis of each ratemap around (ex. bearing bins where 0 = 360 degrees) instead of
+# treating the bins past its edges as 0
+# nan bins are ignored and filled in with the weighted average of the bins around them, bins with no bins that are not nan
+# within reach of the kernel stay nan
+def smooth_ratemaps(ratemaps, stddev, circular=False):
+    ratemaps = np.asarray(ratemaps, dtype=np.float64)
+    single_ratemap = ratemaps.ndim == 2
+    if single_ratemap:
+        ratemaps = ratemaps[np.newaxis]
+    half_size = gaussian_kernel(stddev).shape[0] // 2
+    nan_bins = np.isnan(ratemaps)
+    values = np.where(nan_bins, 0., ratemaps)
+    # bins past the edges count as 0 with full weight (astropy's default 'fill' boundary)
+    weights = (~nan_bins).astype(np.float64)
+    if circular:
+        values = np.pad(values, [(0, 0), (half_size, half_size), (0, 0)], mode='wrap')
+        weights = np.pad(weights, [(0, 0), (half_size, half_size), (0, 0)], mode='wrap')
+    else:
+        values = np.pad(values, [(0, 0), (half_size, half_size), (0, 0)], mode='constant', constant_values=0.)
+        weights = np.pad(weights, [(0, 0), (half_size, half_size), (0, 0)], mode='constant', constant_values=1.)
+    values = np.pad(values, [(0, 0), (0, 0), (half_size, half_size)], mode='constant', constant_values=0.)
+    weights = np.pad(weights, [(0, 0), (0, 0), (half_size, half_size)], mode='constant', constant_values=1.)
+    value_sums = _convolve_valid(values, stddev)
+    weight_sums = _convolve_valid(weights, stddev)
+    # FFTs leave round-off (~1e-16) where the sums should be 0 -> bins with no bin in reach of the kernel (ex. inside nan
+    # regions wider than the kernel) stay nan like in astropy, any bin in reach adds at least the smallest kernel weight
+    no_weight = weight_sums < gaussian_kernel(stddev).min() / 2.
+    if not (values < 0).any():
+        value_sums = np.maximum(value_sums, 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = np.where(no_weight, np.nan, value_sums / weight_sums)
+    if single_ratemap:
+        return smoothed[0]
+    return smoothed
@@ -2,11 +2,13 @@ import os
 import matplotlib.pyplot as plt
 from matplotlib import colors as mplcolors
 import numpy as np
-from astropy.convolution import convolve
-from astropy.convolution.kernels import Gaussian2DKernel
+import src.plotting.plot_utils as plt_util
+from src.plotting.smoothing import smooth_ratemaps
+from src.plotting.ratemaps import EBC_SMOOTHING_STDDEV, HEATMAP_SMOOTHING_STDDEV
 
 #  class used to create figures / matplotlib subplots
 #  can also be used to make single session spike plots 
+#  plots are drawn on the axis given -> a figure is only made when no axis is given, and it is closed once saved to destination
 
 class Subplot(object):
     def __init__(self, framerate, arena_coords):
@@ -15,13 +17,13 @@ class Subplot(object):
         self.arena_y_length = arena_coords[1]  
         self.max_wall_length = np.max([self.arena_x_length, self.arena_y_length])
         self.ebc_cutoff = self.max_wall_length / 2.
+        self.bearing_bin_size = 3 #degrees
+        self.dist_bin_size = 2.5 #cm
         
     
-    def path_spike_plot_subplot(self, head_x,head_y,angles,spike_train,destination, line_color, spike_sizes, line_size, axis):
-        if destination is not None:
-            savedir = os.path.dirname(destination)
-            if not os.path.isdir(savedir):
-                os.makedirs(savedir)
+    def path_spike_plot_subplot(self, head_x,head_y,angles,spike_train,destination, line_color, spike_sizes, line_size, axis=None):
+        make_save_dir(destination)
+        figure, axis, made_figure = get_figure_and_axis(axis)
 
 
         #grab locations and head directions where events occurred
@@ -35,150 +37,135 @@ class Subplot(object):
         norm = mplcolors.Normalize(vmin=0, vmax=360)
 
     #plot it!
-    ####** can modify to change figure size**####
-        fig = plt.figure()
         #plt.rcParams['lines.linewidth'] = 5
         axis.invert_yaxis()
         axis.plot(head_x,head_y,color=line_color,linewidth=line_size, alpha=0.6,zorder=0)
         axis.scatter(spike_x,spike_y,s=spike_sizes, c=spike_angles,cmap=colormap,norm=norm,zorder=1,clip_on=False)
         axis.axis('off')
         axis.set_aspect('equal')
-        fig.tight_layout()
         
         #axis.axis('equal')
-        #save if you provided a destination
-        if destination is not None:
-            fig.savefig(destination,dpi=300)
-            plt.close()
-            
-        else:
-            return axis
-            
-    # create EBC plots for multiple sessions / days and return axis to be plotted on 
-    def ebc_subplot(self, boundary_bearings, boundary_distances, spike_train,destination,axis):
-        if destination is not None:
-            savedir = os.path.dirname(destination)
-            if not os.path.isdir(savedir):
-                os.makedirs(savedir)
-
-        bearing_bin_size = 3 #degrees
-        dist_bin_size = 2.5 #cm
-        
-        #figure out how many bins we'll have in the bearing and distance domains
-        bearing_bin_num = int(np.ceil(360 / bearing_bin_size))
-        dist_bin_num = int(np.ceil(self.ebc_cutoff / dist_bin_size))
+        return save_or_return(figure, axis, destination, made_figure)
 
-        
-        #bin the bearings and distances according to the bin sizes specified at the top of the script
-        bearing_bins = np.digitize(boundary_bearings, bins=np.arange(0,360,bearing_bin_size)).astype(float) - 1
-        dist_bins = np.digitize(boundary_distances, bins=np.arange(0,np.max(boundary_distances),dist_bin_size)).astype(float) - 1
-        
-        #make an array for bin occupancy and event counts
-        occ = np.zeros([len(bearing_bins),bearing_bin_num,dist_bin_num])
-        spikes = np.zeros([len(bearing_bins),bearing_bin_num,dist_bin_num])
-        
-        #boundaries outside the dist cutoff are discarded
-        dist_bins[boundary_distances > self.ebc_cutoff] = np.nan
-        bearing_bins[boundary_distances > self.ebc_cutoff] = np.nan
-        
-        #for every video frame, take which bins are occupied and increment the occupancy time (occ) and event counts (spikes) for those bins
-        for i in range(len(bearing_bins)):
+    # update a spike plot drawn by path_spike_plot_subplot with the events of another cell
+    # the trajectory of the session stays the same, so only the event markers are moved
+    def update_path_spike_plot_subplot(self, head_x, head_y, angles, spike_train, axis):
+        spikes = axis.collections[0]
+        spikes.set_offsets(np.column_stack([head_x[spike_train>0], head_y[spike_train>0]]))
+        spikes.set_array(angles[spike_train>0])
+        return axis
             
-            occ[i, bearing_bins[i][~np.isnan(bearing_bins[i])].astype(int), dist_bins[i][~np.isnan(dist_bins[i])].astype(int)] = 1./self.framerate
-            spikes[i, bearing_bins[i][~np.isnan(bearing_bins[i])].astype(int), dist_bins[i][~np.isnan(dist_bins[i])].astype(int)] = spike_train[i]
+    # create EBC plots for multiple sessions / days and return axis to be plotted on 
+    # frame_durations gives the time (s) of each frame, frames last 1 / framerate if it is not provided
+    def ebc_subplot(self, boundary_bearings, boundary_distances, spike_train,destination,axis=None, frame_durations=None):
+        #bin the bearings and distances according to the bin sizes used for all EBC plots
+        bearing_bins, dist_bins = plt_util.get_ebc_bins(boundary_bearings, boundary_distances, self.ebc_cutoff,
+                                                        self.bearing_bin_size, self.dist_bin_size)
+        ebc_occupancy = plt_util.get_ebc_occupancy(bearing_bins, dist_bins, self.ebc_cutoff, self.framerate,
+                                                   self.bearing_bin_size, self.dist_bin_size, frame_durations)
+        return self.binned_ebc_subplot(ebc_occupancy, spike_train, destination, axis)
 
-        #sum across all time points in the session
-        summed_occ = np.sum(occ,axis=0)
-        summed_spikes = np.sum(spikes,axis=0)
-        
+    # create EBC plot from bearing x distance occupancy that has already been computed (ex. by a SessionGeometry)
+    def binned_ebc_subplot(self, ebc_occupancy, spike_train, destination, axis=None):
         #divide events by occupancy time to get a ratemap
-        raw_ratemap = summed_spikes/summed_occ
+        raw_ratemap = ebc_occupancy.ratemap(spike_train)
+        return self.ebc_ratemap_subplot(raw_ratemap, destination, axis)
+
+    # create EBC plot from a raw bearing x distance ratemap (ex. one cell from ratemaps.compute_ratemaps)
+    # smoothed=True means the ratemap has already been smoothed (ex. with compute_ratemaps(..., smooth=True))
+    def ebc_ratemap_subplot(self, raw_ratemap, destination, axis=None, smoothed=False):
+        make_save_dir(destination)
+        figure, axis, made_figure = get_figure_and_axis(axis, polar=True)
+
+        bearing_bin_size = self.bearing_bin_size
+        dist_bin_size = self.dist_bin_size
     
-        #we need to smooth the ratemap, but the smoothing kernel doesn't understand that the direction
-        #axis is circular, so we can stack three ratemaps next to each other, smooth across them, and then take the middle one
-        hist3 = np.concatenate((raw_ratemap,raw_ratemap,raw_ratemap),axis=0)
-        hist3 = convolve(hist3,Gaussian2DKernel(x_stddev=2,y_stddev=2))
-        smoothed_ratemap = hist3[len(raw_ratemap):len(raw_ratemap)*2]
+        smoothed_ratemap = self.get_ebc_plot_ratemap(raw_ratemap, smoothed)
 
         #bin edges for plotting
         angle_vals = np.deg2rad(np.arange(0,361,bearing_bin_size))
         dist_vals = np.arange(0,self.ebc_cutoff,dist_bin_size)
-
-        #append first angle bin to end of ratemap because 0deg = 360deg
-        smoothed_ratemap = np.concatenate([smoothed_ratemap,smoothed_ratemap[0,np.newaxis]])
         
-        fig = plt.figure() 
-        #fig.tight_layout()
-        fig.tight_layout()
         axis.set_theta_zero_location("N")
         axis.pcolormesh(angle_vals,dist_vals,smoothed_ratemap.T,vmin=0)
         axis.axis('off')
         
-        #save if you provided a destination
-        if destination is not None:
-            fig.savefig(destination,dpi=300)
-            plt.close()
-            
+        return save_or_return(figure, axis, destination, made_figure)
+
+    # smoothed ratemap with the first bearing bin repeated at the end, as plotted by ebc_ratemap_subplot
+    def get_ebc_plot_ratemap(self, raw_ratemap, smoothed=False):
+        #we need to smooth the ratemap, and the direction axis is circular so the smoothing wraps around it
+        if smoothed:
+            smoothed_ratemap = raw_ratemap
         else:
-            return axis 
-        
-    def heatmap_subplot(self, head_x, head_y, spike_train, destination=None, axis=None):
-        
-        binsize = 3. #cm
-        stddev = 1 #for Gaussian smoothing - higher values will smooth more
-        
-        xbin_edges = np.arange(np.min(head_x),np.max(head_x),binsize)
-        ybin_edges = np.arange(np.min(head_y),np.max(head_y),binsize)
+            smoothed_ratemap = smooth_ratemaps(raw_ratemap, EBC_SMOOTHING_STDDEV, circular=True)
+        #append first angle bin to end of ratemap because 0deg = 360deg
+        return np.concatenate([smoothed_ratemap,smoothed_ratemap[0,np.newaxis]])
 
-        xbins = np.digitize(head_x, bins=xbin_edges) - 1
-        ybins = np.digitize(head_y, bins=ybin_edges) - 1
-        
-        spikes = np.zeros((len(xbin_edges),len(ybin_edges)))
-        occ = np.zeros((len(xbin_edges),len(ybin_edges)))
-        
-        for i in range(len(xbins)):
-            spikes[xbins[i],ybins[i]] += spike_train[i]
-            occ[xbins[i],ybins[i]] += 1./self.framerate
-            
-        raw_heatmap = spikes/occ
-        smoothed_heatmap = convolve(raw_heatmap, Gaussian2DKernel(x_stddev=stddev,y_stddev=stddev))
-        smoothed_heatmap = smoothed_heatmap.T
+    # update an EBC plot drawn by ebc_ratemap_subplot with the ratemap of another cell
+    def update_ebc_ratemap_subplot(self, raw_ratemap, axis, smoothed=False):
+        mesh = axis.collections[0]
+        mesh.set_array(self.get_ebc_plot_ratemap(raw_ratemap, smoothed).T)
+        rescale_colors(mesh)
+        return axis
+        
+    # frame_durations gives the time (s) of each frame, frames last 1 / framerate if it is not provided
+    def heatmap_subplot(self, head_x, head_y, spike_train, destination=None, axis=None, frame_durations=None):
+        if frame_durations is None:
+            frame_durations = np.full(len(head_x), 1./self.framerate)
+        heatmap_occupancy = plt_util.get_heatmap_occupancy(head_x, head_y, frame_durations)
+        return self.binned_heatmap_subplot(heatmap_occupancy, spike_train, destination, axis)
+
+    # create heatmap from position occupancy that has already been computed (ex. by a SessionGeometry)
+    def binned_heatmap_subplot(self, heatmap_occupancy, spike_train, destination=None, axis=None):
+        raw_heatmap = heatmap_occupancy.ratemap(spike_train)
+        return self.heatmap_ratemap_subplot(raw_heatmap, destination, axis)
+
+    # create heatmap from a raw x by y ratemap (ex. one cell from ratemaps.compute_ratemaps)
+    # smoothed=True means the heatmap has already been smoothed (ex. with compute_ratemaps(..., smooth=True))
+    def heatmap_ratemap_subplot(self, raw_heatmap, destination=None, axis=None, smoothed=False):
+        make_save_dir(destination)
+        figure, axis, made_figure = get_figure_and_axis(axis)
+        smoothed_heatmap = self.get_heatmap_plot_ratemap(raw_heatmap, smoothed)
 
-        fig = plt.figure()
         axis.imshow(smoothed_heatmap,origin='lower',cmap='viridis',vmin=0)
         axis.set_aspect('equal')
         axis.axis('off')
         
-        #save if you provided a destination
-        if destination is not None:
-            fig.savefig(destination,dpi=300)
-            plt.close()
-            
+        return save_or_return(figure, axis, destination, made_figure)
+
+    # smoothed heatmap with x bins along the columns, as plotted by heatmap_ratemap_subplot
+    def get_heatmap_plot_ratemap(self, raw_heatmap, smoothed=False):
+        if smoothed:
+            smoothed_heatmap = raw_heatmap
         else:
-            return axis
+            smoothed_heatmap = smooth_ratemaps(raw_heatmap, HEATMAP_SMOOTHING_STDDEV)
+        return smoothed_heatmap.T
 
-    def hd_curve_subplot(self, angles, spike_train, line_color, destination=None, axis=None):
-        binsize = 12. #degrees
-        
-        bin_edges = np.arange(0,360,binsize)
-        
-        angle_bins = np.digitize(angles,bins=bin_edges) - 1
-        
-        spikes = np.zeros(len(bin_edges))
-        occ = np.zeros(len(bin_edges))
-        
-        for i in range(len(angle_bins)):
-            spikes[angle_bins[i]] += spike_train[i]
-            occ[angle_bins[i]] += 1./self.framerate
-            
-        curve = spikes/occ
-        
-        #append first bin to end because 0 = 360deg
-        curve = np.array( list(curve) + [curve[0]] )
-        xvals = np.array( list(bin_edges) + [0] )
+    # update a heatmap drawn by heatmap_ratemap_subplot with the heatmap of another cell
+    def update_heatmap_ratemap_subplot(self, raw_heatmap, axis, smoothed=False):
+        image = axis.images[0]
+        image.set_data(self.get_heatmap_plot_ratemap(raw_heatmap, smoothed))
+        rescale_colors(image)
+        return axis
+
+    def hd_curve_subplot(self, angles, spike_train, line_color, destination=None, axis=None, frame_durations=None):
+        if frame_durations is None:
+            frame_durations = np.full(len(angles), 1./self.framerate)
+        hd_occupancy = plt_util.get_hd_occupancy(angles, frame_durations)
+        return self.binned_hd_curve_subplot(hd_occupancy, spike_train, line_color, destination, axis)
+
+    # create HD curve from head direction occupancy that has already been computed (ex. by a SessionGeometry)
+    def binned_hd_curve_subplot(self, hd_occupancy, spike_train, line_color, destination=None, axis=None):
+        curve = hd_occupancy.ratemap(spike_train)
+        return self.hd_ratemap_subplot(curve, line_color, destination, axis)
+
+    # create HD curve from the raw firing rate in each head direction bin (ex. one cell from ratemaps.compute_ratemaps)
+    def hd_ratemap_subplot(self, curve, line_color, destination=None, axis=None):
+        make_save_dir(destination)
+        figure, axis, made_figure = get_figure_and_axis(axis, polar=True)
+        xvals, curve = self.get_hd_plot_curve(curve)
         
-        fig = plt.figure()
-        #ax = fig.add_subplot(111,projection='polar')
         axis.yaxis.grid(False)
         axis.xaxis.grid(linewidth=2,color='k')
         axis.spines['polar'].set_visible(False)
@@ -188,10 +175,57 @@ class Subplot(object):
         axis.set_yticklabels([])
         axis.set_theta_offset(0)
         
-        #save if you provided a destination
-        if destination is not None:
-            fig.savefig(destination,dpi=300)
-            plt.close()
-            
-        else:
-            return axis
+        return save_or_return(figure, axis, destination, made_figure)
+
+    # head direction bins (degrees) and curve with the first bin repeated at the end, as plotted by hd_ratemap_subplot
+    def get_hd_plot_curve(self, curve):
+        binsize = 360. / len(curve) #degrees
+        bin_edges = np.arange(0,360,binsize)
+        
+        #append first bin to end because 0 = 360deg
+        curve = np.array( list(curve) + [curve[0]] )
+        xvals = np.array( list(bin_edges) + [0] )
+        return xvals, curve
+
+    # update an HD curve drawn by hd_ratemap_subplot with the curve of another cell
+    def update_hd_ratemap_subplot(self, curve, axis):
+        xvals, curve = self.get_hd_plot_curve(curve)
+        axis.lines[0].set_data(np.deg2rad(xvals), curve)
+        # rescale the radial axis to the new curve
+        axis.relim()
+        axis.autoscale_view()
+        return axis
+
+# rescale the colors of a ratemap plot (drawn with vmin=0) to the maximum of its new data
+def rescale_colors(artist):
+    artist.norm.vmax = None
+    artist.autoscale_None()
+
+# make the folder of destination if a destination is given
+def make_save_dir(destination):
+    if destination is not None:
+        savedir = os.path.dirname(destination)
+        if savedir and not os.path.isdir(savedir):
+            os.makedirs(savedir)
+
+# figure and axis to draw on -> the figure of the axis given, or a new figure with one (polar) axis when axis is None
+# made_figure tells if the figure was made here
+def get_figure_and_axis(axis, polar=False):
+    if axis is not None:
+        return axis.figure, axis, False
+    figure = plt.figure()
+    if polar:
+        return figure, figure.add_subplot(projection='polar'), True
+    return figure, figure.add_subplot(), True
+
+# save the figure if you provided a destination, otherwise return the axis drawn on
+# a figure made by get_figure_and_axis is closed once it is saved, figures of axes given are left to the caller
+def save_or_return(figure, axis, destination, made_figure):
+    if destination is not None:
+        if made_figure:
+            figure.tight_layout()
+        figure.savefig(destination,dpi=300)
+        if made_figure:
+            plt.close(figure)
+    else:
+        return axis
@@ -1,35 +1,217 @@
 import os
 import sys
+import tempfile
 sys.path.append(r'C:\Users\Gianna\Documents\Python Scripts\rsc_ca_plotting')
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 from src.plotting.subplot import Subplot
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.cell_events import CellEventIndex
+from src.plotting.ratemaps import compute_ratemaps, smooth_plot_ratemaps, HEATMAP_BIN_SIZE, HD_BIN_SIZE, \
+    EBC_SMOOTHING_STDDEV, HEATMAP_SMOOTHING_STDDEV
 import src.plotting.plot_utils as plt_util
-from src.workutils.handle_dirs import combine_files_get_num_sessions
+from src.workutils.handle_dirs import combine_files_get_num_sessions, get_session_file_paths
+from src.workutils.run_manifest import RunManifest, get_inputs_hash, get_options_hash
 from src.workutils.PlotEmitterSignals import EmittedPlotSignals
+import src.workutils.results_store as results_store
+import src.plotting.tuning_metrics as tuning_metrics
+from src.workutils.figure_output import FigureOutput, MULTIPAGE_PDF_NAME
+from src.workutils.cancellation import check_cancelled
+from src.workutils.shared_arrays import WORKER_CONTEXT, share_arrays, load_shared_arrays
 
 
 class TimeSeriesPlots(object):
 
 
-        def __init__(self, spike_directory, dlc_directory, output_folder_path, framerate, two_dim_arena_coords):
+        # use_cache=False parses every csv again instead of reading the cached copies in the output folder
+        def __init__(self, spike_directory, dlc_directory, output_folder_path, framerate, two_dim_arena_coords, use_cache=True):
             self.framerate = framerate #Hz
             self.bearing_bin_size = 3 #degrees
             self.dist_bin_size = 2.5 #cm
             self.spike_dir = spike_directory
             self.dlc_dir = dlc_directory
             self.output_folder_path = output_folder_path
-            self.num_sessions, self.sessions_data = combine_files_get_num_sessions(self.spike_dir, self.dlc_dir, self.output_folder_path)
+            self.num_sessions, self.sessions_data = combine_files_get_num_sessions(self.spike_dir, self.dlc_dir, self.output_folder_path, use_cache)
+            # files the figures are made from -> used to tell if figures in the output folder are up to date
+            self.input_files = get_session_file_paths(self.spike_dir, self.dlc_dir)
+            # events of each session grouped by cell
+            self.session_events = [CellEventIndex(session[1]) for session in self.sessions_data]
             self.two_dim_arena_coords = two_dim_arena_coords
             self.arena_x_length = self.two_dim_arena_coords[0] 
             self.arena_y_length = self.two_dim_arena_coords[1]
             #instantiate a subplot object
             self.splt = Subplot(self.framerate, self.two_dim_arena_coords)
             self.signals = EmittedPlotSignals()
+            # figure and plots of the first cell, kept while rendering with reuse_figure=True
+            self.figure_template = None
+            # format and resolution figures are saved with -> set by plot_figures / replot_figures
+            self.figure_output = FigureOutput()
             print(f'Number of sessions: {self.num_sessions}')
 
 
+        # drop the Qt signals, raw data frames, session geometry and per-session arrays when the object is sent to a worker process
+        # render_figures shares the per-session arrays the workers need as memory mapped files instead
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            for name in ['session_spike_trains', 'session_trajectories', 'session_ratemaps', 'session_raw_ratemaps']:
+                state.pop(name, None)
+            state.pop('signals', None)
+            state.pop('sessions_data', None)
+            state.pop('session_events', None)
+            state.pop('session_geometries', None)
+            state.pop('figure_template', None)
+            return state
+
+
+        # align the events of every cell to the video frames and compute the tracking geometry once per session
+        # ratemaps of all cells for the plots requested are computed here for each session, so each cell only has to be drawn
+        # session_raw_ratemaps[session_idx][plot_name] is an array with the raw ratemap of every cell in cell_names,
+        # session_ratemaps holds the same ratemaps smoothed for plotting
+        # cancel_token (a CancellationToken) is checked before each session
+        def prepare_sessions(self, cell_names, *args, cancel_token=None, **kwargs):
+            self.cell_names = cell_names
+            self.session_spike_trains = []
+            self.session_geometries = []
+            self.session_trajectories = []
+            self.session_raw_ratemaps = []
+            for session_idx, session in enumerate(self.sessions_data):
+                check_cancelled(cancel_token)
+                timestamps = plt_util.get_timestamps(self.sessions_data, session_idx, self.framerate)
+                spike_trains = self.session_events[session_idx].spike_trains(timestamps, cell_names)
+                geometry = SessionGeometry(session[0], timestamps, self.framerate, self.two_dim_arena_coords,
+                                           self.bearing_bin_size, self.dist_bin_size)
+                raw_ratemaps = {}
+                for arg in args:
+                    if arg in ['ebc_boundary', 'heatmap', 'hd_curve']:
+                        raw_ratemaps[arg] = compute_ratemaps(geometry, spike_trains, kind=arg)
+                    elif ((arg in ['ebc_barrier', 'ebc_boundary_barrier']) & ('barrier_coords' in kwargs)):
+                        barrier_start, barrier_end = kwargs['barrier_coords'][session_idx]
+                        if ((barrier_start[0] is not None) & (barrier_end[0] is not None)):
+                            raw_ratemaps[arg] = compute_ratemaps(geometry, spike_trains, kind=arg,
+                                                                 barrier_start=barrier_start, barrier_end=barrier_end)
+                self.session_spike_trains.append(spike_trains)
+                self.session_geometries.append(geometry)
+                self.session_trajectories.append((geometry.head_x, geometry.head_y, geometry.angles))
+                self.session_raw_ratemaps.append(raw_ratemaps)
+            self.smooth_session_ratemaps()
+
+        # smooth the ratemaps of all cells in each session for plotting
+        def smooth_session_ratemaps(self):
+            self.session_ratemaps = [{arg: smooth_plot_ratemaps(raw_ratemaps, arg) for arg, raw_ratemaps in ratemaps.items()}
+                                     for ratemaps in self.session_raw_ratemaps]
+
+        # save the ratemaps, trajectories and spike trains from prepare_sessions to a results file in dir_output
+        # spike trains are saved as (cell, frame, count) triplets of the frames with events
+        def export_results(self, dir_output, *args, **kwargs):
+            arrays = {}
+            for session_idx in range(self.num_sessions):
+                session_key = f'session{session_idx + 1}'
+                for arg, raw_ratemaps in self.session_raw_ratemaps[session_idx].items():
+                    arrays[f'{session_key}/{arg}'] = raw_ratemaps.astype(np.float32)
+                head_x, head_y, angles = self.session_trajectories[session_idx]
+                arrays[f'{session_key}/head_x'] = head_x.astype(np.float32)
+                arrays[f'{session_key}/head_y'] = head_y.astype(np.float32)
+                arrays[f'{session_key}/angles'] = angles.astype(np.float32)
+                spike_trains = self.session_spike_trains[session_idx]
+                spike_cells, spike_frames = np.nonzero(spike_trains)
+                arrays[f'{session_key}/spike_cells'] = spike_cells.astype(np.int32)
+                arrays[f'{session_key}/spike_frames'] = spike_frames.astype(np.int32)
+                arrays[f'{session_key}/spike_counts'] = spike_trains[spike_cells, spike_frames]
+                arrays[f'{session_key}/num_frames'] = np.array(spike_trains.shape[1])
+                # length (s) of the frames used in the plots, used to select cells by event rate when replotting
+                arrays[f'{session_key}/duration'] = np.array(np.sum(self.session_geometries[session_idx].frame_durations))
+            metadata = {'cell_names': [str(cell) for cell in self.cell_names], 'num_sessions': int(self.num_sessions),
+                        'plots': list(args), 'framerate': self.framerate, 'arena': list(self.two_dim_arena_coords),
+                        'bearing_bin_size': self.bearing_bin_size, 'dist_bin_size': self.dist_bin_size,
+                        'ebc_cutoff': float(self.splt.ebc_cutoff), 'heatmap_bin_size': HEATMAP_BIN_SIZE, 'hd_bin_size': HD_BIN_SIZE,
+                        'ebc_smoothing_stddev': EBC_SMOOTHING_STDDEV, 'heatmap_smoothing_stddev': HEATMAP_SMOOTHING_STDDEV,
+                        'barrier_coords': kwargs.get('barrier_coords')}
+            results_path = results_store.get_results_path(dir_output)
+            results_store.save_results(results_path, arrays, metadata)
+            return results_path
+
+        # table of tuning metrics (see tuning_metrics) of every cell and session from the sessions made by prepare_sessions
+        # ratemaps already computed for plotting are reused, metrics of plot types that were not prepared are computed here
+        # num_shuffles > 0 adds the shuffle p values of the metrics, num_workers > 1 runs the shuffles in worker processes
+        # cancel_token (a CancellationToken) is checked before each session
+        def get_tuning_metrics(self, num_shuffles=0, seed=None, num_workers=1, cancel_token=None):
+            if not hasattr(self, 'session_geometries'):
+                raise Exception('Tuning metrics need the tracking of each session, they cannot be computed from a results file.')
+            session_metrics = []
+            for session_idx, geometry in enumerate(self.session_geometries):
+                check_cancelled(cancel_token)
+                session_metrics.append(tuning_metrics.get_session_metrics(geometry, self.session_spike_trains[session_idx],
+                                                                          self.session_ratemaps[session_idx], num_shuffles,
+                                                                          seed, num_workers))
+            return tuning_metrics.get_metrics_table(self.cell_names, session_metrics)
+
+        # save the table from get_tuning_metrics to dir_output as csv or parquet
+        def save_tuning_metrics(self, dir_output, metrics_format='csv', num_shuffles=0, seed=None, num_workers=1,
+                                cancel_token=None):
+            metrics_path = tuning_metrics.get_metrics_path(dir_output, metrics_format)
+            table = self.get_tuning_metrics(num_shuffles, seed, num_workers, cancel_token)
+            tuning_metrics.save_metrics_table(table, metrics_path)
+            print(f'Tuning metrics saved to {metrics_path}')
+            return table
+
+        # compute and save the tuning metrics of every cell to output_folder_name without drawing any figures
+        # ex. to screen all cells of a recording and only plot the cells that are tuned
+        def export_tuning_metrics(self, output_folder_name, metrics_format='csv', num_shuffles=0, seed=None, num_workers=1):
+            dir_output = os.path.join(self.output_folder_path, output_folder_name)
+            if not os.path.exists(dir_output):
+                os.mkdir(dir_output)
+            self.prepare_sessions(self.session_events[0].cell_names, *tuning_metrics.METRIC_PLOTS)
+            return self.save_tuning_metrics(dir_output, metrics_format, num_shuffles, seed, num_workers)
+
+        # read the arrays saved by export_results back into the form prepare_sessions makes them
+        def load_results(self, results_path):
+            arrays, metadata = results_store.load_results(results_path)
+            self.cell_names = np.array(metadata['cell_names'])
+            self.num_sessions = metadata['num_sessions']
+            self.session_spike_trains = []
+            self.session_trajectories = []
+            self.session_raw_ratemaps = []
+            self.session_durations = []
+            for session_idx in range(self.num_sessions):
+                session_key = f'session{session_idx + 1}'
+                # results files saved before durations were added -> frames were evenly spaced unless there was a LOF file
+                num_frames = int(arrays[f'{session_key}/num_frames'])
+                self.session_durations.append(float(arrays[f'{session_key}/duration']) if f'{session_key}/duration' in arrays
+                                              else (num_frames - 1) / self.framerate)
+                spike_trains = np.zeros((len(self.cell_names), int(arrays[f'{session_key}/num_frames'])), dtype=np.uint16)
+                spike_trains[arrays[f'{session_key}/spike_cells'], arrays[f'{session_key}/spike_frames']] = arrays[f'{session_key}/spike_counts']
+                self.session_spike_trains.append(spike_trains)
+                self.session_trajectories.append(tuple(arrays[f'{session_key}/{name}'].astype(np.float64) for name in ['head_x', 'head_y', 'angles']))
+                self.session_raw_ratemaps.append({arg: arrays[f'{session_key}/{arg}'].astype(np.float64) for arg in metadata['plots']
+                                                  if f'{session_key}/{arg}' in arrays})
+            self.smooth_session_ratemaps()
+            return metadata
+
+        # make a TimeSeriesPlots from a results file without reading the spike and DLC files again
+        # ex. to replot with different colours -> TimeSeriesPlots.from_results(path, output_folder).replot_figures(path, 'new_plots', ...)
+        @classmethod
+        def from_results(cls, results_path, output_folder_path):
+            _, metadata = results_store.load_results(results_path)
+            plots = cls.__new__(cls)
+            plots.framerate = metadata['framerate']
+            plots.bearing_bin_size = metadata['bearing_bin_size']
+            plots.dist_bin_size = metadata['dist_bin_size']
+            plots.output_folder_path = output_folder_path
+            plots.input_files = [results_path]
+            plots.num_sessions = metadata['num_sessions']
+            plots.sessions_data = []
+            plots.two_dim_arena_coords = metadata['arena']
+            plots.arena_x_length = plots.two_dim_arena_coords[0]
+            plots.arena_y_length = plots.two_dim_arena_coords[1]
+            plots.splt = Subplot(plots.framerate, plots.two_dim_arena_coords)
+            plots.signals = EmittedPlotSignals()
+            plots.figure_template = None
+            plots.figure_output = FigureOutput()
+            return plots
+
+
         # input the types of subplots to be created as strings on one figure
         # output to desination
         # *args provided should be the name of plots provided, **kwargs should be the arguments to the plots
@@ -38,101 +220,343 @@ class TimeSeriesPlots(object):
         #                       + for barrier plots: {"barrier_coord1": [[x1,y1], [x2, y2]], "barrier_coord2": [[x3, y3], [x4, y4], 'barrier_coord3' = [[None, None], [None, None]]]
         #                       + for HD plots: {"hd_line_color": xx}
         #args = # rows 
-        def plot_figures(self, output_folder_name, *args, **kwargs):
-            num_rows = len(args)
-            num_cols = self.num_sessions
+        # num_workers > 1 renders cells in that many worker processes, progress is still emitted with cell_plotted
+        # (figures are not emitted to the GUI in that case since they live in the workers)
+        # save_results=False skips writing the results file (ratemaps, trajectories and spike trains) to the output folder
+        # figures that are already in the output folder and were made from the same input files and plot options are skipped,
+        # force=True makes every figure again
+        # reuse_figure=True builds the grid of axes once and only updates the data of the plots for every other cell
+        # figure_output sets the format, DPI, thumbnails and multi-page pdf output of the figures (png at 300 dpi by default)
+        # metrics_format='csv' or 'parquet' also saves the tuning metrics of every cell (see get_tuning_metrics), with shuffle p
+        # values from metric_shuffles shuffles (seeded with metric_seed) when metric_shuffles > 0
+        # cell_selection (a CellSelection) only plots the cells it selects, cells are selected by their events before anything is
+        # computed and by their tuning metric (if it has one) once the sessions are prepared
+        # cancel_token (a CancellationToken) stops plotting between sessions and cells with PlotCancelled, the figures written
+        # before it stopped are kept in the manifest (see render_figures)
+        # plot_figures is prepare_figures followed by render_prepared_figures, the TaskManager runs them as separate tasks
+        def plot_figures(self, output_folder_name, *args, num_workers=1, save_results=True, force=False, reuse_figure=False,
+                         figure_output=None, metrics_format=None, metric_shuffles=0, metric_seed=None, cell_selection=None,
+                         cancel_token=None, **kwargs):
+            prepared = self.prepare_figures(output_folder_name, *args, num_workers=num_workers, save_results=save_results,
+                                            force=force, figure_output=figure_output, metrics_format=metrics_format,
+                                            metric_shuffles=metric_shuffles, metric_seed=metric_seed,
+                                            cell_selection=cell_selection, cancel_token=cancel_token, **kwargs)
+            self.render_prepared_figures(prepared, *args, num_workers=num_workers, reuse_figure=reuse_figure,
+                                         cancel_token=cancel_token, **kwargs)
+
+        # everything plot_figures does before drawing -> selects the cells, prepares the sessions and saves the results file and
+        # tuning metrics, no figures are drawn so it can run while another job is rendering
+        # returns (output folder, indices of the cells to plot, manifest) for render_prepared_figures, or None if there is
+        # nothing to plot
+        # the results file and tuning metrics are only saved once every session is prepared, so a cancelled run leaves the
+        # ones from the last run that finished
+        def prepare_figures(self, output_folder_name, *args, num_workers=1, save_results=True, force=False, figure_output=None,
+                            metrics_format=None, metric_shuffles=0, metric_seed=None, cell_selection=None, cancel_token=None,
+                            **kwargs):
             dir_output = os.path.join(self.output_folder_path, output_folder_name)
             print(dir_output)
             if not os.path.exists(dir_output):
                 os.mkdir(dir_output)
-            # var to determine whether cell 1 has completed 
-            for cell in np.unique(self.sessions_data[0][1][' Cell Name']):
-                print(cell)
-                figure= plt.figure()
-                plt.rcParams.update({'figure.max_open_warning': 0})
-                axes = []
-                ax_indices = []
-                gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
-                polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
-                for plot_num, plot_name in enumerate(args):
-                    # number of axes needed to make subplots
-                    for j in range(0, num_cols):
-                        if plot_name in polar_plots:
-                            axes.append(figure.add_subplot(gs[plot_num, j], projection="polar"))
-                        else:
-                            axes.append(figure.add_subplot(gs[plot_num, j]))
-                        ax_indices.append([plot_num, j])
-                for session_idx, session in enumerate(self.sessions_data): 
-                    timestamps = plt_util.get_timestamps(self.sessions_data, session_idx, framerate=30)
-                    #timestamps = plt_util.get_timestamps(self.sessions_data, session_idx, framerate=30)
-                    cell_event_timestamps = session[1]['Time (s)'][session[1][' Cell Name']==cell]
-                    #make an empty spike train
-                    spike_train = np.zeros_like(timestamps)
-
-                    #add a 1 to the spike train for the video frame closest to each cell event
-                    for event_ts in cell_event_timestamps:                
-                        abs_diffs = abs(timestamps - event_ts)
-                        spike_train[abs_diffs == np.min(abs_diffs, axis=0)] = 1
+            self.figure_output = figure_output if figure_output is not None else FigureOutput()
+            cell_names = self.select_cells(self.session_events[0].cell_names, cell_selection)
+            if len(cell_names) == 0:
+                print('No cells were selected to plot.')
+                return
+            manifest = self.get_manifest(dir_output, args, kwargs, cell_selection)
+            cells_to_plot = self.get_cells_to_plot(manifest, cell_names, force)
+            if ((len(cells_to_plot) == 0) &
+                ((not save_results) or (results_store.find_results_path(dir_output) is not None)) &
+                ((metrics_format is None) or tuning_metrics.has_metrics_table(dir_output, metrics_format, metric_shuffles > 0))):
+                print('All figures are up to date.')
+                return
+            self.prepare_sessions(cell_names, *args, cancel_token=cancel_token, **kwargs)
+            check_cancelled(cancel_token)
+            if save_results:
+                self.export_results(dir_output, *args, **kwargs)
+            metrics_table = None
+            if metrics_format is not None:
+                metrics_table = self.save_tuning_metrics(dir_output, metrics_format, metric_shuffles, metric_seed, num_workers,
+                                                         cancel_token)
+            if (cell_selection is not None) and cell_selection.uses_metric():
+                if (metrics_table is None) or (cell_selection.metric not in metrics_table):
+                    metrics_table = self.get_tuning_metrics(cell_selection.get_metric_shuffles(), cell_selection.seed, num_workers,
+                                                            cancel_token)
+                selected = cell_selection.select_by_metric(self.cell_names, metrics_table)
+                selected_cells = [cell_idx for cell_idx in cells_to_plot if selected[cell_idx]]
+                print(f'{len(selected_cells)} of {len(cells_to_plot)} cells to plot have {cell_selection.metric} past the threshold')
+                cells_to_plot = selected_cells
+            return dir_output, cells_to_plot, manifest
+
+        # draw and save the figures of the cells prepared by prepare_figures (nothing is drawn when prepared is None)
+        def render_prepared_figures(self, prepared, *args, num_workers=1, reuse_figure=False, cancel_token=None, **kwargs):
+            if prepared is None:
+                return
+            dir_output, cells_to_plot, manifest = prepared
+            self.render_figures(dir_output, *args, num_workers=num_workers, cell_indices=cells_to_plot, manifest=manifest,
+                                reuse_figure=reuse_figure, cancel_token=cancel_token, **kwargs)
+
+        # plot figures again from a results file saved by plot_figures instead of recomputing them (ex. with different colours)
+        # plot types must have been saved in the results file, barrier coordinates default to the saved ones
+        # cell_selection can select cells by their events (counted from the saved spike trains) but not by a tuning metric
+        def replot_figures(self, results_path, output_folder_name, *args, num_workers=1, force=False, reuse_figure=False,
+                           figure_output=None, cell_selection=None, cancel_token=None, **kwargs):
+            self.figure_output = figure_output if figure_output is not None else FigureOutput()
+            metadata = self.load_results(results_path)
+            missing_plots = [arg for arg in args if (arg != 'spike_plot') & (arg not in metadata['plots'])]
+            if len(missing_plots) > 0:
+                raise ValueError(f'The plot types {missing_plots} are not saved in {results_path}.')
+            if (kwargs.get('barrier_coords') is None) & (metadata['barrier_coords'] is not None):
+                kwargs['barrier_coords'] = metadata['barrier_coords']
+            dir_output = os.path.join(self.output_folder_path, output_folder_name)
+            if not os.path.exists(dir_output):
+                os.mkdir(dir_output)
+            manifest = self.get_manifest(dir_output, args, kwargs, cell_selection)
+            cells_to_plot = self.get_cells_to_plot(manifest, self.cell_names, force)
+            if cell_selection is not None:
+                if cell_selection.uses_metric():
+                    raise ValueError('Cells cannot be selected by a tuning metric when plotting from a results file.')
+                session_event_counts = [spike_trains.sum(axis=1) for spike_trains in self.session_spike_trains]
+                selected = cell_selection.select_by_events(self.cell_names, session_event_counts, self.session_durations)
+                print(f'{np.count_nonzero(selected)} of {len(self.cell_names)} cells selected')
+                cells_to_plot = [cell_idx for cell_idx in cells_to_plot if selected[cell_idx]]
+            self.render_figures(dir_output, *args, num_workers=num_workers, cell_indices=cells_to_plot, manifest=manifest,
+                                reuse_figure=reuse_figure, cancel_token=cancel_token, **kwargs)
+
+        # cells in cell_names selected by cell_selection (a CellSelection) from the events in the spike files and the length of
+        # each session, so no ratemaps are made for cells that are not plotted (every cell when cell_selection is None)
+        def select_cells(self, cell_names, cell_selection=None):
+            if cell_selection is None:
+                return cell_names
+            session_event_counts = [events.event_counts(cell_names) for events in self.session_events]
+            selected = cell_selection.select_by_events(cell_names, session_event_counts, self.get_session_durations())
+            print(f'{np.count_nonzero(selected)} of {len(cell_names)} cells selected')
+            return cell_names[selected]
+
+        # length (s) of the frames of each session used in the plots (the last frame is not used), from the LOF frame times
+        # when there are any -> the same as the durations saved in the results file for replotting
+        def get_session_durations(self):
+            session_durations = []
+            for session_idx in range(self.num_sessions):
+                timestamps = plt_util.get_timestamps(self.sessions_data, session_idx, self.framerate)
+                session_durations.append(np.sum(plt_util.get_frame_durations(timestamps, self.framerate)[:-1]))
+            return session_durations
+
+        # file name the figure of a cell is saved as (the multi-page pdf when all figures are saved to one file)
+        def get_figure_name(self, cell):
+            return self.figure_output.get_figure_name(cell.lstrip())
+
+        # manifest of the figures in dir_output for a run with these plot types and options
+        # and the cells selected by cell_selection (a CellSelection, None for every cell)
+        def get_manifest(self, dir_output, args, kwargs, cell_selection=None):
+            options = {'plots': list(args), 'plot_options': kwargs, 'framerate': self.framerate,
+                       'arena': list(self.two_dim_arena_coords), 'bearing_bin_size': self.bearing_bin_size,
+                       'dist_bin_size': self.dist_bin_size, 'output': self.figure_output.get_options()}
+            # options without a selection are left as they were, so folders plotted before keep their figures
+            if cell_selection is not None:
+                options['cell_selection'] = cell_selection.get_options()
+            return RunManifest(dir_output, get_inputs_hash(self.input_files), get_options_hash(options))
+
+        # indices of the cells whose figures are missing or out of date
+        # (every cell when a multi-page pdf is missing or out of date, since it is written again with all of its pages)
+        def get_cells_to_plot(self, manifest, cell_names, force=False):
+            return [cell_idx for cell_idx, cell in enumerate(cell_names)
+                    if force or (not manifest.is_up_to_date(self.get_figure_name(cell)))]
+
+        # draw and save the figure of every cell (or the cells in cell_indices) from the arrays made by prepare_sessions or load_results
+        # saved figures are recorded in the manifest if one is given
+        # with reuse_figure=True every worker (or the serial loop) keeps one figure and updates it for each cell,
+        # so the figure emitted to the GUI is the same figure for every cell
+        # figures are recorded once their files are written (figures are written in the background unless figure_output says otherwise)
+        # a multi-page pdf is only recorded in the manifest (and replaces the old pdf) once all of its pages are saved
+        # cancel_token (a CancellationToken) is checked before each cell -> once it is cancelled the figures already queued are
+        # written and recorded, cells that worker processes have not started are dropped and the cells they are drawing are
+        # waited for and recorded, then PlotCancelled is raised (a multi-page pdf is thrown away and the old one kept)
+        def render_figures(self, dir_output, *args, num_workers=1, cell_indices=None, manifest=None, reuse_figure=False,
+                           figure_output=None, cancel_token=None, **kwargs):
+            cell_names = self.cell_names
+            self.figure_template = None
+            if figure_output is not None:
+                self.figure_output = figure_output
+            if cell_indices is None:
+                cell_indices = range(len(cell_names))
+            if len(cell_indices) == 0:
+                return
+            # pages of a multi-page pdf are written in order by one process
+            if self.figure_output.multipage_pdf & (num_workers > 1):
+                print('All figures are saved to one pdf, so they are rendered in one process.')
+                num_workers = 1
+            if num_workers > 1:
+                # the per-session arrays are saved once and opened memory mapped by the workers instead of being pickled
+                # into every worker (see shared_arrays)
+                with tempfile.TemporaryDirectory() as array_folder:
+                    session_arrays = share_arrays({'session_spike_trains': self.session_spike_trains,
+                                                   'session_trajectories': self.session_trajectories,
+                                                   'session_ratemaps': self.session_ratemaps}, array_folder)
+                    with ProcessPoolExecutor(max_workers=num_workers, mp_context=WORKER_CONTEXT, initializer=_init_render_worker,
+                                             initargs=(self, session_arrays)) as executor:
+                        futures = [executor.submit(_render_cell_in_worker, cell_idx, dir_output, args, kwargs, reuse_figure)
+                                   for cell_idx in cell_indices]
+                        recorded = set()
+                        try:
+                            for future in as_completed(futures):
+                                cell = future.result()
+                                print(cell)
+                                if manifest is not None:
+                                    manifest.figure_saved(self.get_figure_name(cell))
+                                recorded.add(future)
+                                self.signals.cell_plotted.emit(cell)
+                                check_cancelled(cancel_token)
+                        except BaseException:
+                            executor.shutdown(wait=True, cancel_futures=True)
+                            for future in futures:
+                                if ((manifest is not None) and (future not in recorded) and future.done() and
+                                    (not future.cancelled()) and (future.exception() is None)):
+                                    manifest.figure_saved(self.get_figure_name(future.result()))
+                            raise
+                return
+            self.figure_output.open(dir_output)
+            try:
+                for cell_idx in cell_indices:
+                    check_cancelled(cancel_token)
+                    cell = cell_names[cell_idx]
+                    print(cell)
+                    figure = self.plot_cell(cell_idx, dir_output, *args, reuse_figure=reuse_figure, **kwargs)
+                    self.record_saved_figures(manifest)
+                    self.signals.figure_closed.emit()
+                    self.signals.figure_plotted.emit(figure)
+                    self.signals.cell_plotted.emit(cell)
+                    if not reuse_figure:
+                        plt.close(figure)
+            except BaseException:
+                self.figure_output.close(keep=False)
+                self.record_saved_figures(manifest)
+                raise
+            finally:
+                if self.figure_template is not None:
+                    plt.close(self.figure_template[0])
+                    self.figure_template = None
+            self.figure_output.close()
+            self.record_saved_figures(manifest)
+            if (manifest is not None) & self.figure_output.multipage_pdf:
+                manifest.figure_saved(MULTIPAGE_PDF_NAME)
+
+        # record the figures figure_output has written since the last call in the manifest
+        def record_saved_figures(self, manifest):
+            for figure_name in self.figure_output.pop_saved_figures():
+                if manifest is not None:
+                    manifest.figure_saved(figure_name)
+
+
+        # make and save the figure for one cell using the spike trains, trajectories and ratemaps from prepare_sessions
+        # reuse_figure=True keeps the figure of the first cell as a template -> the figures of the next cells only update the data of
+        # its plots instead of building the grid of axes again (the template is reset by render_figures)
+        def plot_cell(self, cell_idx, dir_output, *args, reuse_figure=False, **kwargs):
+            cell = self.cell_names[cell_idx]
+            if reuse_figure & (self.figure_template is not None):
+                figure, drawn_axes = self.figure_template
+                self.update_cell_figure(drawn_axes, cell_idx)
+            else:
+                figure, axes = self.create_cell_figure(*args)
+                drawn_axes = self.draw_cell_figure(axes, cell_idx, *args, **kwargs)
+                if reuse_figure:
+                    self.figure_template = (figure, drawn_axes)
+            self.figure_output.save(figure, dir_output, cell.lstrip())
+            return figure
+
+        # figure with a grid of axes -> one row per plot type in args and one column per session, axes[plot_num][session_idx]
+        def create_cell_figure(self, *args):
+            num_rows = len(args)
+            num_cols = self.num_sessions
+            figure= plt.figure()
+            gs = GridSpec(nrows=num_rows, ncols=num_cols, wspace=0.75, hspace=0.75)
+            polar_plots = ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier', 'hd_curve']
+            axes = []
+            for plot_num, plot_name in enumerate(args):
+                # number of axes needed to make subplots
+                if plot_name in polar_plots:
+                    axes.append([figure.add_subplot(gs[plot_num, j], projection="polar") for j in range(0, num_cols)])
+                else:
+                    axes.append([figure.add_subplot(gs[plot_num, j]) for j in range(0, num_cols)])
+            return figure, axes
+
+        # draw the plots of one cell on the axes from create_cell_figure
+        # returns the (plot type, session index, axis) of every plot drawn so they can be updated with another cell
+        def draw_cell_figure(self, axes, cell_idx, *args, **kwargs):
+            drawn_axes = []
+            for session_idx in range(self.num_sessions): 
+                #spike train holds the number of cell events closest to each video frame
+                spike_train = self.session_spike_trains[session_idx][cell_idx][:-1]
+                ratemaps = self.session_ratemaps[session_idx]
+                head_x, head_y, angles = self.session_trajectories[session_idx]
+                for arg_num, arg in enumerate(args):
+                    axis_to_plot = axes[arg_num][session_idx]
+                    axis_to_plot.axis('off')
+                    if ((arg == 'ebc_boundary_barrier')):
+
+                        if ((kwargs['barrier_coords'][session_idx][0][0] is not None) &
+                             (kwargs['barrier_coords'][session_idx][1][0] is not None)):
+                            self.splt.ebc_ratemap_subplot(ratemaps[arg][cell_idx], destination=None, axis=axis_to_plot, smoothed=True)
+                            drawn_axes.append((arg, session_idx, axis_to_plot))
+                    
+                    elif (arg == 'ebc_boundary'):
+                        self.splt.ebc_ratemap_subplot(ratemaps[arg][cell_idx], destination= None, axis= axis_to_plot, smoothed=True)
+                        drawn_axes.append((arg, session_idx, axis_to_plot))
+                    
+                    elif ((arg == 'ebc_barrier') & ('barrier_coords' in kwargs)):
+                        if ((kwargs['barrier_coords'][session_idx][0][0] is not None) & (kwargs['barrier_coords'][session_idx][1][0] is not None)):
+                            self.splt.ebc_ratemap_subplot(ratemaps[arg][cell_idx], destination=None, axis= axis_to_plot, smoothed=True)
+                            drawn_axes.append((arg, session_idx, axis_to_plot))
+                    
+                    elif ((arg == 'spike_plot') & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs)):
+                        self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'], spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
+                        drawn_axes.append((arg, session_idx, axis_to_plot))
+                    
+                    elif (arg == 'hd_curve') & ('hd_line_color' in kwargs):
+                        axis_to_plot.axis('on')
+                        self.splt.hd_ratemap_subplot(ratemaps[arg][cell_idx], line_color= kwargs['hd_line_color'],
+                                                     destination=None, axis=axis_to_plot)
+                        drawn_axes.append((arg, session_idx, axis_to_plot))
+                    
+                    elif (arg == 'heatmap'):
+                        self.splt.heatmap_ratemap_subplot(ratemaps[arg][cell_idx], destination=None, axis= axis_to_plot, smoothed=True)
+                        drawn_axes.append((arg, session_idx, axis_to_plot))
                     
-                    head_x, head_y, angles = plt_util.get_head_and_angles(self.sessions_data[session_idx][0], self.arena_x_length, self.arena_y_length)
-                    head_x, head_y, angles = head_x[:-1], head_y[:-1], angles[:-1]
-                    spike_train = spike_train[:-1]
-                    for arg_num, arg in enumerate(args):
-                        axis_to_plot_idx = next((i for i,
-                                                  sublist in enumerate(ax_indices) if sublist == [arg_num, session_idx]), None)
-                        axis_to_plot = axes[axis_to_plot_idx]
-                        axis_to_plot.axis('off')
-                        if ((arg == 'ebc_boundary_barrier')):
-
-                            if ((kwargs['barrier_coords'][session_idx][0][0] is not None) &
-                                 (kwargs['barrier_coords'][session_idx][1][0] is not None)):
-                                
-                                barrier_start = kwargs['barrier_coords'][session_idx][0]
-                                barrier_end = kwargs['barrier_coords'][session_idx][1]
-                                boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(head_x, head_y, angles)
-                                boundary_bearings, boundary_distances = boundary_bearings[:-1], boundary_distances[:-1]
-                                barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(head_x, head_y, angles, barrier_start, barrier_end)
-                                barrier_bearings, barrier_distances = barrier_bearings[:-1], barrier_distances[:-1]
-                                all_bearings = np.concatenate([boundary_bearings, barrier_bearings],axis=1)
-                                all_dists = np.concatenate([boundary_distances, barrier_distances],axis=1)
-                                all_bearings, all_dists = all_bearings[:-1], all_dists[:-1]
-                                self.splt.ebc_subplot(all_bearings, all_dists,
-                                                       spike_train, destination=None, axis=axis_to_plot)                        
-                        
-                        elif (arg == 'ebc_boundary'):
-                            boundary_bearings, boundary_distances = plt_util.ego_boundary_measurements(head_x, head_y, angles)
-                            boundary_bearings, boundary_distances = boundary_bearings[:-1], boundary_distances[:-1]
-                            self.splt.ebc_subplot(boundary_bearings, boundary_distances, spike_train,
-                                                   destination= None, axis= axis_to_plot)
-                        
-                        elif ((arg == 'ebc_barrier') & ('barrier_coords' in kwargs)):
-                            if ((kwargs['barrier_coords'][session_idx][0][0] is not None) & (kwargs['barrier_coords'][session_idx][1][0] is not None)):
-#                               barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(head_x, head_y, angles,
-                                                                                                              #kwargs['barrier_coords'][session_idx][0], kwargs['barrier_coords'][session_idx][1])
-                                barrier_start = kwargs['barrier_coords'][session_idx][0]
-                                barrier_end = kwargs['barrier_coords'][session_idx][1]
-
-                                barrier_bearings, barrier_distances = plt_util.inserted_barrier_measurements(head_x, head_y, angles, barrier_start, barrier_end)
-                                barrier_bearings, barrier_distances = barrier_bearings[:-1], barrier_distances[:-1]
-                                self.splt.ebc_subplot(barrier_bearings, barrier_distances, spike_train, destination=None, axis= axis_to_plot)
-                        
-                        elif ((arg == 'spike_plot') & ('spike_line_color' in kwargs) & ('spike_size' in kwargs) & ('line_size' in kwargs)):
-                            self.splt.path_spike_plot_subplot(head_x, head_y, angles, spike_train, destination=None, line_color = kwargs['spike_line_color'], spike_sizes = kwargs['spike_size'], line_size=kwargs['line_size'], axis = axis_to_plot)
-                        
-                        elif (arg == 'hd_curve') & ('hd_line_color' in kwargs):
-                            axis_to_plot.axis('on')
-                            self.splt.hd_curve_subplot(angles, spike_train, line_color= kwargs['hd_line_color'], destination=None, axis=axis_to_plot)
-                        
-                        elif (arg == 'heatmap'):
-                            self.splt.heatmap_subplot(head_x, head_y, spike_train, destination=None, axis= axis_to_plot)
-                        
-                        else:
-                            raise ValueError(fr"The argument {arg} provided is not a valid plot type.")
-                plt.tight_layout()
-                destination = os.path.join(dir_output, fr'{cell.lstrip()}')
-                figure.savefig(destination,dpi=300)
-                self.signals.figure_closed.emit()
-                self.signals.figure_plotted.emit(figure)
-                self.signals.cell_plotted.emit(cell)
-                plt.close()
+                    else:
+                        raise ValueError(fr"The argument {arg} provided is not a valid plot type.")
+            return drawn_axes
+
+        # replace the data of the plots drawn by draw_cell_figure with the data of another cell
+        def update_cell_figure(self, drawn_axes, cell_idx):
+            for arg, session_idx, axis in drawn_axes:
+                ratemaps = self.session_ratemaps[session_idx]
+                if arg in ['ebc_boundary', 'ebc_barrier', 'ebc_boundary_barrier']:
+                    self.splt.update_ebc_ratemap_subplot(ratemaps[arg][cell_idx], axis, smoothed=True)
+                elif arg == 'spike_plot':
+                    head_x, head_y, angles = self.session_trajectories[session_idx]
+                    spike_train = self.session_spike_trains[session_idx][cell_idx][:-1]
+                    self.splt.update_path_spike_plot_subplot(head_x, head_y, angles, spike_train, axis)
+                elif arg == 'hd_curve':
+                    self.splt.update_hd_ratemap_subplot(ratemaps[arg][cell_idx], axis)
+                elif arg == 'heatmap':
+                    self.splt.update_heatmap_ratemap_subplot(ratemaps[arg][cell_idx], axis, smoothed=True)
+
+
+# state of a worker process used for parallel rendering -> set once per worker by the pool initializer
+_worker_plots = None
+
+def _init_render_worker(timeseries_plots, session_arrays):
+    global _worker_plots
+    # workers never show figures, so use the non-interactive backend
+    plt.switch_backend('Agg')
+    _worker_plots = timeseries_plots
+    for name, value in load_shared_arrays(session_arrays).items():
+        setattr(_worker_plots, name, value)
+    _worker_plots.figure_template = None
+
+def _render_cell_in_worker(cell_idx, dir_output, args, kwargs, reuse_figure=False):
+    figure = _worker_plots.plot_cell(cell_idx, dir_output, *args, reuse_figure=reuse_figure, **kwargs)
+    # the template figure of the worker is kept open to plot its next cells
+    if not reuse_figure:
+        plt.close(figure)
+    return _worker_plots.cell_names[cell_idx]
 
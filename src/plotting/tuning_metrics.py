@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pandas as pd
+from src.plotting.ratemaps import compute_ratemaps, get_occupancy
+from src.plotting.shuffles import get_bin_angles, mean_resultant_vector, spatial_information, shuffle_test
+
+# table of tuning metrics for every cell and session -> screens all cells from their ratemaps without drawing any figures
+# metrics are computed from the same occupancy and ratemaps the plots use (smoothed the same way they are plotted):
+#   + num_events and mean_rate (events / s over the frames of the session)
+#   + spatial_information (bits / spike) of the heatmap
+#   + hd_mean_vector_length and hd_preferred_direction (degrees) of the HD curve
+#   + ebc_mean_resultant_length, ebc_preferred_bearing (degrees) and ebc_preferred_distance (cm) of the EBC boundary ratemap,
+#     the preferred distance is the distance bin (center) with the highest rate at the preferred bearing
+# num_shuffles > 0 adds the shuffle p value (see shuffles.shuffle_test) of the spatial information, HD mean vector length
+# and EBC mean resultant length of each cell
+# tables are saved as csv, or as parquet if pandas has a parquet engine (pyarrow or fastparquet) installed
+
+METRICS_FILE_NAME = 'tuning_metrics'
+METRICS_FORMATS = ['csv', 'parquet']
+# ratemap plot types the metrics are computed from
+METRIC_PLOTS = ['ebc_boundary', 'heatmap', 'hd_curve']
+# metric that the shuffle p value of each ratemap plot type is computed for
+SHUFFLED_METRICS = {'heatmap': 'spatial_information', 'hd_curve': 'hd_mean_vector_length',
+                    'ebc_boundary': 'ebc_mean_resultant_length'}
+# columns of the metrics table for each cell and session (p values are only added when shuffles are run)
+METRIC_NAMES = ['num_events', 'mean_rate', 'spatial_information', 'hd_mean_vector_length', 'hd_preferred_direction',
+                'ebc_mean_resultant_length', 'ebc_preferred_bearing', 'ebc_preferred_distance']
+P_VALUE_METRICS = [f'{metric_name}_p_value' for metric_name in SHUFFLED_METRICS.values()]
+
+# preferred angle (degrees from 0 to 360) of mean resultant vectors
+def get_preferred_angle(vectors):
+    return np.mod(np.rad2deg(np.angle(vectors)), 360.)
+
+# tuning metrics of every cell in a session -> returns a dictionary of arrays with one value per cell
+# spike_trains is a cells x frames array of spike trains aligned to the frames of geometry (a SessionGeometry)
+# ratemaps optionally holds smoothed ratemaps of all cells that were already computed for plotting (ex. session_ratemaps of
+# TimeSeriesPlots), the plot types in METRIC_PLOTS that are missing are computed from geometry
+def get_session_metrics(geometry, spike_trains, ratemaps=None, num_shuffles=0, seed=None, num_workers=1):
+    spike_trains = np.asarray(spike_trains)[:, :len(geometry)]
+    ratemaps = {} if ratemaps is None else ratemaps
+    ratemaps = {kind: ratemaps[kind] if kind in ratemaps else compute_ratemaps(geometry, spike_trains, kind=kind, smooth=True)
+                for kind in METRIC_PLOTS}
+    metrics = {}
+    metrics['num_events'] = spike_trains.sum(axis=1)
+    metrics['mean_rate'] = metrics['num_events'] / np.sum(geometry.frame_durations)
+
+    metrics['spatial_information'] = spatial_information(ratemaps['heatmap'], get_occupancy(geometry, 'heatmap').occ)
+
+    hd_curves = ratemaps['hd_curve']
+    hd_vectors = mean_resultant_vector(hd_curves, get_bin_angles(hd_curves.shape[-1]))
+    metrics['hd_mean_vector_length'] = np.abs(hd_vectors)
+    metrics['hd_preferred_direction'] = get_preferred_angle(hd_vectors)
+
+    # EBC ratemaps are (cells, bearing bins, distance bins) -> bearing tuning comes from the ratemaps collapsed over distance
+    ebc_ratemaps = ratemaps['ebc_boundary']
+    num_bearing_bins = ebc_ratemaps.shape[1]
+    ebc_vectors = mean_resultant_vector(np.nansum(ebc_ratemaps, axis=2), get_bin_angles(num_bearing_bins))
+    preferred_bearing = get_preferred_angle(ebc_vectors)
+    metrics['ebc_mean_resultant_length'] = np.abs(ebc_vectors)
+    metrics['ebc_preferred_bearing'] = preferred_bearing
+    bearing_bins = np.nan_to_num(preferred_bearing // (360. / num_bearing_bins)).astype(int) % num_bearing_bins
+    preferred_bearing_rates = ebc_ratemaps[np.arange(len(ebc_ratemaps)), bearing_bins]
+    distance_bins = np.argmax(np.nan_to_num(preferred_bearing_rates, nan=-np.inf), axis=1)
+    metrics['ebc_preferred_distance'] = np.where(np.isnan(preferred_bearing), np.nan,
+                                                 (distance_bins + 0.5) * geometry.dist_bin_size)
+
+    if num_shuffles > 0:
+        for kind, metric_name in SHUFFLED_METRICS.items():
+            results = shuffle_test(geometry, spike_trains, kind, num_shuffles=num_shuffles, seed=seed, num_workers=num_workers)
+            metrics[f'{metric_name}_p_value'] = results['p_value']
+    return metrics
+
+# table with one row per cell and session from the metrics of each session (from get_session_metrics)
+def get_metrics_table(cell_names, session_metrics):
+    cells = [str(cell).lstrip() for cell in cell_names]
+    tables = [pd.DataFrame({'cell': cells, 'session': session_idx + 1, **metrics})
+              for session_idx, metrics in enumerate(session_metrics)]
+    return pd.concat(tables, ignore_index=True)
+
+# path of the tuning metrics table in an output folder
+def get_metrics_path(output_folder, file_format='csv'):
+    if file_format not in METRICS_FORMATS:
+        raise ValueError(f'{file_format} is not a valid tuning metrics format, use one of {METRICS_FORMATS}.')
+    return os.path.join(output_folder, f'{METRICS_FILE_NAME}.{file_format}')
+
+# save a tuning metrics table as csv or parquet (from the extension of metrics_path)
+def save_metrics_table(table, metrics_path):
+    # write to a temporary file first so a crash never leaves a half written table
+    tmp_path = f'{metrics_path}.{os.getpid()}.tmp'
+    if metrics_path.endswith('.parquet'):
+        try:
+            table.to_parquet(tmp_path, index=False)
+        except ImportError:
+            raise Exception('pyarrow or fastparquet is needed to save tuning metrics as parquet, save them as csv instead.')
+    else:
+        table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, metrics_path)
+
+# load a tuning metrics table saved by save_metrics_table
+def load_metrics_table(metrics_path):
+    if metrics_path.endswith('.parquet'):
+        return pd.read_parquet(metrics_path)
+    return pd.read_csv(metrics_path)
+
+# whether output_folder has a tuning metrics table in file_format (with the shuffle p values if p_values=True)
+def has_metrics_table(output_folder, file_format='csv', p_values=False):
+    metrics_path = get_metrics_path(output_folder, file_format)
+    if not os.path.exists(metrics_path):
+        return False
+    return (not p_values) or all(metric in load_metrics_table(metrics_path) for metric in P_VALUE_METRICS)
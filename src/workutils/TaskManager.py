@@ -1,60 +1,155 @@
 from PyQt5.QtCore import Qt, QObject, pyqtSignal as Signal, pyqtSlot as Slot, QThreadPool
 from src.workutils.WorkerThread import Worker
+from src.workutils.cancellation import PlotCancelled
 
-# # class to handle the execution of tasks in the queue sequentially-> set up finished signal
+# resource of the tasks that draw figures -> matplotlib is not thread safe, so only one of them runs at a time
+FIGURE_RESOURCE = 'figures'
+
+# placeholder for the return value of another task in the arguments of a task
+# ex. add_graph_task('render_prepared_figures', args=(TaskResult(prepare_task), 'heatmap')) -> replaced by the value
+# prepare_task returned once it is done, so tasks share what they computed instead of computing it again
+class TaskResult(object):
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+# # class to handle the execution of a graph of tasks -> set up finished signal
+# every task is a method of a process object (timeseries or longitudinal plots) with its arguments and the tasks it depends on
+# a task starts once all the tasks it depends on are done, and at most max_concurrent_tasks tasks run at the same time
+# tasks added with add_task run after the last task added for the same process object, so the tasks of one process object
+# still run in order while tasks of different process objects (ex. timeseries and longitudinal plots) run together
+# tasks with the same resource (ex. FIGURE_RESOURCE) never run at the same time
+# a task is skipped if a task it depends on failed, was cancelled or was skipped
+# tasks with a cancel_token keyword argument (a CancellationToken) are stopped through it by quit_tasks
 class TaskManager(QObject):
     # setup finished signal
     tasks_completed = Signal()
     task_progress = Signal()
-    
+    # id of a task that finished, failed, was cancelled or was skipped
+    task_finished = Signal(str)
+
 
-# initialize queue and index of tasks
-    def __init__(self, parent=None):
+# initialize graph of tasks
+    def __init__(self, parent=None, max_concurrent_tasks=2):
         super(TaskManager, self).__init__(parent)
-        self.task_queue = [] # queue
-        self.current_task_index = 0
+        # task id -> task, in the order tasks were added (tasks can only depend on tasks added before them)
+        self.tasks = {}
+        # return value of every task that is done
+        self.results = {}
+        # last task added for each process object (by id)
+        self.last_object_tasks = {}
+        # signals of the running workers -> (task id, worker)
+        self.running_workers = {}
         self.process_object = None
         self.is_running = False
-        #self.workers = []
-        
+        self.thread_pool = QThreadPool(self)
+        self.set_max_concurrent_tasks(max_concurrent_tasks)
+
 # set the type of data process object to perform on-> either timeseries or longitudinal process
     def set_process_object(self, process_object):
         self.process_object = process_object
 
+    def set_max_concurrent_tasks(self, max_concurrent_tasks):
+        self.max_concurrent_tasks = max(1, max_concurrent_tasks)
+        self.thread_pool.setMaxThreadCount(self.max_concurrent_tasks)
+
 
-# add the function name and optional arguments to the queue 
+# add the function name and optional arguments of the process object as a task that runs after the last task of that object
+# returns the id of the task
     def add_task(self, method_name, *args, **kwargs):
-        self.task_queue.append((method_name, args, kwargs))
+        last_task = self.last_object_tasks.get(id(self.process_object))
+        return self.add_graph_task(method_name, args, kwargs, depends_on=[] if last_task is None else [last_task])
+
+# add a task that runs once the tasks in depends_on are done (tasks whose results are in its arguments are added to them)
+# process_object defaults to the one set by set_process_object, resource stops tasks with the same resource running together
+# returns the id of the task (task_id, or one made from the method name)
+    def add_graph_task(self, method_name, args=(), kwargs=None, depends_on=(), process_object=None, resource=None,
+                       task_id=None):
+        kwargs = {} if kwargs is None else kwargs
+        process_object = self.process_object if process_object is None else process_object
+        if task_id is None:
+            task_id = f'{method_name}_{len(self.tasks)}'
+        if task_id in self.tasks:
+            raise ValueError(f'A task with the id {task_id} has already been added.')
+        depends_on = list(depends_on) + [arg.task_id for arg in list(args) + list(kwargs.values())
+                                         if isinstance(arg, TaskResult)]
+        unknown_tasks = [dependency for dependency in depends_on if dependency not in self.tasks]
+        if len(unknown_tasks) > 0:
+            raise ValueError(f'The tasks {unknown_tasks} have not been added.')
+        self.tasks[task_id] = {'method_name': method_name, 'args': tuple(args), 'kwargs': kwargs,
+                               'depends_on': set(depends_on), 'process_object': process_object, 'resource': resource,
+                               'state': 'waiting'}
+        self.last_object_tasks[id(process_object)] = task_id
+        return task_id
 
-# start at beginning of queue and execute task
+# start every task that can run (tasks can be added and started again while others are running)
     def start_tasks(self):
-        self.current_task_index = 0
-        self.execute_next_task()
+        self.is_running = True
+        self.execute_ready_tasks()
 
+# start the waiting tasks whose dependencies are done, while fewer than max_concurrent_tasks run and their resource is free
+# tasks are checked in the order they were added, so a skipped task also skips the tasks after it that depend on it
 # for each task construct a worker object that will execute the run function
 # setup finished signal (queued connection) to be emitted when worker is finished with task
-# start thread from global thread pool 
-# if at end of queue emit tasks_completed signal
-    def execute_next_task(self):
-        if self.current_task_index < len(self.task_queue):
-            self.is_running = True
-            method_name, args, kwargs = self.task_queue[self.current_task_index]
-            worker = Worker(self.process_object, method_name, *args, **kwargs)
-            worker.signals.finished.connect(self.on_task_finished, Qt.QueuedConnection)
-            QThreadPool.globalInstance().start(worker)
-        else:
+# if all tasks are finished emit tasks_completed signal
+    def execute_ready_tasks(self):
+        for task_id, task in self.tasks.items():
+            if task['state'] != 'waiting':
+                continue
+            dependency_states = [self.tasks[dependency]['state'] for dependency in task['depends_on']]
+            if any(state in ['failed', 'cancelled', 'skipped'] for state in dependency_states):
+                print(f'Task {task_id} skipped because a task it depends on did not finish.')
+                task['state'] = 'skipped'
+                self.task_finished.emit(task_id)
+                continue
+            running_resources = [self.tasks[running_id]['resource'] for running_id, _ in self.running_workers.values()]
+            if (all(state == 'done' for state in dependency_states) & (len(self.running_workers) < self.max_concurrent_tasks) &
+                ((task['resource'] is None) or (task['resource'] not in running_resources))):
+                self.execute_task(task_id)
+        if (len(self.running_workers) == 0) & all(task['state'] != 'waiting' for task in self.tasks.values()):
             # All tasks completed
-            self.is_running = False 
+            self.is_running = False
+            self.tasks.clear()
+            self.results.clear()
+            self.last_object_tasks.clear()
             self.tasks_completed.emit()
-            self.task_queue.clear()
-
-# hook up finished signal to slot for task and execute next task in queue
-    @Slot()
-    def on_task_finished(self):
-        self.current_task_index += 1
-        self.execute_next_task()
-    
-    # remove tasks in task queue to stop processing
+
+# replace the TaskResult arguments of a task with the results of those tasks and start it in the thread pool
+    def execute_task(self, task_id):
+        task = self.tasks[task_id]
+        task['state'] = 'running'
+        get_value = lambda arg: self.results[arg.task_id] if isinstance(arg, TaskResult) else arg
+        args = [get_value(arg) for arg in task['args']]
+        kwargs = {key: get_value(value) for key, value in task['kwargs'].items()}
+        worker = Worker(task['process_object'], task['method_name'], *args, **kwargs)
+        # the worker is kept until its result is read
+        worker.setAutoDelete(False)
+        worker.signals.finished.connect(self.on_task_finished, Qt.QueuedConnection)
+        self.running_workers[worker.signals] = (task_id, worker)
+        self.thread_pool.start(worker)
+
+# hook up finished signal to slot for task, keep its result and start the tasks that were waiting for it
+    @Slot(object)
+    def on_task_finished(self, worker):
+        task_id, _ = self.running_workers.pop(worker.signals)
+        if worker.error is None:
+            self.tasks[task_id]['state'] = 'done'
+            self.results[task_id] = worker.result
+        elif isinstance(worker.error, PlotCancelled):
+            self.tasks[task_id]['state'] = 'cancelled'
+        else:
+            self.tasks[task_id]['state'] = 'failed'
+        self.task_progress.emit()
+        self.task_finished.emit(task_id)
+        self.execute_ready_tasks()
+
+    # remove tasks that have not started and cancel the running tasks to stop processing
+    # running tasks stop at their next check of the cancel token (between cells and sessions), tasks without a token finish
     def quit_tasks(self):
         if self.is_running:
-            self.task_queue.clear()
+            for task_id, task in self.tasks.items():
+                if (task['state'] in ['waiting', 'running']) and (task['kwargs'].get('cancel_token') is not None):
+                    task['kwargs']['cancel_token'].cancel()
+                if task['state'] == 'waiting':
+                    task['state'] = 'skipped'
+                    self.task_finished.emit(task_id)
+            self.execute_ready_tasks()
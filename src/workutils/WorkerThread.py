@@ -1,12 +1,15 @@
 from PyQt5.QtCore import QObject, pyqtSignal as Signal, pyqtSlot as Slot, QRunnable
 import traceback
+from src.workutils.cancellation import PlotCancelled
 
-# setup trigger signal for tasks 
+# setup trigger signal for tasks -> finished sends the worker, so its result or error can be read once it is done
 class TriggerSignals(QObject):
-    finished = Signal()
+    finished = Signal(object)
 
 # worker thread -> takes in either timeseries or longitudinal process object, its method to be called
 # in a string, and optional arguments to the function
+# the return value of the method is kept in result, and the exception it raised (if any) in error
+# (PlotCancelled when the method was stopped with its cancel token)
 class Worker(QRunnable):
     def __init__(self, process_object, method_name, *args, **kwargs):
         super(Worker, self).__init__()
@@ -15,6 +18,8 @@ class Worker(QRunnable):
         self.args = args
         self.kwargs = kwargs
         self.signals = TriggerSignals()
+        self.result = None
+        self.error = None
 
 # override of QRunnable run method
 # execute function provided in constructor and emit finished signal from this slot once it is done
@@ -23,11 +28,17 @@ class Worker(QRunnable):
         func = getattr(self.process_object, self.method_name, None)
         try:
             if func is not None and callable(func):
-                func(*self.args, **self.kwargs)
+                self.result = func(*self.args, **self.kwargs)
+            else:
+                raise AttributeError(f'{self.method_name} is not a method of {type(self.process_object).__name__}.')
+        except PlotCancelled as e:
+            print(e)
+            self.error = e
         except Exception as e:   
             print(f"ERROR: {e}")
             traceback.print_exc()
-        self.signals.finished.emit()
+            self.error = e
+        self.signals.finished.emit(self)
         
 
     
@@ -0,0 +1,26 @@
+import threading
+
+# cooperative cancellation of plotting jobs -> a job is given a CancellationToken and checks it between sessions and cells,
+# so it stops at the next cell instead of rendering every remaining cell
+# a cancelled job raises PlotCancelled, figures written before it stopped stay recorded in the manifest of the output folder
+# and figures it had queued are still written, so the folder is consistent and a rerun only makes the missing figures
+
+# raised by a plotting job once its token is cancelled
+class PlotCancelled(Exception):
+    pass
+
+# cancelled from the GUI thread (ex. the stop button or TaskManager.quit_tasks) and checked in the thread running the job
+class CancellationToken(object):
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+# raise PlotCancelled if cancel_token was cancelled (None for jobs that cannot be cancelled)
+def check_cancelled(cancel_token):
+    if (cancel_token is not None) and cancel_token.is_cancelled():
+        raise PlotCancelled('Plotting was cancelled.')
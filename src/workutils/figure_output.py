@@ -0,0 +1,124 @@
+import os
+import io
+from matplotlib.backends.backend_pdf import PdfPages
+from src.workutils.figure_writer import FigureWriter
+
+# how figures are saved -> file format, resolution, optional low resolution thumbnails and multi-page pdf output
+# raster formats (png, jpg, webp) are saved at dpi, svg and pdf are vector formats so dpi only changes their embedded images
+# thumbnails are png previews saved at thumbnail_dpi (ex. 72) in a 'thumbnails' folder next to the full resolution figures
+# multipage_pdf=True saves every figure as a page of one pdf in the output folder instead of one file per figure,
+# ex. FigureOutput('pdf', multipage_pdf=True) -> one file to copy to a network share instead of hundreds of small files
+# background_writes=True renders each figure to bytes and leaves writing the files to a FigureWriter thread between open and close,
+# with at most max_pending_writes figures waiting to be written (pages of a multi-page pdf are always written directly)
+# the names of the figure files saved are collected so they can be recorded (ex. in a manifest) once they are on disk
+
+OUTPUT_FORMATS = ['png', 'jpg', 'webp', 'svg', 'pdf']
+THUMBNAIL_FOLDER_NAME = 'thumbnails'
+MULTIPAGE_PDF_NAME = 'figures.pdf'
+
+class FigureOutput(object):
+    def __init__(self, file_format='png', dpi=300, thumbnail_dpi=None, multipage_pdf=False, background_writes=True,
+                 max_pending_writes=8):
+        file_format = file_format.lower().lstrip('.')
+        if file_format == 'jpeg':
+            file_format = 'jpg'
+        if file_format not in OUTPUT_FORMATS:
+            raise ValueError(f'{file_format} is not a valid figure format, use one of {OUTPUT_FORMATS}.')
+        if multipage_pdf & (file_format != 'pdf'):
+            raise ValueError('Figures can only be saved to one multi-page file as a pdf.')
+        if (dpi <= 0) or ((thumbnail_dpi is not None) and (thumbnail_dpi <= 0)):
+            raise ValueError('Figure DPI must be greater than 0.')
+        self.file_format = file_format
+        self.dpi = dpi
+        self.thumbnail_dpi = thumbnail_dpi
+        self.multipage_pdf = multipage_pdf
+        self.background_writes = background_writes
+        self.max_pending_writes = max_pending_writes
+        self.pdf_pages = None
+        self.writer = None
+        self.saved_figures = []
+
+    # options that change the saved files -> used in the manifest of an output folder
+    def get_options(self):
+        return {'format': self.file_format, 'dpi': self.dpi, 'thumbnail_dpi': self.thumbnail_dpi,
+                'multipage_pdf': self.multipage_pdf}
+
+    # file name of a figure saved with this output (name without an extension, ex. a cell name)
+    # all figures of a multi-page pdf are in the same file
+    def get_figure_name(self, name):
+        if self.multipage_pdf:
+            return MULTIPAGE_PDF_NAME
+        return f'{name}.{self.file_format}'
+
+    # open the multi-page pdf of an output folder (pages are written to a temporary file until close is called)
+    # or start the background writer
+    def open(self, output_folder):
+        if self.multipage_pdf:
+            self.pdf_path = os.path.join(output_folder, MULTIPAGE_PDF_NAME)
+            self.pdf_tmp_path = f'{self.pdf_path}.{os.getpid()}.tmp'
+            self.pdf_pages = PdfPages(self.pdf_tmp_path)
+        elif self.background_writes:
+            self.writer = FigureWriter(self.max_pending_writes)
+
+    # save a figure to the output folder (or as the next page of the open multi-page pdf)
+    def save(self, figure, output_folder, name):
+        # (path, format, dpi) of every file saved for the figure
+        files = []
+        if self.multipage_pdf:
+            if self.pdf_pages is None:
+                raise Exception('The multi-page pdf has to be opened before figures are saved to it.')
+            self.pdf_pages.savefig(figure, dpi=self.dpi)
+        else:
+            files.append((os.path.join(output_folder, self.get_figure_name(name)), self.file_format, self.dpi))
+        if self.thumbnail_dpi is not None:
+            thumbnail_folder = os.path.join(output_folder, THUMBNAIL_FOLDER_NAME)
+            if not os.path.isdir(thumbnail_folder):
+                os.makedirs(thumbnail_folder, exist_ok=True)
+            files.append((os.path.join(thumbnail_folder, f'{name}.png'), 'png', self.thumbnail_dpi))
+        if self.writer is not None:
+            rendered_files = []
+            for path, file_format, dpi in files:
+                buffer = io.BytesIO()
+                figure.savefig(buffer, dpi=dpi, format=file_format)
+                rendered_files.append((path, buffer.getvalue()))
+            self.writer.write(rendered_files, self.get_figure_name(name))
+            return
+        for path, file_format, dpi in files:
+            figure.savefig(path, dpi=dpi, format=file_format)
+        if not self.multipage_pdf:
+            self.saved_figures.append(self.get_figure_name(name))
+
+    # file names of the figures saved (and written to disk) since the last call
+    # pages of a multi-page pdf are not included, the pdf is saved when close is called
+    def pop_saved_figures(self):
+        if self.writer is not None:
+            self.saved_figures.extend(self.writer.pop_written())
+        saved_figures, self.saved_figures = self.saved_figures, []
+        return saved_figures
+
+    # finish the multi-page pdf -> it replaces the pdf in the output folder only once all of its pages are written
+    # keep=False throws the pages away (ex. when plotting failed part way)
+    # the background writer always writes the figures queued before it stops, errors writing them are raised if keep=True
+    def close(self, keep=True):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+            self.saved_figures.extend(writer.pop_written())
+            if keep:
+                writer.raise_error()
+        if self.pdf_pages is None:
+            return
+        self.pdf_pages.close()
+        self.pdf_pages = None
+        if keep:
+            os.replace(self.pdf_tmp_path, self.pdf_path)
+        else:
+            os.remove(self.pdf_tmp_path)
+
+    # the open pdf and the writer thread are not sent to worker processes -> workers save their figures directly
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pdf_pages'] = None
+        state['writer'] = None
+        state['saved_figures'] = []
+        return state
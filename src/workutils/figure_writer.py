@@ -0,0 +1,61 @@
+import os
+import queue
+import threading
+
+# background thread that writes saved figures to disk -> figures are rendered to bytes in the plotting thread and the files
+# are written here, so drawing the next cell overlaps with writing the last one (ex. on a network drive)
+# at most max_pending figures wait to be written, write blocks when the queue is full so memory stays bounded
+# every file is written to a temporary file and renamed, so a stopped run never leaves a half written figure
+# an error writing a file is raised by the next call to write or raise_error, and the figures after it are not written
+class FigureWriter(object):
+    def __init__(self, max_pending=8):
+        self.pending = queue.Queue(maxsize=max(1, max_pending))
+        self.written = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # queue the files of one figure -> files is a list of (path, bytes), figure_name is returned by pop_written once they are written
+    def write(self, files, figure_name):
+        self.raise_error()
+        self.pending.put((files, figure_name))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            files, figure_name = item
+            if self.error is not None:
+                continue
+            try:
+                for path, data in files:
+                    write_file(path, data)
+                self.written.put(figure_name)
+            except Exception as e:
+                self.error = e
+
+    # names of the figures written since the last call
+    def pop_written(self):
+        figure_names = []
+        while True:
+            try:
+                figure_names.append(self.written.get_nowait())
+            except queue.Empty:
+                return figure_names
+
+    # wait for the queued figures to be written and stop the thread
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise Exception(f'Could not write figure: {self.error}') from self.error
+
+# write bytes to path through a temporary file in the same folder
+def write_file(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import traceback
+import numpy as np
+import pandas as pd
+
+# on-disk cache of parsed DLC and spike csv files so reruns skip csv parsing
+# each csv is stored as one .npz file of column arrays, keyed by the csv path, size and modification time,
+# so an edited or replaced csv is parsed again
+# the cache is kept under a size limit by deleting the least recently used entries
+
+CACHE_FOLDER_NAME = '.plot_cache'
+DEFAULT_CACHE_SIZE = 2 * 1024**3 # bytes
+
+def get_cache_dir(output_folder):
+    return os.path.join(output_folder, CACHE_FOLDER_NAME)
+
+# key for a file -> changes whenever the file is moved, resized or modified
+def get_cache_key(file_path):
+    stat = os.stat(file_path)
+    key_string = f'{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}'
+    return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+# store each column as its own array with the column names (tuples for multi-level headers) saved as json
+def save_frame(data_frame, cache_path):
+    multi_level = isinstance(data_frame.columns, pd.MultiIndex)
+    column_names = [list(col) if multi_level else col for col in data_frame.columns]
+    arrays = {'columns': np.array(json.dumps({'names': column_names, 'multi_level': multi_level}))}
+    for col_idx, col in enumerate(data_frame.columns):
+        values = data_frame[col].to_numpy()
+        if not np.issubdtype(values.dtype, np.number):
+            values = values.astype(str)
+        arrays[f'col_{col_idx}'] = values
+    # write to a temporary file first so other jobs never read a half written cache file
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(tmp_path, cache_path)
+
+def load_frame(cache_path):
+    with np.load(cache_path, allow_pickle=False) as arrays:
+        column_info = json.loads(str(arrays['columns']))
+        names = column_info['names']
+        data = {idx: arrays[f'col_{idx}'] for idx in range(len(names))}
+    data_frame = pd.DataFrame(data)
+    if column_info['multi_level']:
+        data_frame.columns = pd.MultiIndex.from_tuples([tuple(name) for name in names])
+    else:
+        data_frame.columns = names
+    return data_frame
+
+# delete least recently used cache files until the cache is under max_cache_bytes
+def evict_cache(cache_dir, max_cache_bytes):
+    entries = []
+    for file in os.listdir(cache_dir):
+        if file.endswith('.npz'):
+            path = os.path.join(cache_dir, file)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total_size = sum(entry[1] for entry in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_cache_bytes:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+# read a csv through the cache -> kwargs are passed to pd.read_csv when the file has to be parsed
+# cache_dir=None or use_cache=False reads the csv directly
+def read_csv_cached(file_path, cache_dir=None, use_cache=True, max_cache_bytes=DEFAULT_CACHE_SIZE, **kwargs):
+    if (cache_dir is None) or (not use_cache):
+        return pd.read_csv(file_path, **kwargs)
+    cache_path = os.path.join(cache_dir, get_cache_key(file_path) + '.npz')
+    if os.path.exists(cache_path):
+        try:
+            data_frame = load_frame(cache_path)
+            # mark entry as recently used
+            os.utime(cache_path)
+            return data_frame
+        except Exception:
+            print(f'Could not read cached copy of {file_path}, parsing it again.')
+    data_frame = pd.read_csv(file_path, **kwargs)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_frame(data_frame, cache_path)
+        evict_cache(cache_dir, max_cache_bytes)
+    except Exception:
+        print(f'Could not cache {file_path}.')
+        traceback.print_exc()
+    return data_frame
+
+# DLC files have a scorer row above the bodypart and coordinate header rows
+def read_dlc_file(file_path, cache_dir=None, use_cache=True, max_cache_bytes=DEFAULT_CACHE_SIZE):
+    return read_csv_cached(file_path, cache_dir, use_cache, max_cache_bytes, header=[1,2])
+
+def read_spike_file(file_path, cache_dir=None, use_cache=True, max_cache_bytes=DEFAULT_CACHE_SIZE):
+    return read_csv_cached(file_path, cache_dir, use_cache, max_cache_bytes)
+
+# LOF files hold the epoch time (ms) of every video frame -> returned as a float64 array
+# the frame times are taken from the last column, rows that are not numbers (ex. a header) are skipped
+def read_frame_times(file_path, cache_dir=None, use_cache=True, max_cache_bytes=DEFAULT_CACHE_SIZE):
+    data_frame = read_csv_cached(file_path, cache_dir, use_cache, max_cache_bytes, header=None)
+    frame_times = pd.to_numeric(data_frame.iloc[:, -1], errors='coerce').to_numpy(dtype=np.float64)
+    return frame_times[~np.isnan(frame_times)]
@@ -1,7 +1,7 @@
 import os
 import traceback
 import shutil
-import pandas as pd
+from src.workutils.file_cache import get_cache_dir, read_dlc_file, read_spike_file, read_frame_times
 
 # functions for finding directories with calcium/DLC files and creating directories for files 
 
@@ -56,17 +56,76 @@ def get_spike_files(spike_directory):
             raise Exception('Could not find any DLC files in the provided directory.')
     return spike_dict
 
+# frame time files hold one column of frame times (epoch ms), with an optional header line
+# LOF files end in '_LOF.csv', other sessions save the same times under other names (ex. 'session2_E-WBarrier.csv'),
+# so a csv is also taken as a frame time file when its first lines are one column of numbers
+def is_frame_time_file(file_path, num_lines=5):
+    try:
+        with open(file_path) as file:
+            lines = [line.strip() for _, line in zip(range(num_lines), file)]
+    except (OSError, UnicodeDecodeError):
+        return False
+    lines = [line for line in lines if line != '']
+    if len(lines) == 0:
+        return False
+    # the header (if there is one) is the only line that is not a number
+    num_numbers = 0
+    for line_idx, line in enumerate(lines):
+        line = line.rstrip(',')
+        if ',' in line:
+            return False
+        try:
+            float(line)
+            num_numbers += 1
+        except ValueError:
+            if line_idx > 0:
+                return False
+    return num_numbers > 0
+
+# get frame time files named with 'session' followed by session number -> files ending in '_LOF.csv', or other csv files
+# holding frame times (see is_frame_time_file), a session's LOF file is used if it has both
+# sessions without a frame time file are left out -> their timestamps are made from the framerate
+def get_frame_time_files(directory):
+    frame_time_dict = {}
+    # LOF files first
+    for file in sorted(os.listdir(directory), key=lambda file: not file.lower().endswith('_lof.csv')):
+        if (('session' in file) & file.lower().endswith('.csv') & ('DLC' not in file) &
+            (file.lower().endswith('_lof.csv') or is_frame_time_file(os.path.join(directory, file)))):
+            try:
+                session_to_add = f"session{get_session_number(file, 'session')}"
+            except ValueError:
+                continue
+            if session_to_add not in frame_time_dict:
+                frame_time_dict[session_to_add] = file
+    return frame_time_dict
+
+# paths of the spike, DLC and frame time files of every session (used to tell when the inputs of a run change)
+def get_session_file_paths(spike_dir, dlc_dir):
+    spike_files = [os.path.join(spike_dir, file) for file in get_spike_files(spike_dir).values()]
+    dlc_files = [os.path.join(dlc_dir, file) for file in get_dlc_files(dlc_dir).values()]
+    frame_time_files = [os.path.join(dlc_dir, file) for file in get_frame_time_files(dlc_dir).values()]
+    return spike_files + dlc_files + frame_time_files
+
+# True if a copy of a file no longer matches it (different size or modification time)
+def is_copy_outdated(file_path, copy_path):
+    file_stat = os.stat(file_path)
+    copy_stat = os.stat(copy_path)
+    return (file_stat.st_size != copy_stat.st_size) | (file_stat.st_mtime_ns != copy_stat.st_mtime_ns)
+
+# copy files to the destination directory -> a copy is made again when its file changed, so plots are never made from an old
+# copy of a file whose new version is recorded in the manifest of the output folder
+# copies keep the modification time of their file (shutil.copy2), so unchanged files are not copied again
 def move_files(files, destination):
-    if not os.path.exists(destination) & can_create_directory(destination):
-        os.makedirs(os.path.normpath(destination))
+    if (not os.path.exists(destination)) & can_create_directory(destination):
+        os.makedirs(os.path.normpath(destination), exist_ok=True)
 
     try:
         # Move each file to the destination directory
         for file_path in list(set(files)):
             file_name = os.path.basename(file_path)
             destination_path = os.path.normpath(os.path.join(destination, file_name))
-            if not os.path.exists(destination_path):
-                shutil.copy(file_path, destination_path)
+            if (not os.path.exists(destination_path)) or is_copy_outdated(file_path, destination_path):
+                shutil.copy2(file_path, destination_path)
     except IOError:
         print(fr'Could not move files to {destination}.')
         traceback.print_exc()
@@ -74,13 +133,17 @@ def move_files(files, destination):
 
 ####*** create nested array of sessions and files for each session and find number of sessions for timeseries plots***####
 # each array within represents a session, inner arrays contain tracking file and event file dataframes for that session in the sessions_data variable
-# ex. sessions_data = [[session1_dlc, session1_event], [session2_dlc, session2_event], [session3_dlc, session3_event]]
+# and the frame times (ms) from the session's frame time file in the DLC directory (None if the session does not have one)
+# ex. sessions_data = [[session1_dlc, session1_event, session1_frame_times], [session2_dlc, session2_event, None]]
 # return sessions_data and create directory if spike and dlc dir are not the same 
-def combine_files_get_num_sessions(spike_dir, dlc_dir, output_folder):
+# parsed files are cached in the output folder unless use_cache is False
+def combine_files_get_num_sessions(spike_dir, dlc_dir, output_folder, use_cache=True):
     sessions_data= []
+    cache_dir = get_cache_dir(output_folder)
     num_sessions = 0
     spike_dict = get_spike_files(spike_dir)
     dlc_dict = get_dlc_files(dlc_dir)
+    frame_time_dict = get_frame_time_files(dlc_dir)
     if ((spike_dict.keys() != dlc_dict.keys()) | (len(spike_dict) != len(dlc_dict))):
         raise Exception('The spike files and DLC files provided do not include the same dates or session numbers. Please try again with a different directory or renaming files to match the scheme.')
     elif (spike_dict.keys() == dlc_dict.keys()):
@@ -88,16 +151,23 @@ def combine_files_get_num_sessions(spike_dir, dlc_dir, output_folder):
         for session_num in spike_dict.keys():
             dlc_file = os.path.join(dlc_dir, dlc_dict[session_num])
             spike_file = os.path.join(spike_dir, spike_dict[session_num])
+            frame_times = None
+            if session_num in frame_time_dict:
+                frame_times = read_frame_times(os.path.join(dlc_dir, frame_time_dict[session_num]), cache_dir, use_cache)
+            else:
+                print(f'No frame time file found for {session_num}, its frames are timed as frame / framerate.')
             #check if data frames contain data and are not empty
             dlc_empty = os.path.getsize(dlc_file) == 0
             spike_empty = os.path.getsize(spike_file) == 0
             if ((spike_dir == dlc_dir) & ((not dlc_empty) & (not spike_empty))):
-                sessions_data.append([pd.read_csv(dlc_file, header=[1,2]), pd.read_csv(spike_file)])
+                sessions_data.append([read_dlc_file(dlc_file, cache_dir, use_cache), read_spike_file(spike_file, cache_dir, use_cache),
+                                      frame_times])
             elif ((not dlc_empty) & (not spike_empty) & can_create_directory(output_folder)):
                 move_files([dlc_file, spike_file], output_folder)
                 new_dlc_path = os.path.join(output_folder, os.path.basename(dlc_file))
                 new_spike_path = os.path.join(output_folder, os.path.basename(spike_file))
-                sessions_data.append([pd.read_csv(new_dlc_path, header=[1,2]), pd.read_csv(new_spike_path)])
+                sessions_data.append([read_dlc_file(new_dlc_path, cache_dir, use_cache), read_spike_file(new_spike_path, cache_dir, use_cache),
+                                      frame_times])
             elif ((not dlc_empty) & (not spike_empty) & (not can_create_directory(output_folder))):
                 raise Exception(f'The output folder {output_folder} could not be created. Please check that it is a valid file path.')
             elif (dlc_empty):
@@ -21,21 +21,36 @@ def get_cell_num_from_name(cell_name):
         cell_num = int(match.group(1))
         return cell_num
     
+# order files of the same day by the session number in the file name (ex. 'run2' -> 2)
+# files without a session number are ordered by name after the numbered files
+def get_session_sort_key(file_string):
+    match = re.search(r'(?:session|sess|run)_?(\d+)', file_string.lower())
+    if match:
+        return (0, int(match.group(1)), file_string)
+    return (1, 0, file_string)
+
+# session number in a file name (ex. 'session2' -> 2), None if the file name does not have one
+def get_file_session_number(file_string):
+    match = re.search(r'session_?(\d+)', file_string.lower())
+    if match:
+        return int(match.group(1))
+    return None
+
 # check the spike files for all days to find the max cell value using its number
-def find_max_cell_day(day_session_data):
+# day_cell_events is an iterable of one CellEventIndex for each day -> only the unique cell names of a day are checked
+def find_max_cell_day(day_cell_events):
     max = 0
-    for day in day_session_data:
-        cells = day[1][0][' Cell Name']
+    for cell_events in day_cell_events:
         # strip string to get cell number
-        cell_numbers = cells.apply(lambda x: get_cell_num_from_name(x))
+        cell_numbers = [get_cell_num_from_name(cell) for cell in cell_events.cell_names]
         day_max = np.max(cell_numbers)
         if day_max > max:
             max = day_max
     return max
 
     # find the number of digits in the maximum cell value and name all cells according to the number of digits in max 
-def get_cell_names_from_max(day_session_data):
-    max_cell = find_max_cell_day(day_session_data)
+def get_cell_names_from_max(day_cell_events):
+    max_cell = find_max_cell_day(day_cell_events)
     num_digits = len(str(get_cell_num_from_name(' C' + str(max_cell))))
     # use z fill to rename cells 
     cells = [' C' + str(i).zfill(num_digits) for i in range(0, max_cell+1)]    
@@ -0,0 +1,61 @@
+import os
+import json
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# results store for the numbers behind a plotting run -> one file per run saved next to the figures
+# arrays are stored under names like 'session1/ebc_boundary' and metadata (cell names, bin sizes, arena, framerate ...) is saved as json
+# HDF5 (.h5) with chunked, compressed datasets is used when h5py is installed, otherwise a compressed numpy archive (.npz)
+
+RESULTS_FILE_NAME = 'results'
+
+# path of the results file for an output folder -> .h5 if h5py can be imported, else .npz
+def get_results_path(output_folder):
+    extension = '.h5' if h5py is not None else '.npz'
+    return os.path.join(output_folder, RESULTS_FILE_NAME + extension)
+
+# find an existing results file in an output folder (None if there is none)
+def find_results_path(output_folder):
+    for extension in ['.h5', '.npz']:
+        path = os.path.join(output_folder, RESULTS_FILE_NAME + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+# save a dictionary of arrays and a json serializable metadata dictionary
+def save_results(results_path, arrays, metadata):
+    # write to a temporary file first so a crash never leaves a half written results file
+    tmp_path = f'{results_path}.{os.getpid()}.tmp'
+    if results_path.endswith('.h5'):
+        if h5py is None:
+            raise Exception('h5py is needed to save results as HDF5, save them as .npz instead.')
+        with h5py.File(tmp_path, 'w') as results_file:
+            results_file.attrs['metadata'] = json.dumps(metadata)
+            for name, array in arrays.items():
+                array = np.asarray(array)
+                if array.ndim > 0 and array.size > 0:
+                    results_file.create_dataset(name, data=array, chunks=True, compression='gzip', shuffle=True)
+                else:
+                    results_file.create_dataset(name, data=array)
+    else:
+        with open(tmp_path, 'wb') as results_file:
+            np.savez_compressed(results_file, metadata=np.array(json.dumps(metadata)), **arrays)
+    os.replace(tmp_path, results_path)
+
+# load a results file -> returns (dictionary of arrays, metadata dictionary)
+def load_results(results_path):
+    if results_path.endswith('.h5'):
+        if h5py is None:
+            raise Exception(f'h5py is needed to read {results_path}.')
+        arrays = {}
+        with h5py.File(results_path, 'r') as results_file:
+            metadata = json.loads(results_file.attrs['metadata'])
+            results_file.visititems(lambda name, item: arrays.update({name: item[()]}) if isinstance(item, h5py.Dataset) else None)
+        return arrays, metadata
+    with np.load(results_path, allow_pickle=False) as results_file:
+        metadata = json.loads(str(results_file['metadata']))
+        arrays = {name: results_file[name] for name in results_file.files if name != 'metadata'}
+    return arrays, metadata
@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+from src.workutils.file_cache import get_cache_key
+
+# manifest of the figures in an output folder so a rerun only makes the figures whose inputs or plot options changed
+# every figure is recorded with a hash of the input files (path, size and modification time of each file),
+# the plot options (plot types, colours, sizes, barrier coordinates ...) and the cell name
+# a figure is up to date when its hash has not changed and the figure file still exists
+
+MANIFEST_FILE_NAME = 'manifest.json'
+# change when the figures made from the same inputs and options change (ex. a new plot style)
+MANIFEST_VERSION = 1
+
+# hash of a list of input files -> changes when any file is moved, resized or modified
+def get_inputs_hash(file_paths):
+    keys = [get_cache_key(path) for path in sorted(path for path in file_paths if path is not None)]
+    return hashlib.sha1('|'.join(keys).encode('utf-8')).hexdigest()
+
+# hash of plot options -> options must be json serializable (numpy values are converted to strings)
+def get_options_hash(options):
+    options_string = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(options_string.encode('utf-8')).hexdigest()
+
+class RunManifest(object):
+    def __init__(self, output_folder, inputs_hash, options_hash):
+        self.path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+        self.output_folder = output_folder
+        self.run_hash = f'{MANIFEST_VERSION}|{inputs_hash}|{options_hash}'
+        self.figures = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as manifest_file:
+                    self.figures = json.load(manifest_file)
+            except (OSError, ValueError):
+                print(f'Could not read {self.path}, all figures will be made again.')
+
+    def get_figure_hash(self, figure_name):
+        return hashlib.sha1(f'{self.run_hash}|{figure_name}'.encode('utf-8')).hexdigest()
+
+    # figure_name is the file name of the figure in the output folder
+    def is_up_to_date(self, figure_name):
+        figure_path = os.path.join(self.output_folder, figure_name)
+        return (self.figures.get(figure_name) == self.get_figure_hash(figure_name)) & os.path.exists(figure_path)
+
+    # record a figure as made and save the manifest so a stopped run keeps the figures already made
+    def figure_saved(self, figure_name):
+        self.figures[figure_name] = self.get_figure_hash(figure_name)
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(self.figures, manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
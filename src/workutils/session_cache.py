@@ -0,0 +1,26 @@
+from collections import OrderedDict
+
+# bounded in-memory cache of loaded sessions -> keeps at most max_sessions sessions loaded at once
+# load_function is called with the key of a session that is not loaded yet, and the least recently used
+# session is dropped when the cache is full
+class SessionCache(object):
+    def __init__(self, load_function, max_sessions=4):
+        self.load_function = load_function
+        self.max_sessions = max(1, max_sessions)
+        self.sessions = OrderedDict()
+
+    def get(self, key):
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+            return self.sessions[key]
+        session = self.load_function(key)
+        self.sessions[key] = session
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return session
+
+    def clear(self):
+        self.sessions.clear()
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,43 @@
+import os
+import multiprocessing
+import numpy as np
+
+# arrays shared with worker processes -> instead of pickling every array into every worker, the arrays are saved once as
+# .npy files and the workers are sent small SharedArray handles that open the files memory mapped (read only), so the
+# workers read the same pages of the file from the OS cache instead of each holding a copy
+# worker pools are started with the spawn method (WORKER_CONTEXT) on every platform -> plotting runs in a Qt thread pool,
+# and forking a process with running threads can copy locks held by the other threads and hang the workers
+# spawned workers import the modules again, so scripts that start them need an if __name__ == '__main__' guard
+
+WORKER_CONTEXT = multiprocessing.get_context('spawn')
+
+# handle of an array saved by share_arrays
+class SharedArray(object):
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        return np.load(self.path, mmap_mode='r')
+
+# save every array in value (an array, or lists, tuples and dictionaries of them) to a .npy file in folder
+# returns the same structure with SharedArray handles in place of the arrays
+def share_arrays(value, folder, name='array'):
+    if isinstance(value, np.ndarray):
+        path = os.path.join(folder, f'{name}.npy')
+        np.save(path, value)
+        return SharedArray(path)
+    if isinstance(value, dict):
+        return {key: share_arrays(item, folder, f'{name}_{key}') for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(share_arrays(item, folder, f'{name}_{idx}') for idx, item in enumerate(value))
+    return value
+
+# open the arrays of a structure made by share_arrays (in a worker process)
+def load_shared_arrays(value):
+    if isinstance(value, SharedArray):
+        return value.load()
+    if isinstance(value, dict):
+        return {key: load_shared_arrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(load_shared_arrays(item) for item in value)
+    return value
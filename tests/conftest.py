@@ -0,0 +1,4 @@
+import os
+import sys
+# make the src package importable when the tests are run from the repository folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
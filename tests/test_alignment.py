@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from src.plotting.plot_utils import nearest_frame_indices, frame_times_to_timestamps
+from src.plotting.cell_events import CellEventIndex
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'input_data_samples')
+# (frame time file, spike file) of sample sessions recorded with frame times
+SAMPLE_SESSIONS = [('20230728_kombucha/20230728_kombucha_session1_LOF.csv', '20230728_kombucha/20230728_kombucha_timeseries_spikes_run1.csv'),
+                   ('20230728_kombucha/20230728_kombucha_session5_LOF.csv', '20230728_kombucha/20230728_kombucha_timeseries_spikes_run5.csv'),
+                   ('20230608_kombucha/20230608_kombucha_session2_LOF.csv', '20230608_kombucha/20230608_kombucha_timeseries_spikes_run2.csv')]
+
+# frozen copy of the per-event alignment the plots used before nearest_frame_indices -> sets the closest frame to 1
+def old_spike_train(timestamps, cell_event_timestamps):
+    spike_train = np.zeros_like(timestamps)
+    for event_ts in cell_event_timestamps:
+        abs_diffs= abs(timestamps - event_ts)
+        min_idx = np.argmin(abs_diffs, axis=0)
+        spike_train[min_idx] = 1
+    return spike_train
+
+# the same search counting every event on its frame (coincident events are counted since user-001)
+def argmin_counts(timestamps, cell_event_timestamps):
+    spike_train = np.zeros(len(timestamps), dtype=np.int64)
+    for event_ts in cell_event_timestamps:
+        spike_train[np.argmin(abs(timestamps - event_ts))] += 1
+    return spike_train
+
+# uneven frame times like an LOF file -> jitter around 30 Hz with some dropped frames
+def get_uneven_timestamps(num_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    gaps = np.full(num_frames - 1, 1 / 30.) + rng.normal(0, 0.002, size=num_frames - 1)
+    gaps[rng.random(num_frames - 1) < 0.02] *= rng.integers(2, 5)
+    return np.concatenate([[0.], np.cumsum(gaps)])
+
+def test_matches_argmin_on_uneven_frame_times():
+    timestamps = get_uneven_timestamps(2000)
+    rng = np.random.default_rng(1)
+    events = np.concatenate([
+        rng.uniform(-5, timestamps[-1] + 5, size=3000),                 # including events before and after the session
+        (timestamps[:-1] + timestamps[1:]) / 2.,                        # exactly halfway between two frames (ties)
+        timestamps[rng.choice(len(timestamps), size=200)],              # exactly on a frame
+        [timestamps[0] - 100, timestamps[-1] + 100]])
+    expected = np.array([np.argmin(abs(timestamps - event_ts)) for event_ts in events])
+    np.testing.assert_array_equal(nearest_frame_indices(timestamps, events), expected)
+
+@pytest.mark.parametrize('timestamps', [np.array([0.]), np.array([0., 0.5]), np.array([0., 0., 1., 1., 2.])])
+def test_matches_argmin_on_short_and_repeated_frame_times(timestamps):
+    events = np.array([-1., 0., 0.25, 0.5, 0.75, 1., 1.5, 3.])
+    expected = np.array([np.argmin(abs(timestamps - event_ts)) for event_ts in events])
+    np.testing.assert_array_equal(nearest_frame_indices(timestamps, events), expected)
+
+def test_spike_trains_count_coincident_events():
+    timestamps = get_uneven_timestamps(500, seed=2)
+    rng = np.random.default_rng(3)
+    frames = rng.choice(len(timestamps), size=100)
+    # every event is given once or several times, and some are moved off their frame by less than half a frame
+    times = np.repeat(timestamps[frames], rng.integers(1, 4, size=len(frames))) + rng.uniform(-0.01, 0.01, size=1)
+    names = rng.choice([' C000', ' C001', ' C002'], size=len(times))
+    events = CellEventIndex(pd.DataFrame({'Time (s)': times, ' Cell Name': names, ' Value': 1.}))
+    spike_trains = events.spike_trains(timestamps)
+    assert spike_trains.max() > 1
+    for cell_idx, cell in enumerate(events.cell_names):
+        cell_times = times[names == cell]
+        np.testing.assert_array_equal(spike_trains[cell_idx], argmin_counts(timestamps, cell_times))
+        np.testing.assert_array_equal(spike_trains[cell_idx] > 0, old_spike_train(timestamps, cell_times) > 0)
+
+# events of the first cells of a sample session aligned to its LOF frame times
+@pytest.mark.parametrize('frame_file, spike_file', SAMPLE_SESSIONS)
+def test_matches_old_alignment_on_sample_sessions(frame_file, spike_file):
+    frame_path, spike_path = os.path.join(SAMPLES_DIR, frame_file), os.path.join(SAMPLES_DIR, spike_file)
+    if not (os.path.exists(frame_path) and os.path.exists(spike_path)):
+        pytest.skip('sample session not found')
+    frame_times = pd.read_csv(frame_path, header=None).iloc[:, -1].to_numpy(dtype=np.float64)
+    timestamps = frame_times_to_timestamps(frame_times, len(frame_times), 30)
+    spike_data = pd.read_csv(spike_path)
+    cell_names = np.unique(spike_data[' Cell Name'])[:4]
+    events = CellEventIndex(spike_data, cell_names)
+    spike_trains = events.spike_trains(timestamps)
+    for cell_idx, cell in enumerate(cell_names):
+        cell_times = spike_data['Time (s)'][spike_data[' Cell Name'] == cell].to_numpy()
+        np.testing.assert_array_equal(spike_trains[cell_idx], argmin_counts(timestamps, cell_times))
+        np.testing.assert_array_equal(spike_trains[cell_idx] > 0, old_spike_train(timestamps, cell_times) > 0)
@@ -0,0 +1,110 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import zscore
+from src.plotting.plot_utils import calc_positions, interpolate_nondetects
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'input_data_samples')
+
+# frozen copy of the gap filling loop calc_positions used before interpolate_nondetects
+def old_interpolate_nondetects(positions):
+    positions = np.array(positions, dtype=float)
+    for i in range(len(positions)):
+        for j in range(positions.shape[1]):
+            if positions[i][j] == 0:
+                x = 0
+                count = 1
+                while x == 0:
+                    if i+count < len(positions):
+                        if positions[i+count][j] == 0:
+                            count +=1
+                        elif positions[i+count][j] > 0:
+                            if i>0:
+                                positions[i][j] = positions[i-1][j] + (positions[i+count][j] - positions[i-1][j])/count
+                                x=1
+                            else:
+                                positions[i][j] = positions[i+count][j]
+                                x=1
+                    else:
+                        positions[i][j] = positions[i-1][j]
+                        x=1
+    return positions
+
+# frozen copy of calc_positions before interpolate_nondetects (outliers removed one column at a time)
+def old_calc_positions(tracking_data):
+    positions = np.stack([np.where(tracking_data[part, 'likelihood'] < .1, 0, tracking_data[part, axis])
+                          for part, axis in [('Left Ear', 'x'), ('Left Ear', 'y'), ('Right Ear', 'x'), ('Right Ear', 'y')]]).T
+    positions = positions.astype(float)
+    for i in range(4):
+        zscores = np.abs(zscore(positions[:,i]))
+        for j in np.where(zscores>2)[0]:
+            positions[j,i] = 0
+    positions = old_interpolate_nondetects(positions)
+    angles = np.rad2deg(np.arctan2(positions[:,3] - positions[:,1], positions[:,2] - positions[:,0]))
+    angles = -(angles - 360)
+    angles = angles%360
+    head_x = (positions[:,0] + positions[:,2]) / 2.
+    head_y = (positions[:,1] + positions[:,3]) / 2.
+    return head_x, head_y, angles
+
+# DLC tracking of num_frames frames with bursts of nondetects (likelihood < .1), like a mouse moving in a 600 px arena
+def get_tracking_data(num_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    head = np.clip(300 + np.cumsum(rng.normal(0, 2, size=(num_frames, 2)), axis=0), 20, 580)
+    columns = {}
+    for part, offset in [('Left Ear', -8), ('Right Ear', 8)]:
+        likelihood = rng.uniform(0.5, 1, size=num_frames)
+        burst_starts = rng.choice(num_frames, size=max(1, num_frames // 500), replace=False)
+        for start, length in zip(burst_starts, rng.integers(1, 40, size=len(burst_starts))):
+            likelihood[start:start + length] = rng.uniform(0, 0.1)
+        likelihood[rng.random(num_frames) < 0.01] = 0.05
+        columns[(part, 'x')] = head[:, 0] + offset + rng.normal(0, 1, size=num_frames)
+        columns[(part, 'y')] = head[:, 1] + offset + rng.normal(0, 1, size=num_frames)
+        columns[(part, 'likelihood')] = likelihood
+    return pd.DataFrame(columns)
+
+# number of frames of each sample session -> the samples have the frame time files of their sessions but not their DLC files
+def get_sample_session_lengths():
+    frame_files = sorted(glob.glob(os.path.join(SAMPLES_DIR, '20230728_kombucha', '*_session*.csv')))
+    return [sum(1 for _ in open(path)) for path in frame_files]
+
+def assert_same_positions(new, old):
+    for new_values, old_values in zip(new, old):
+        np.testing.assert_allclose(new_values, old_values, rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize('session_idx', range(5))
+def test_matches_old_loop_on_sample_sessions(session_idx):
+    session_lengths = get_sample_session_lengths()
+    if session_idx >= len(session_lengths):
+        pytest.skip('sample session not found')
+    tracking_data = get_tracking_data(session_lengths[session_idx], seed=session_idx)
+    assert_same_positions(calc_positions(tracking_data), old_calc_positions(tracking_data))
+
+@pytest.mark.parametrize('dlc_path', sorted(glob.glob(os.path.join(SAMPLES_DIR, '**', '*DLC*.csv'), recursive=True)))
+def test_matches_old_loop_on_sample_dlc_files(dlc_path):
+    tracking_data = pd.read_csv(dlc_path, header=[1, 2])
+    assert_same_positions(calc_positions(tracking_data), old_calc_positions(tracking_data))
+
+@pytest.mark.parametrize('column', [
+    [0, 0, 0, 5., 6., 7.],                  # leading nondetects
+    [5., 6., 7., 0, 0, 0],                  # trailing nondetects
+    [0, 0, 0, 0],                           # only nondetects
+    [0],                                    # one frame, not detected
+    [3.],                                   # one frame, detected
+    [1., 0, 3., 0, 5., 0, 7.],              # single frame gaps
+    [1., 0, 0, 0, 9., 0, 0, 3.],            # gaps of different lengths
+    [0, 2., 0, 0, 8., 0],                   # leading, interior and trailing gaps together
+    [4., 4., 0, 4., 0, 0, 0, 10.],
+])
+def test_matches_old_loop_on_edge_cases(column):
+    positions = np.array(column, dtype=float)[:, np.newaxis]
+    np.testing.assert_allclose(interpolate_nondetects(positions), old_interpolate_nondetects(positions), rtol=0, atol=1e-12)
+
+def test_matches_old_loop_on_random_gaps():
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        positions = rng.uniform(1, 600, size=(rng.integers(1, 60), 4))
+        positions[rng.random(positions.shape) < rng.uniform(0, 0.9)] = 0
+        np.testing.assert_allclose(interpolate_nondetects(positions), old_interpolate_nondetects(positions), rtol=0, atol=1e-9)
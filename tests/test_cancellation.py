@@ -0,0 +1,74 @@
+import json
+import os
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pytest
+from src.workutils.cancellation import CancellationToken, PlotCancelled
+from src.workutils.figure_output import FigureOutput, MULTIPAGE_PDF_NAME
+from src.workutils.run_manifest import RunManifest, MANIFEST_FILE_NAME
+from src.workutils.PlotEmitterSignals import EmittedPlotSignals
+from tests.test_figure_memory import get_timeseries_plots, PLOTS, PLOT_KWARGS, NUM_CELLS
+
+NUM_CELLS_BEFORE_CANCEL = 3
+
+# TimeSeriesPlots whose cancel token is cancelled once num_cells cells are plotted (between two cells)
+def get_cancelled_plots(figure_output, num_cells):
+    plots = get_timeseries_plots()
+    plots.figure_output = figure_output
+    plots.signals = EmittedPlotSignals()
+    cancel_token = CancellationToken()
+    plotted_cells = []
+    def cell_plotted(cell):
+        plotted_cells.append(cell)
+        if len(plotted_cells) == num_cells:
+            cancel_token.cancel()
+    plots.signals.cell_plotted.connect(cell_plotted)
+    return plots, cancel_token, plotted_cells
+
+def read_manifest(output_folder):
+    with open(os.path.join(output_folder, MANIFEST_FILE_NAME)) as manifest_file:
+        return json.load(manifest_file)
+
+# render the cells the manifest of output_folder does not have up to date, like prepare_figures / render_prepared_figures
+def render_outdated_cells(plots, output_folder, cancel_token=None):
+    manifest = RunManifest(output_folder, 'inputs', 'options')
+    cells_to_plot = plots.get_cells_to_plot(manifest, plots.cell_names)
+    plots.render_figures(output_folder, *PLOTS, cell_indices=cells_to_plot, manifest=manifest, cancel_token=cancel_token,
+                         **PLOT_KWARGS)
+    return cells_to_plot
+
+@pytest.mark.parametrize('background_writes', [False, True])
+def test_cancel_between_cells_keeps_only_written_figures(tmp_path, background_writes):
+    plt.close('all')
+    output_folder = str(tmp_path)
+    plots, cancel_token, plotted_cells = get_cancelled_plots(FigureOutput(dpi=40, background_writes=background_writes),
+                                                             NUM_CELLS_BEFORE_CANCEL)
+    with pytest.raises(PlotCancelled):
+        render_outdated_cells(plots, output_folder, cancel_token)
+    # rendering stopped before the next cell, and every figure drawn before it was written and recorded
+    written_figures = [f'C{cell:03d}.png' for cell in range(NUM_CELLS_BEFORE_CANCEL)]
+    assert [cell.lstrip() for cell in plotted_cells] == [figure.replace('.png', '') for figure in written_figures]
+    assert sorted(read_manifest(output_folder)) == written_figures
+    assert sorted(file for file in os.listdir(output_folder) if file.endswith('.png')) == written_figures
+    assert len(plt.get_fignums()) == 0
+
+    # a rerun only renders the cells the cancelled run did not get to
+    plots.signals = EmittedPlotSignals()
+    rendered_cells = render_outdated_cells(plots, output_folder)
+    assert rendered_cells == list(range(NUM_CELLS_BEFORE_CANCEL, NUM_CELLS))
+    assert sorted(read_manifest(output_folder)) == [f'C{cell:03d}.png' for cell in range(NUM_CELLS)]
+    assert render_outdated_cells(plots, output_folder) == []
+
+# a cancelled multi-page pdf is thrown away -> the manifest does not record it, so a rerun makes every page again
+def test_cancelled_multipage_pdf_is_not_recorded(tmp_path):
+    plt.close('all')
+    output_folder = str(tmp_path)
+    plots, cancel_token, _ = get_cancelled_plots(FigureOutput('pdf', dpi=40, multipage_pdf=True), NUM_CELLS_BEFORE_CANCEL)
+    with pytest.raises(PlotCancelled):
+        render_outdated_cells(plots, output_folder, cancel_token)
+    assert (not os.path.exists(os.path.join(output_folder, MANIFEST_FILE_NAME))) or (read_manifest(output_folder) == {})
+    assert [file for file in os.listdir(output_folder) if file != MANIFEST_FILE_NAME] == []
+    plots.signals = EmittedPlotSignals()
+    assert render_outdated_cells(plots, output_folder) == list(range(NUM_CELLS))
+    assert MULTIPAGE_PDF_NAME in read_manifest(output_folder)
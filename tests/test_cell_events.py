@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+from src.plotting.cell_events import CellEventIndex
+
+# spike file with events of three cells, one of them not in the cells asked for
+def get_spike_data(seed=0):
+    rng = np.random.default_rng(seed)
+    names = rng.choice([' C000', ' C001', ' C003'], size=500)
+    return pd.DataFrame({'Time (s)': rng.uniform(0, 100, size=500), ' Cell Name': names, ' Value': 1.})
+
+def test_sparse_spike_trains_match_dense():
+    events = CellEventIndex(get_spike_data())
+    timestamps = np.arange(0, 100, 1 / 30.)
+    cell_names = [' C000', ' C001', ' C002']
+    sparse = events.sparse_spike_trains(timestamps, cell_names)
+    dense = np.zeros((len(cell_names), len(timestamps)), dtype=np.uint16)
+    for row, cell in enumerate(cell_names):
+        if cell in events.cell_names:
+            dense[row] = events.spike_train(events.cell_idx(cell), timestamps)
+    assert sparse.shape == dense.shape
+    np.testing.assert_array_equal(sparse.toarray(), dense)
+    np.testing.assert_array_equal(sparse.tocsr().toarray(), dense)
+    np.testing.assert_array_equal(np.stack([sparse[row] for row in range(len(sparse))]), dense)
+    np.testing.assert_array_equal(sparse.event_counts(), dense.sum(axis=1))
+    np.testing.assert_array_equal(events.spike_trains(timestamps, cell_names), dense)
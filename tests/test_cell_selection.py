@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from src.plotting.cell_selection import CellSelection
+from src.plotting.tuning_metrics import get_metrics_table
+
+# cell names are read from the spike files with a leading space
+CELL_NAMES = np.array([' C000', ' C001', ' C002', ' C003'])
+# sessions x cells
+EVENT_COUNTS = np.array([[30, 5, 0, 12],
+                         [25, 40, 0, 8]])
+DURATIONS = [100., 50.]
+
+def get_metrics(values, p_values):
+    return {'spatial_information': np.array(values, dtype=float),
+            'spatial_information_p_value': np.array(p_values, dtype=float)}
+
+def get_table():
+    return get_metrics_table(CELL_NAMES, [get_metrics([0.8, 0.1, np.nan, 0.6], [0.001, 0.5, np.nan, 0.02]),
+                                          get_metrics([0.9, 0.7, np.nan, 0.2], [0.002, 0.005, np.nan, 0.3])])
+
+def test_select_by_events_in_any_or_every_session():
+    np.testing.assert_array_equal(CellSelection(min_events=10).select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS),
+                                  [True, True, False, True])
+    np.testing.assert_array_equal(CellSelection(min_events=10, all_sessions=True).select_by_events(CELL_NAMES, EVENT_COUNTS,
+                                                                                                    DURATIONS),
+                                  [True, False, False, False])
+    # rates are 0.3, 0.05, 0, 0.12 events / s in session 1 and 0.5, 0.8, 0, 0.16 in session 2
+    np.testing.assert_array_equal(CellSelection(min_rate=0.15).select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS),
+                                  [True, True, False, True])
+    np.testing.assert_array_equal(CellSelection(min_rate=0.15, all_sessions=True).select_by_events(CELL_NAMES, EVENT_COUNTS,
+                                                                                                    DURATIONS),
+                                  [True, False, False, False])
+    np.testing.assert_array_equal(CellSelection().select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS), [True] * 4)
+
+def test_select_by_metric_threshold_and_p_values():
+    table = get_table()
+    np.testing.assert_array_equal(CellSelection(metric='spatial_information', metric_threshold=0.5).select_by_metric(CELL_NAMES, table),
+                                  [True, True, False, True])
+    np.testing.assert_array_equal(CellSelection(metric='spatial_information', metric_threshold=0.5,
+                                                all_sessions=True).select_by_metric(CELL_NAMES, table),
+                                  [True, False, False, False])
+    # p values pass at or below the threshold, cells without a value (nan) never pass
+    selection = CellSelection(metric='spatial_information_p_value', metric_threshold=0.01, metric_shuffles=200)
+    assert selection.uses_metric() & (selection.get_metric_shuffles() == 200)
+    np.testing.assert_array_equal(selection.select_by_metric(CELL_NAMES, table), [True, True, False, False])
+    # cells are looked up by name, not by their order in the table
+    np.testing.assert_array_equal(selection.select_by_metric(CELL_NAMES[::-1], table), [False, False, True, True])
+    assert CellSelection(metric='spatial_information', metric_threshold=0.5).get_metric_shuffles() == 0
+
+@pytest.mark.parametrize('cells', [['C000', 'C003'], [' C000', ' C003'], ['C000 ', '  C003']])
+def test_cell_list_ignores_spaces_around_names(cells):
+    selection = CellSelection(cells)
+    np.testing.assert_array_equal(selection.select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS), [True, False, False, True])
+    # the same names without the leading space (ex. lstripped figure names) select the same cells
+    np.testing.assert_array_equal(selection.select_by_events(np.char.lstrip(CELL_NAMES), EVENT_COUNTS, DURATIONS),
+                                  [True, False, False, True])
+    assert selection.get_options()['cells'] == ['C000', 'C003']
+
+def test_cell_list_combines_with_other_filters():
+    selection = CellSelection([' C001', 'C002'], min_events=10, all_sessions=True)
+    np.testing.assert_array_equal(selection.select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS), [False] * 4)
+
+def test_selection_matching_no_cells():
+    for selection in [CellSelection(['C999']), CellSelection(min_events=1000), CellSelection(min_rate=10.)]:
+        selected = selection.select_by_events(CELL_NAMES, EVENT_COUNTS, DURATIONS)
+        assert selected.dtype == bool
+        assert len(CELL_NAMES[selected]) == 0
+    selected = CellSelection(metric='spatial_information', metric_threshold=5.).select_by_metric(CELL_NAMES, get_table())
+    assert not selected.any()
+    # cells missing from the table (ex. not in the spike file of a session) do not pass
+    selected = CellSelection(metric='spatial_information', metric_threshold=0.).select_by_metric(np.array([' C999']), get_table())
+    np.testing.assert_array_equal(selected, [False])
+
+def test_invalid_selections():
+    with pytest.raises(ValueError):
+        CellSelection(metric='not_a_metric', metric_threshold=1.)
+    with pytest.raises(ValueError):
+        CellSelection(metric='spatial_information')
+    with pytest.raises(ValueError):
+        CellSelection(min_events=-1)
@@ -0,0 +1,123 @@
+import threading
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+try:
+    import resource
+except ImportError:
+    resource = None
+from src.plotting.timeseries_plot import TimeSeriesPlots
+from src.plotting.longitudinal_plot import LongitudinalPlot
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.ratemaps import compute_ratemaps, smooth_plot_ratemaps
+from src.plotting.subplot import Subplot
+from src.workutils.figure_output import FigureOutput
+from src.workutils.PlotEmitterSignals import EmittedPlotSignals
+
+FRAMERATE = 30
+ARENA = [60, 60]
+NUM_CELLS = 24
+PLOTS = ['spike_plot', 'heatmap', 'hd_curve', 'ebc_boundary']
+PLOT_KWARGS = {'spike_line_color': '#000000', 'spike_size': 5, 'line_size': 1, 'hd_line_color': '#FF0000'}
+# growth of the peak RSS allowed while plotting every cell once the first cells are plotted
+# (leaking a figure per subplot grew it by ~110 MB over these cells)
+MAX_RSS_GROWTH_MB = 60
+
+# DLC tracking of a mouse moving around the arena
+def get_tracking_data(num_frames, seed):
+    rng = np.random.default_rng(seed)
+    head = np.clip(300 + np.cumsum(rng.normal(0, 5, size=(num_frames, 2)), axis=0), 20, 580)
+    columns = {}
+    for part, offset in [('Left Ear', -8), ('Right Ear', 8)]:
+        columns[(part, 'x')] = head[:, 0] + offset
+        columns[(part, 'y')] = head[:, 1] + offset
+        columns[(part, 'likelihood')] = np.ones(num_frames)
+    return pd.DataFrame(columns)
+
+# TimeSeriesPlots of two sessions with the spike trains, trajectories and ratemaps prepare_sessions makes for render_figures
+def get_timeseries_plots(num_frames=3000):
+    plots = TimeSeriesPlots.__new__(TimeSeriesPlots)
+    plots.framerate = FRAMERATE
+    plots.num_sessions = 2
+    plots.cell_names = np.array([f' C{cell:03d}' for cell in range(NUM_CELLS)])
+    plots.splt = Subplot(FRAMERATE, ARENA)
+    plots.figure_template = None
+    plots.figure_output = FigureOutput(dpi=40, background_writes=False)
+    plots.session_spike_trains = []
+    plots.session_trajectories = []
+    plots.session_ratemaps = []
+    rng = np.random.default_rng(0)
+    for session_idx in range(plots.num_sessions):
+        geometry = SessionGeometry(get_tracking_data(num_frames, session_idx), np.arange(num_frames) / FRAMERATE, FRAMERATE, ARENA)
+        spike_trains = (rng.random((NUM_CELLS, num_frames)) < 0.02).astype(np.uint16)
+        plots.session_spike_trains.append(spike_trains)
+        plots.session_trajectories.append((geometry.head_x, geometry.head_y, geometry.angles))
+        plots.session_ratemaps.append({arg: smooth_plot_ratemaps(compute_ratemaps(geometry, spike_trains, kind=arg), arg)
+                                       for arg in PLOTS if arg != 'spike_plot'})
+    return plots
+
+# peak resident memory of the process in MB
+def get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / 1024. if peak_rss < 2**32 else peak_rss / 1024.**2
+
+@pytest.mark.parametrize('reuse_figure', [False, True])
+def test_plot_cell_does_not_leak_figures(tmp_path, reuse_figure):
+    plt.close('all')
+    plots = get_timeseries_plots()
+    # the first cells load fonts and fill the caches of matplotlib
+    for cell_idx in range(4):
+        figure = plots.plot_cell(cell_idx, str(tmp_path), *PLOTS, reuse_figure=reuse_figure, **PLOT_KWARGS)
+        if not reuse_figure:
+            plt.close(figure)
+    num_figures = len(plt.get_fignums())
+    start_rss = get_peak_rss_mb() if resource is not None else None
+    for cell_idx in range(4, NUM_CELLS):
+        figure = plots.plot_cell(cell_idx, str(tmp_path), *PLOTS, reuse_figure=reuse_figure, **PLOT_KWARGS)
+        if not reuse_figure:
+            plt.close(figure)
+        assert len(plt.get_fignums()) == num_figures
+    if start_rss is not None:
+        assert get_peak_rss_mb() - start_rss < MAX_RSS_GROWTH_MB
+    assert len(list(tmp_path.glob('*.png'))) == NUM_CELLS
+    plt.close('all')
+
+def test_render_figures_closes_every_figure(tmp_path):
+    plt.close('all')
+    plots = get_timeseries_plots()
+    plots.signals = EmittedPlotSignals()
+    for reuse_figure in [False, True]:
+        plots.render_figures(str(tmp_path), *PLOTS, reuse_figure=reuse_figure, **PLOT_KWARGS)
+        assert plt.get_fignums() == []
+
+# a figure failing part way through the longitudinal plots stops the background writer and closes the figure it was drawing
+def test_LR_plots_stop_figure_writer_when_a_figure_fails(tmp_path):
+    plt.close('all')
+    geometries = [SessionGeometry(get_tracking_data(1000, day_idx), np.arange(1000) / FRAMERATE, FRAMERATE, ARENA)
+                  for day_idx in range(2)]
+    spike_trains = [np.ones((2, 1000), dtype=np.uint16) for _ in range(2)]
+    ratemaps = [compute_ratemaps(geometry, spike_train, kind='heatmap') for geometry, spike_train in zip(geometries, spike_trains)]
+    # the heatmap of the second cell cannot be drawn
+    ratemaps = [[day_ratemaps[0], np.zeros(5)] for day_ratemaps in ratemaps]
+    plots = LongitudinalPlot.__new__(LongitudinalPlot)
+    plots.output_folder_path = str(tmp_path)
+    plots.max_row_num = 1
+    plots.num_days = 2
+    plots.sessions_in_each_day = [1, 1]
+    plots.cell_names = [' C000', ' C001']
+    plots.splt = Subplot(FRAMERATE, ARENA)
+    plots.signals = EmittedPlotSignals()
+    plots.prepare_sessions = lambda plot_type_arg: ([[day] for day in spike_trains], [[day] for day in geometries],
+                                                    [[day] for day in ratemaps])
+    num_threads = threading.active_count()
+    with pytest.raises(TypeError):
+        plots.get_LR_plots_all_days_have_cell('figs', 'heatmap', FigureOutput(dpi=40))
+    assert threading.active_count() == num_threads
+    assert plots.figure_output.writer is None
+    assert plt.get_fignums() == []
+    # the figure of the first cell was queued before the failure and is still written
+    assert [path.name for path in (tmp_path / 'figs').glob('*.png')] == [' C000.png']
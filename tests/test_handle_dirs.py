@@ -0,0 +1,65 @@
+import os
+from src.workutils.handle_dirs import is_frame_time_file, get_frame_time_files, move_files
+from src.plotting.longitudinal_plot import LongitudinalPlot
+
+FRAME_TIMES = '1690562948345.3481\n1690562948378.7021\n1690562948412.0562\n'
+
+def write_files(folder, files):
+    for name, content in files.items():
+        with open(os.path.join(folder, name), 'w') as file:
+            file.write(content)
+
+def test_is_frame_time_file(tmp_path):
+    write_files(tmp_path, {'times.csv': FRAME_TIMES, 'header.csv': 'Frame time\n' + FRAME_TIMES,
+                           'spikes.csv': 'Time (s), Cell Name, Value\n3.66, C000, 6.1\n', 'barrier.csv': '10,30\n50,30\n',
+                           'notes.csv': 'session notes\nbarrier moved\n', 'empty.csv': ''})
+    assert is_frame_time_file(str(tmp_path / 'times.csv'))
+    assert is_frame_time_file(str(tmp_path / 'header.csv'))
+    for name in ['spikes.csv', 'barrier.csv', 'notes.csv', 'empty.csv', 'missing.csv']:
+        assert not is_frame_time_file(str(tmp_path / name))
+
+# frame times saved under other names (ex. barrier sessions) are found by their content, LOF files are used first
+def test_frame_time_files_found_by_content(tmp_path):
+    write_files(tmp_path, {'20230728_session1_LOF.csv': FRAME_TIMES, '20230728_session2_E-WBarrier.csv': FRAME_TIMES,
+                           '20230728_session3_N-SBarrier_2.csv': FRAME_TIMES, '20230728_session3_LOF.csv': FRAME_TIMES,
+                           '20230728_session4_notes.csv': 'barrier moved\nat 10 min\n',
+                           '20230728_session1DLC_resnet50.csv': 'scorer,DLC\nbodyparts,Left Ear\n1,2\n'})
+    assert get_frame_time_files(str(tmp_path)) == {'session1': '20230728_session1_LOF.csv',
+                                                   'session2': '20230728_session2_E-WBarrier.csv',
+                                                   'session3': '20230728_session3_LOF.csv'}
+
+def test_longitudinal_frame_time_files_found_by_content(tmp_path, capsys):
+    write_files(tmp_path, {'20230728_session1DLC_resnet50.csv': '', '20230728_session2DLC_resnet50.csv': '',
+                           '20230728_session3DLC_resnet50.csv': '',
+                           'day1_longitudinal_spikes_session1.csv': '', 'day1_longitudinal_spikes_session2.csv': '',
+                           'day1_longitudinal_spikes_session3.csv': '',
+                           '20230728_session1_LOF.csv': FRAME_TIMES, '20230728_session2_E-WBarrier.csv': FRAME_TIMES})
+    plots = LongitudinalPlot.__new__(LongitudinalPlot)
+    plots.spike_dir = plots.dlc_dir = str(tmp_path)
+    day_sessions = plots.get_files()
+    frame_time_files = [session['frame_time_file'] for session in day_sessions[0]]
+    assert frame_time_files == [str(tmp_path / '20230728_session1_LOF.csv'), str(tmp_path / '20230728_session2_E-WBarrier.csv'), None]
+    # sessions timed from the framerate are reported
+    assert 'No frame time file found for 20230728_session3DLC_resnet50.csv' in capsys.readouterr().out
+
+# copies in the output folder are made again when their file changes, and only then
+def test_move_files_refreshes_changed_copies(tmp_path):
+    source_dir, output_dir = tmp_path / 'spikes', tmp_path / 'output'
+    source_dir.mkdir()
+    source = source_dir / 'spikes_run1.csv'
+    source.write_text('Time (s), Cell Name, Value\n1.0, C000, 1\n2.0, C001, 1\n')
+    move_files([str(source)], str(output_dir))
+    copy = output_dir / 'spikes_run1.csv'
+    assert copy.read_text() == source.read_text()
+    copy_mtime = copy.stat().st_mtime_ns
+    move_files([str(source)], str(output_dir))
+    assert copy.stat().st_mtime_ns == copy_mtime
+    # every C000 event is removed
+    source.write_text('Time (s), Cell Name, Value\n2.0, C001, 1\n')
+    move_files([str(source)], str(output_dir))
+    assert copy.read_text() == source.read_text()
+    # same size, newer file
+    source.write_text('Time (s), Cell Name, Value\n3.0, C001, 1\n')
+    os.utime(source, ns=(copy.stat().st_atime_ns, copy.stat().st_mtime_ns + 10**9))
+    move_files([str(source)], str(output_dir))
+    assert copy.read_text() == source.read_text()
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.ratemaps import compute_ratemaps, get_occupancy
+from src.plotting.cell_events import SparseSpikeTrains
+from tests.test_figure_memory import get_tracking_data
+
+# ratemaps from the sparse product match the spike counts of a dense float product, for dense and sparse spike trains
+@pytest.mark.parametrize('kind', ['ebc_boundary', 'heatmap', 'hd_curve'])
+def test_ratemaps_of_dense_and_sparse_spike_trains(kind):
+    num_frames = 3000
+    geometry = SessionGeometry(get_tracking_data(num_frames, 0), np.arange(num_frames) / 30., 30, [60, 60])
+    rng = np.random.default_rng(1)
+    spike_trains = SparseSpikeTrains(rng.integers(0, 12, size=2000), rng.integers(0, num_frames, size=2000), 12, num_frames)
+    dense = spike_trains.toarray()
+    assert dense.max() > 1
+    occupancy = get_occupancy(geometry, kind)
+    spike_counts = np.asarray(occupancy.occupancy_matrix(len(geometry)) @ dense[:, :len(geometry)].astype(float).T).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = spike_counts.reshape((len(dense),) + occupancy.shape) / occupancy.occ
+        for value in [dense, sparse.csr_matrix(dense), spike_trains]:
+            np.testing.assert_array_equal(compute_ratemaps(geometry, value, kind=kind), expected)
+        np.testing.assert_array_equal(compute_ratemaps(geometry, spike_trains, cells=[3, 0], kind=kind), expected[[3, 0]])
@@ -0,0 +1,41 @@
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from src.workutils.shared_arrays import share_arrays, load_shared_arrays, SharedArray
+from src.workutils.PlotEmitterSignals import EmittedPlotSignals
+from tests.test_figure_memory import get_timeseries_plots, PLOTS, PLOT_KWARGS
+
+def test_shared_arrays_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    value = {'spike_trains': [rng.integers(0, 3, size=(4, 50)).astype(np.uint16)],
+             'trajectories': [(rng.random(50), rng.random(50), rng.random(50))],
+             'ratemaps': [{'heatmap': rng.random((4, 20, 20))}], 'name': 'session'}
+    shared = share_arrays(value, str(tmp_path))
+    assert isinstance(shared['spike_trains'][0], SharedArray)
+    assert isinstance(shared['trajectories'][0], tuple)
+    loaded = load_shared_arrays(shared)
+    assert loaded['name'] == 'session'
+    assert isinstance(loaded['spike_trains'][0], np.memmap)
+    np.testing.assert_array_equal(loaded['spike_trains'][0], value['spike_trains'][0])
+    for loaded_values, values in zip(loaded['trajectories'][0], value['trajectories'][0]):
+        np.testing.assert_array_equal(loaded_values, values)
+    np.testing.assert_array_equal(loaded['ratemaps'][0]['heatmap'], value['ratemaps'][0]['heatmap'])
+
+# figures rendered by worker processes reading the memory mapped arrays are the same as figures rendered in one process
+def test_render_figures_in_workers_matches_one_process(tmp_path):
+    plots = get_timeseries_plots()
+    plots.cell_names = plots.cell_names[:4]
+    plots.signals = EmittedPlotSignals()
+    one_process_dir = tmp_path / 'one_process'
+    workers_dir = tmp_path / 'workers'
+    one_process_dir.mkdir()
+    workers_dir.mkdir()
+    plots.render_figures(str(one_process_dir), *PLOTS, **PLOT_KWARGS)
+    plots.render_figures(str(workers_dir), *PLOTS, num_workers=2, **PLOT_KWARGS)
+    assert plt.get_fignums() == []
+    figure_names = sorted(path.name for path in one_process_dir.glob('*.png'))
+    assert figure_names == sorted(path.name for path in workers_dir.glob('*.png'))
+    assert len(figure_names) == 4
+    for name in figure_names:
+        assert (one_process_dir / name).read_bytes() == (workers_dir / name).read_bytes()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.ratemaps import get_occupancy, smooth_plot_ratemaps, EBC_SMOOTHING_STDDEV, HEATMAP_SMOOTHING_STDDEV
+from src.plotting.smoothing import smooth_ratemaps
+from src.plotting.shuffles import get_shuffle_shifts, get_smoothing_matrix, get_shuffled_scores, get_tuning_scores
+from tests.test_figure_memory import get_tracking_data
+
+NUM_FRAMES = 2000
+
+def get_geometry():
+    return SessionGeometry(get_tracking_data(NUM_FRAMES, 0), np.arange(NUM_FRAMES) / 30., 30, [60, 60])
+
+# spike trains with some frames holding more than one event
+def get_spike_trains(num_cells, num_frames, seed):
+    rng = np.random.default_rng(seed)
+    return (rng.random((num_cells, num_frames)) < 0.02) * rng.integers(1, 3, size=(num_cells, num_frames))
+
+@pytest.mark.parametrize('kind', ['ebc_boundary', 'heatmap', 'hd_curve'])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_shifted_spike_counts_match_rolled_spike_trains(kind, seed):
+    geometry = get_geometry()
+    occupancy = get_occupancy(geometry, kind)
+    spike_train = get_spike_trains(1, len(geometry), seed)[0]
+    shifts = get_shuffle_shifts(len(geometry), 20, 5 * 30, seed)
+    spike_counts = occupancy.shifted_spike_counts(spike_train, shifts)
+    for shift, counts in zip(shifts, spike_counts):
+        np.testing.assert_allclose(counts, occupancy.spike_counts(np.roll(spike_train, shift)), rtol=0, atol=1e-9)
+
+# scores of the shuffles are the scores of the ratemaps of the rolled spike trains, smoothed the way they are plotted
+@pytest.mark.parametrize('kind', ['ebc_boundary', 'heatmap', 'hd_curve'])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_shuffled_scores_match_rolled_ratemaps(kind, seed):
+    geometry = get_geometry()
+    occupancy = get_occupancy(geometry, kind)
+    spike_trains = get_spike_trains(3, len(geometry), seed)
+    shifts = get_shuffle_shifts(len(geometry), 10, 5 * 30, seed)
+    smoothing_matrix = None if kind == 'hd_curve' else get_smoothing_matrix(occupancy, kind)
+    scores = get_shuffled_scores(occupancy, spike_trains, shifts, kind, smoothing_matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for row, spike_train in enumerate(spike_trains):
+            ratemaps = np.stack([occupancy.ratemap(np.roll(spike_train, shift)) for shift in np.concatenate([[0], shifts])])
+            expected = get_tuning_scores(ratemaps, occupancy, kind, smooth=True)
+            np.testing.assert_allclose(scores[row], expected, rtol=1e-9, atol=1e-12)
+
+# the smoothing matrix of a session smooths a ratemap the same way smooth_ratemaps does
+@pytest.mark.parametrize('kind,stddev,circular', [('ebc_boundary', EBC_SMOOTHING_STDDEV, True),
+                                                  ('heatmap', HEATMAP_SMOOTHING_STDDEV, False)])
+def test_smoothing_matrix_matches_smooth_ratemaps(kind, stddev, circular):
+    geometry = get_geometry()
+    occupancy = get_occupancy(geometry, kind)
+    assert (occupancy.occ == 0).any()
+    smoothing_matrix = get_smoothing_matrix(occupancy, kind)
+    for spike_train in get_spike_trains(4, len(geometry), 5):
+        spike_counts = occupancy.spike_counts(spike_train)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            expected = smooth_ratemaps(spike_counts / occupancy.occ, stddev, circular=circular)
+        smoothed = (spike_counts.ravel() @ smoothing_matrix).reshape(occupancy.shape)
+        np.testing.assert_allclose(smoothed, expected, rtol=1e-9, atol=1e-12)
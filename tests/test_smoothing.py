@@ -0,0 +1,60 @@
+import warnings
+import numpy as np
+import pytest
+from src.plotting.smoothing import smooth_ratemaps
+
+convolution = pytest.importorskip('astropy.convolution')
+
+# smoothing with astropy, the way the ratemaps were smoothed before smooth_ratemaps
+def astropy_smooth(ratemap, stddev):
+    # astropy warns when nan regions are wider than the kernel, which is what is tested here
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return convolution.convolve(ratemap, convolution.Gaussian2DKernel(x_stddev=stddev, y_stddev=stddev))
+
+# EBC ratemaps were tiled three times along bearing, smoothed and cropped back to the middle copy
+def astropy_smooth_circular(ratemap, stddev):
+    tiled = astropy_smooth(np.concatenate((ratemap, ratemap, ratemap), axis=0), stddev)
+    return tiled[len(ratemap):len(ratemap) * 2]
+
+# ratemap of values from 0 to 1 with a block of nan bins and scattered nan bins
+def get_ratemap(shape, hole, seed=0):
+    rng = np.random.default_rng(seed)
+    ratemap = rng.random(shape)
+    ratemap[rng.random(shape) < 0.1] = np.nan
+    ratemap[hole] = np.nan
+    return ratemap
+
+def assert_same_smoothing(smoothed, expected):
+    np.testing.assert_array_equal(np.isnan(smoothed), np.isnan(expected))
+    np.testing.assert_allclose(smoothed, expected, rtol=0, atol=1e-9, equal_nan=True)
+
+@pytest.mark.parametrize('stddev', [1, 2])
+@pytest.mark.parametrize('shape, hole', [
+    ((40, 40), (slice(5, 35), slice(5, 35))),      # nan block much wider than the kernel
+    ((50, 30), (slice(0, 50), slice(10, 25))),     # nan band through the whole ratemap
+    ((40, 40), (slice(0, 20), slice(0, 20))),      # nan block at a corner
+    ((20, 20), (slice(0, 20), slice(0, 20))),      # only nan bins
+])
+def test_matches_astropy_with_large_nan_holes(stddev, shape, hole):
+    ratemap = get_ratemap(shape, hole)
+    assert_same_smoothing(smooth_ratemaps(ratemap, stddev), astropy_smooth(ratemap, stddev))
+
+@pytest.mark.parametrize('stddev', [1, 2])
+def test_matches_astropy_circular(stddev):
+    # bearing x distance ratemap with a hole wider than the kernel, like an EBC ratemap far from any wall
+    ratemap = get_ratemap((120, 16), (slice(30, 90), slice(0, 16)), seed=1)
+    assert_same_smoothing(smooth_ratemaps(ratemap, stddev, circular=True), astropy_smooth_circular(ratemap, stddev))
+
+def test_stack_matches_each_ratemap():
+    ratemaps = np.stack([get_ratemap((30, 30), (slice(5, 25), slice(5, 25)), seed=seed) for seed in range(4)])
+    smoothed = smooth_ratemaps(ratemaps, 2)
+    for ratemap, smoothed_ratemap in zip(ratemaps, smoothed):
+        assert_same_smoothing(smoothed_ratemap, astropy_smooth(ratemap, 2))
+
+def test_non_negative_ratemaps_stay_non_negative():
+    ratemap = np.zeros((40, 40))
+    ratemap[20, 20] = 1.
+    ratemap[:, :15] = np.nan
+    smoothed = smooth_ratemaps(ratemap, 2)
+    assert np.nanmin(smoothed) >= 0
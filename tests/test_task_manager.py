@@ -0,0 +1,164 @@
+import pytest
+from src.workutils.TaskManager import TaskManager, TaskResult, FIGURE_RESOURCE
+from src.workutils.cancellation import CancellationToken, check_cancelled
+
+# thread pool that only keeps the workers it is given -> tests run them one at a time with run_next, so no Qt event loop or
+# threads are needed and the tasks that would be running together can be checked
+class ManualThreadPool(object):
+    def __init__(self):
+        self.started = []
+
+    def start(self, worker):
+        self.started.append(worker)
+
+# task manager with a ManualThreadPool, and the state of every task recorded as it finishes (tasks are cleared once all
+# of them are done)
+def get_task_manager(max_concurrent_tasks=2):
+    manager = TaskManager(max_concurrent_tasks=max_concurrent_tasks)
+    manager.thread_pool = ManualThreadPool()
+    manager.finished_states = {}
+    manager.completed = []
+    manager.task_finished.connect(lambda task_id: manager.finished_states.setdefault(task_id, manager.tasks[task_id]['state']))
+    manager.tasks_completed.connect(lambda: manager.completed.append(True))
+    return manager
+
+# run the worker the manager started first (or the one of task_id) and hand it back the way its finished signal would
+def run_next(manager, task_id=None):
+    workers = {running_id: worker for running_id, worker in manager.running_workers.values()}
+    worker = manager.thread_pool.started[0] if task_id is None else workers[task_id]
+    manager.thread_pool.started.remove(worker)
+    worker.signals.finished.disconnect()
+    worker.run()
+    manager.on_task_finished(worker)
+
+def get_running_tasks(manager):
+    return sorted(task_id for task_id, _ in manager.running_workers.values())
+
+# process object with a prepare step and a render step, like TimeSeriesPlots.prepare_figures / render_prepared_figures
+class Plots(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def prepare(self, output_folder, plot_type, cancel_token=None):
+        self.calls.append(('prepare', output_folder, plot_type))
+        check_cancelled(cancel_token)
+        if self.fail:
+            raise Exception('could not prepare')
+        return {'output_folder': output_folder, 'cells': [0, 2]}
+
+    def render(self, prepared, plot_type, scale=1, cancel_token=None):
+        self.calls.append(('render', prepared, plot_type, scale))
+        return len(prepared['cells']) * scale
+
+    def summarize(self, rendered, label=''):
+        self.calls.append(('summarize', rendered, label))
+        return f'{label}{rendered}'
+
+
+def test_task_result_is_passed_from_prepare_to_render():
+    manager = get_task_manager()
+    plots = Plots()
+    manager.set_process_object(plots)
+    prepare_task = manager.add_task('prepare', 'plots', 'heatmap')
+    render_task = manager.add_graph_task('render', (TaskResult(prepare_task), 'heatmap'), {'scale': 3},
+                                         resource=FIGURE_RESOURCE)
+    summary_task = manager.add_graph_task('summarize', (), {'rendered': TaskResult(render_task), 'label': 'cells: '})
+    # dependencies come from the TaskResult arguments
+    assert manager.tasks[render_task]['depends_on'] == {prepare_task}
+    assert manager.tasks[summary_task]['depends_on'] == {render_task}
+
+    manager.start_tasks()
+    assert get_running_tasks(manager) == [prepare_task]
+    run_next(manager)
+    assert get_running_tasks(manager) == [render_task]
+    assert manager.results[prepare_task] == {'output_folder': 'plots', 'cells': [0, 2]}
+    run_next(manager)
+    run_next(manager)
+    assert plots.calls == [('prepare', 'plots', 'heatmap'),
+                           ('render', {'output_folder': 'plots', 'cells': [0, 2]}, 'heatmap', 3),
+                           ('summarize', 6, 'cells: ')]
+    assert manager.finished_states == {prepare_task: 'done', render_task: 'done', summary_task: 'done'}
+    assert manager.completed == [True]
+    assert (not manager.is_running) & (len(manager.tasks) == 0) & (len(manager.results) == 0)
+
+def test_failed_dependency_skips_its_dependents():
+    manager = get_task_manager()
+    failing_plots = Plots(fail=True)
+    other_plots = Plots()
+    prepare_task = manager.add_graph_task('prepare', ('plots', 'heatmap'), process_object=failing_plots)
+    render_task = manager.add_graph_task('render', (TaskResult(prepare_task), 'heatmap'), process_object=failing_plots,
+                                         resource=FIGURE_RESOURCE)
+    summary_task = manager.add_graph_task('summarize', (TaskResult(render_task),), process_object=failing_plots)
+    # a task of another process object that does not depend on the failed one still runs
+    other_task = manager.add_graph_task('prepare', ('other', 'hd_curve'), process_object=other_plots)
+    manager.start_tasks()
+    assert get_running_tasks(manager) == sorted([prepare_task, other_task])
+    run_next(manager, prepare_task)
+    assert manager.finished_states == {prepare_task: 'failed', render_task: 'skipped', summary_task: 'skipped'}
+    assert failing_plots.calls == [('prepare', 'plots', 'heatmap')]
+    assert manager.completed == []
+    run_next(manager, other_task)
+    assert manager.finished_states[other_task] == 'done'
+    assert manager.completed == [True]
+
+def test_cancelled_task_skips_its_dependents():
+    manager = get_task_manager()
+    plots = Plots()
+    manager.set_process_object(plots)
+    cancel_token = CancellationToken()
+    prepare_task = manager.add_task('prepare', 'plots', 'heatmap', cancel_token=cancel_token)
+    render_task = manager.add_graph_task('render', (TaskResult(prepare_task), 'heatmap'), {'cancel_token': cancel_token})
+    manager.start_tasks()
+    # quit_tasks cancels the token of the running task and skips the tasks that have not started
+    manager.quit_tasks()
+    assert cancel_token.is_cancelled()
+    assert manager.finished_states == {render_task: 'skipped'}
+    run_next(manager)
+    # the token stopped prepare, and render never ran
+    assert plots.calls == [('prepare', 'plots', 'heatmap')]
+    assert manager.finished_states == {render_task: 'skipped', prepare_task: 'cancelled'}
+    assert manager.completed == [True]
+
+def test_figure_resource_runs_one_figure_task_at_a_time():
+    manager = get_task_manager(max_concurrent_tasks=3)
+    timeseries_plots = Plots()
+    longitudinal_plots = Plots()
+    timeseries_prepare = manager.add_graph_task('prepare', ('timeseries', 'heatmap'), process_object=timeseries_plots)
+    longitudinal_prepare = manager.add_graph_task('prepare', ('longitudinal', 'hd_curve'), process_object=longitudinal_plots)
+    timeseries_render = manager.add_graph_task('render', (TaskResult(timeseries_prepare), 'heatmap'),
+                                               process_object=timeseries_plots, resource=FIGURE_RESOURCE)
+    longitudinal_render = manager.add_graph_task('render', (TaskResult(longitudinal_prepare), 'hd_curve'),
+                                                 process_object=longitudinal_plots, resource=FIGURE_RESOURCE)
+    manager.start_tasks()
+    # both prepare tasks run together
+    assert get_running_tasks(manager) == sorted([timeseries_prepare, longitudinal_prepare])
+    run_next(manager, timeseries_prepare)
+    run_next(manager, longitudinal_prepare)
+    # both renders are ready, but only one draws figures at a time even though a thread is free
+    assert get_running_tasks(manager) == [timeseries_render]
+    assert manager.tasks[longitudinal_render]['state'] == 'waiting'
+    # a task without the resource starts next to the running figure task
+    summary_task = manager.add_graph_task('summarize', (1,), process_object=timeseries_plots)
+    manager.start_tasks()
+    assert get_running_tasks(manager) == sorted([timeseries_render, summary_task])
+    run_next(manager, timeseries_render)
+    assert get_running_tasks(manager) == sorted([longitudinal_render, summary_task])
+    run_next(manager, longitudinal_render)
+    run_next(manager, summary_task)
+    assert all(state == 'done' for state in manager.finished_states.values())
+    assert len(manager.finished_states) == 5
+    assert manager.completed == [True]
+
+def test_max_concurrent_tasks_and_unknown_dependencies():
+    manager = get_task_manager(max_concurrent_tasks=1)
+    first_task = manager.add_graph_task('summarize', (1,), process_object=Plots())
+    second_task = manager.add_graph_task('summarize', (2,), process_object=Plots())
+    manager.start_tasks()
+    assert get_running_tasks(manager) == [first_task]
+    run_next(manager)
+    assert get_running_tasks(manager) == [second_task]
+    with pytest.raises(ValueError):
+        manager.add_graph_task('render', (TaskResult('not_a_task'), 'heatmap'))
+    with pytest.raises(ValueError):
+        manager.add_graph_task('summarize', (3,), task_id=second_task)
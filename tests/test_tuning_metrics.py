@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from src.plotting.session_geometry import SessionGeometry
+from src.plotting.ratemaps import compute_ratemaps
+from src.plotting.tuning_metrics import get_session_metrics, get_metrics_table
+
+FRAMERATE = 30
+ARENA = [60, 60]
+NUM_FRAMES = 6000
+
+# tracking of an animal walking around the arena and turning its head -> the ears are on either side of the head, so the
+# head direction follows a random walk over every angle
+def get_turning_tracking_data(num_frames, seed):
+    rng = np.random.default_rng(seed)
+    head = np.clip(300 + np.cumsum(rng.normal(0, 5, size=(num_frames, 2)), axis=0), 20, 580)
+    head_direction = np.cumsum(rng.normal(0, 0.3, size=num_frames))
+    columns = {}
+    for part, side in [('Left Ear', -1), ('Right Ear', 1)]:
+        columns[(part, 'x')] = head[:, 0] + side * 8 * np.cos(head_direction)
+        columns[(part, 'y')] = head[:, 1] + side * 8 * np.sin(head_direction)
+        columns[(part, 'likelihood')] = np.ones(num_frames)
+    return pd.DataFrame(columns)
+
+def get_geometry(timestamps=None):
+    timestamps = np.arange(NUM_FRAMES) / FRAMERATE if timestamps is None else timestamps
+    return SessionGeometry(get_turning_tracking_data(NUM_FRAMES, 0), timestamps, FRAMERATE, ARENA)
+
+# a cell firing only while the head points into one 12 degree HD bin (96 - 108 degrees)
+def test_hd_cell_has_long_mean_vector_at_its_direction():
+    geometry = get_geometry()
+    hd_cell = ((geometry.angles >= 96) & (geometry.angles < 108)).astype(np.uint16)
+    assert hd_cell.sum() > 100
+    metrics = get_session_metrics(geometry, hd_cell[np.newaxis])
+    assert metrics['hd_mean_vector_length'][0] > 0.95
+    np.testing.assert_allclose(metrics['hd_preferred_direction'][0], 102., atol=1.)
+
+# a cell firing on every frame has the same rate in every bin -> no spatial information, unlike a cell firing in one place
+def test_uniform_cell_has_no_spatial_information():
+    geometry = get_geometry()
+    uniform_cell = np.ones(len(geometry), dtype=np.uint16)
+    place_cell = (((geometry.head_x - 20) ** 2 + (geometry.head_y - 40) ** 2) < 36).astype(np.uint16)
+    spike_trains = np.stack([uniform_cell, place_cell])
+    metrics = get_session_metrics(geometry, spike_trains)
+    # smoothing fills the bins past the arena edges with 0, so the smoothed uniform heatmap is only nearly flat
+    assert metrics['spatial_information'][0] < 0.05
+    assert metrics['spatial_information'][1] > 1.
+    assert metrics['hd_mean_vector_length'][0] < 1e-6
+    with np.errstate(invalid='ignore', divide='ignore'):
+        raw_heatmaps = compute_ratemaps(geometry, spike_trains, kind='heatmap')
+    raw_metrics = get_session_metrics(geometry, spike_trains, {'heatmap': raw_heatmaps})
+    np.testing.assert_allclose(raw_metrics['spatial_information'][0], 0., atol=1e-9)
+
+# events are counted with the frames holding more than one event, over frames that are not evenly spaced
+def test_num_events_and_mean_rate_match_spike_counts():
+    rng = np.random.default_rng(1)
+    timestamps = np.cumsum(rng.uniform(0.5, 1.5, size=NUM_FRAMES)) / FRAMERATE
+    geometry = get_geometry(timestamps)
+    spike_trains = (rng.random((5, NUM_FRAMES)) < 0.05) * rng.integers(1, 4, size=(5, NUM_FRAMES))
+    spike_trains[3] = 0
+    metrics = get_session_metrics(geometry, spike_trains)
+    # the last frame of a session is not used
+    num_events = spike_trains[:, :len(geometry)].sum(axis=1)
+    np.testing.assert_array_equal(metrics['num_events'], num_events)
+    np.testing.assert_allclose(metrics['mean_rate'], num_events / (timestamps[len(geometry)] - timestamps[0]))
+    assert metrics['mean_rate'][3] == 0
+
+    table = get_metrics_table(np.array([f' C{cell:03d}' for cell in range(5)]), [metrics, metrics])
+    assert list(table['cell'][:5]) == ['C000', 'C001', 'C002', 'C003', 'C004']
+    assert list(table['session'].unique()) == [1, 2]
+    np.testing.assert_array_equal(table['num_events'], np.concatenate([num_events, num_events]))